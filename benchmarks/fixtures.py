@@ -0,0 +1,124 @@
+"""
+Deterministic generators for benchmark fixtures.  Each fixture is generated
+from a fixed seed, so every run (and every machine) benchmarks the same
+data, and is cached in the fixture directory once generated.
+
+"""
+import os
+import random
+import binascii
+from xml.sax.saxutils import quoteattr
+from libsheep.protocol import escape
+from libsheep.utils import b32encode
+
+SEED = 80
+EXTENSIONS = ['mp3', 'flac', 'avi', 'mkv', 'iso', 'txt', 'jpg', 'zip']
+WORDS = ['sheep', 'direct', 'connect', 'hub', 'client', 'tiger', 'tree',
+         'hash', 'album', 'live', 'remix', 'season', 'episode', u'caf\xe9',
+         u'\u65e5\u672c', 'disc', 'bonus', 'demo', 'final', 'draft']
+
+def random_name(rng, words=3):
+    return u' '.join(rng.choice(WORDS) for i in xrange(words))
+
+def random_bytes(rng, length):
+    if not length:
+        return ''
+    return binascii.unhexlify('%0*x' % (length * 2,
+                                        rng.getrandbits(length * 8)))
+
+def cached(directory, filename, generate, *args):
+    """
+    Return the path of `filename` in `directory`, calling
+    `generate(path, *args)` to create it if it does not exist yet.
+
+    """
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = path + '.tmp'
+        generate(temporary, *args)
+        os.rename(temporary, path)
+    return path
+
+def write_listing(path, entries, files_per_directory=20, fanout=8):
+    """
+    Write an XML file listing with about `entries` files and directories,
+    nested so that each directory has `fanout` subdirectories (until the
+    entry budget is spent) and `files_per_directory` files.
+
+    """
+    rng = random.Random(SEED)
+    with open(path, 'wb') as f:
+        f.write('<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n')
+        f.write('<FileListing Version="1" CID="%s" Base="/" '
+                'Generator="libsheep benchmarks">\n' %
+                (b32encode(random_bytes(rng, 24)),))
+        state = {'remaining': entries}
+        def write_directory(depth):
+            for i in xrange(files_per_directory):
+                if state['remaining'] <= 0:
+                    return
+                state['remaining'] -= 1
+                name = u'%s %d.%s' % (random_name(rng), i,
+                                      rng.choice(EXTENSIONS))
+                f.write((u'<File Name=%s Size="%d" TTH="%s"/>\n' % (
+                    quoteattr(name), rng.randint(0, 1 << 32),
+                    b32encode(random_bytes(rng, 24)))).encode('utf-8'))
+            if depth >= 8:
+                return
+            for i in xrange(fanout):
+                if state['remaining'] <= 0:
+                    return
+                state['remaining'] -= 1
+                name = u'%s %d' % (random_name(rng, 2), i)
+                f.write((u'<Directory Name=%s>\n' %
+                         (quoteattr(name),)).encode('utf-8'))
+                write_directory(depth + 1)
+                f.write('</Directory>\n')
+        # Add top-level directories until the entry budget is spent.
+        while state['remaining'] > 0:
+            state['remaining'] -= 1
+            f.write('<Directory Name="root %d">\n' % (state['remaining'],))
+            write_directory(0)
+            f.write('</Directory>\n')
+        f.write('</FileListing>\n')
+
+def write_random_file(path, size, chunk_size=1 << 20):
+    """Write `size` pseudo-random bytes to `path`."""
+    rng = random.Random(SEED)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            chunk = min(chunk_size, remaining)
+            f.write(random_bytes(rng, chunk))
+            remaining -= chunk
+
+def write_hub_traffic(path, lines, search_ratio=0.5):
+    """
+    Write `lines` lines of recorded-style hub traffic: `BINF` lines for
+    users joining and `BSCH` searches, in the proportion `search_ratio`.
+
+    """
+    rng = random.Random(SEED)
+    sids = [b32encode(random_bytes(rng, 3))[:4] for i in xrange(512)]
+    with open(path, 'wb') as f:
+        for i in xrange(lines):
+            sid = rng.choice(sids)
+            if rng.random() < search_ratio:
+                tokens = ['BSCH', sid]
+                for word in random_name(rng, rng.randint(1, 3)).split():
+                    tokens.append(u'AN' + escape(word))
+                if rng.random() < 0.3:
+                    tokens.append('GE%d' % (rng.randint(0, 1 << 30),))
+                tokens.append('TO%d' % (rng.getrandbits(32),))
+            else:
+                tokens = ['BINF', sid,
+                          'ID' + b32encode(random_bytes(rng, 24)),
+                          'PD' + b32encode(random_bytes(rng, 24)),
+                          u'NI' + escape(random_name(rng, 2)),
+                          'SS%d' % (rng.getrandbits(40),),
+                          'SF%d' % (rng.randint(0, 100000),),
+                          'VEsheep\\s0.1', 'SL%d' % (rng.randint(1, 10),),
+                          'SUADC0,TCP4']
+            f.write((u' '.join(tokens) + u'\n').encode('utf-8'))
@@ -0,0 +1,139 @@
+"""
+A small benchmark harness in the style of pyperf: each benchmark is run for
+a number of warmup and measured samples, each sample timing enough loops to
+last at least `min_time` seconds, and the results can be written to and
+compared against JSON files.
+
+"""
+import sys
+import json
+import math
+import time
+import platform
+import subprocess
+from timeit import default_timer
+
+class Runner(object):
+    def __init__(self, samples=5, warmups=1, min_time=0.1, name_filter=None,
+                 verbose=False):
+        self.samples = samples
+        self.warmups = warmups
+        self.min_time = min_time
+        self.name_filter = name_filter
+        self.verbose = verbose
+        self.results = {}
+
+    def wanted(self, name):
+        return self.name_filter is None or self.name_filter in name
+
+    def bench(self, name, func, loops=None):
+        """
+        Time `func`, a callable taking no arguments, and record the time per
+        call under `name`.  If `loops` is not given, it is calibrated so
+        that each sample takes at least `min_time` seconds.
+
+        """
+        if not self.wanted(name):
+            return None
+        if loops is None:
+            loops = self._calibrate(func)
+        for i in xrange(self.warmups):
+            self._sample(func, loops)
+        samples = [self._sample(func, loops) for i in xrange(self.samples)]
+        result = summarize(samples)
+        result['loops'] = loops
+        self.results[name] = result
+        self._report(name, result)
+        return result
+
+    def skip(self, name, reason):
+        if self.wanted(name):
+            self.results[name] = {'skipped': reason}
+            print '%-40s skipped: %s' % (name, reason)
+
+    def _calibrate(self, func):
+        loops = 1
+        while True:
+            elapsed = self._sample(func, loops) * loops
+            if elapsed >= self.min_time or loops >= 1 << 20:
+                return loops
+            if elapsed <= 0:
+                loops *= 10
+            else:
+                loops = max(loops * 2, int(loops * self.min_time / elapsed))
+
+    def _sample(self, func, loops):
+        start = default_timer()
+        for i in xrange(loops):
+            func()
+        return (default_timer() - start) / loops
+
+    def _report(self, name, result):
+        print '%-40s %s +- %s' % (name, format_time(result['mean']),
+                                  format_time(result['stdev']))
+        if self.verbose:
+            print '    samples: %s' % ', '.join(map(format_time,
+                                                   result['samples']))
+
+    def dump(self, filename, metadata=None):
+        data = {'metadata': metadata or collect_metadata(),
+                'benchmarks': self.results}
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+def summarize(samples):
+    mean = sum(samples) / len(samples)
+    if len(samples) > 1:
+        variance = (sum((sample - mean) ** 2 for sample in samples) /
+                    (len(samples) - 1))
+    else:
+        variance = 0.0
+    return {'samples': samples, 'mean': mean, 'stdev': math.sqrt(variance),
+            'min': min(samples), 'unit': 'second'}
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.3g %s' % (seconds / scale, unit)
+    return '%.3g ns' % (seconds / 1e-9)
+
+def collect_metadata():
+    metadata = {'python': sys.version.split()[0],
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    try:
+        revision = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE).communicate()[0]
+    except OSError:
+        revision = ''
+    if revision.strip():
+        metadata['revision'] = revision.strip()
+    return metadata
+
+def compare(base_filename, results, threshold=0.05):
+    """
+    Print how each benchmark in `results` changed relative to the results
+    stored in `base_filename`.  Changes smaller than `threshold` (a
+    fraction of the base time) or within the combined standard deviations
+    are reported as insignificant.
+
+    """
+    with open(base_filename) as f:
+        base = json.load(f)['benchmarks']
+    for name in sorted(results):
+        new = results[name]
+        old = base.get(name)
+        if old is None or 'mean' not in old or 'mean' not in new:
+            continue
+        ratio = new['mean'] / old['mean']
+        noise = (old['stdev'] + new['stdev']) / old['mean']
+        if abs(ratio - 1) < max(threshold, noise):
+            verdict = 'not significant'
+        elif ratio < 1:
+            verdict = '%.2fx faster' % (1 / ratio,)
+        else:
+            verdict = '%.2fx slower' % (ratio,)
+        print '%-40s %s -> %s: %s' % (name, format_time(old['mean']),
+                                      format_time(new['mean']), verdict)
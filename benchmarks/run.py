@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Run the libsheep benchmark suite.
+
+Fixtures are generated deterministically on the first run and cached in the
+fixture directory.  Write the results to a JSON file with --output and
+compare a later run against it with --compare:
+
+    $ python benchmarks/run.py --output before.json
+    $ python benchmarks/run.py --compare before.json
+
+"""
+import os
+import sys
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libsheep.path import Path
+from libsheep.filelist import FileListing
+from libsheep.protocol import Message
+import libsheep.features.base
+from harness import Runner, compare
+import fixtures
+
+DEFAULT_FIXTURES = os.path.join(tempfile.gettempdir(), 'libsheep-benchmarks')
+
+def bench_path(runner, options):
+    names = [u'/share/%s/%s %d.mp3' % (fixtures.WORDS[i % 20],
+                                       fixtures.WORDS[(i * 7) % 20], i)
+             for i in xrange(1000)]
+    def parse():
+        for name in names:
+            Path(name)
+    runner.bench('path.parse_1000', parse)
+    paths = [Path(name) for name in names]
+    base = Path(u'/share/')
+    def relative():
+        for path in paths:
+            path.relative_to(base)
+    runner.bench('path.relative_to_1000', relative)
+
+def bench_filelist(runner, options):
+    if not any(runner.wanted(name) for name in ('filelist.load',
+                                                 'filelist.serialize',
+                                                 'filelist.iter_xml',
+                                                 'filelist.add_10000')):
+        return
+    filename = fixtures.cached(options.fixtures,
+                               'files-%d.xml' % (options.entries,),
+                               fixtures.write_listing, options.entries)
+    # Loading a large listing takes seconds, so time single loops.
+    runner.bench('filelist.load', lambda: FileListing.from_file(filename),
+                 loops=1)
+    listing = FileListing.from_file(filename)
+    runner.bench('filelist.serialize', listing.serialize, loops=1)
+    runner.bench('filelist.iter_xml',
+                 lambda: ''.join(listing.iter_xml()), loops=1)
+    paths = [u'dir %d/sub %d/file %d.txt' % (i % 100, i % 7, i)
+             for i in xrange(10000)]
+    def add():
+        target = FileListing('cid', '/')
+        for path in paths:
+            target.add(path, size=1)
+    runner.bench('filelist.add_10000', add)
+
+def bench_tth(runner, options):
+    try:
+        from libsheep.tth import TigerTreeHash
+    except ImportError, e:
+        runner.skip('tth.hash_file', str(e))
+        return
+    filename = fixtures.cached(options.fixtures,
+                               'random-%d.bin' % (options.hash_size,),
+                               fixtures.write_random_file, options.hash_size)
+    def hash_file():
+        with open(filename, 'rb') as f:
+            TigerTreeHash(f)
+    result = runner.bench('tth.hash_file', hash_file, loops=1)
+    if result is not None:
+        result['bytes_per_second'] = options.hash_size / result['mean']
+
+def bench_protocol(runner, options):
+    filename = fixtures.cached(options.fixtures,
+                               'hub-%d.txt' % (options.lines,),
+                               fixtures.write_hub_traffic, options.lines)
+    with open(filename, 'rb') as f:
+        lines = [line.decode('utf-8') for line in f]
+    def decode():
+        for line in lines:
+            Message.decode(line)
+    runner.bench('protocol.decode', decode)
+    messages = [Message.decode(line) for line in lines[:1000]]
+    def encode():
+        for message in messages:
+            message.encode()
+    runner.bench('protocol.encode_1000', encode)
+
+BENCHMARKS = [bench_path, bench_filelist, bench_tth, bench_protocol]
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', help="write results to a JSON file")
+    parser.add_option('-c', '--compare', metavar='FILE',
+                      help="compare results with a previous JSON file")
+    parser.add_option('-b', '--benchmark', dest='name_filter',
+                      help="only run benchmarks whose names contain this")
+    parser.add_option('--fixtures', default=DEFAULT_FIXTURES,
+                      help="directory for generated fixtures [%default]")
+    parser.add_option('--entries', type='int', default=1000000,
+                      help="entries in the file list fixture [%default]")
+    parser.add_option('--hash-size', type='int', default=64 << 20,
+                      help="bytes in the hashing fixture [%default]")
+    parser.add_option('--lines', type='int', default=100000,
+                      help="lines in the hub traffic fixture [%default]")
+    parser.add_option('-n', '--samples', type='int', default=5)
+    parser.add_option('-w', '--warmups', type='int', default=1)
+    parser.add_option('--quick', action='store_true',
+                      help="use small fixtures and few samples")
+    parser.add_option('-v', '--verbose', action='store_true')
+    options, args = parser.parse_args(argv)
+    if options.quick:
+        options.entries = min(options.entries, 10000)
+        options.hash_size = min(options.hash_size, 1 << 20)
+        options.lines = min(options.lines, 10000)
+        options.samples = min(options.samples, 3)
+    runner = Runner(options.samples, options.warmups,
+                    name_filter=options.name_filter, verbose=options.verbose)
+    for benchmark in BENCHMARKS:
+        benchmark(runner, options)
+    if options.output:
+        runner.dump(options.output)
+    if options.compare:
+        compare(options.compare, runner.results)
+
+if __name__ == '__main__':
+    main()
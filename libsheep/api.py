@@ -26,7 +26,8 @@ class API(object):
         pass
 
     def rehash(self):
-        pass
+        self.state.scanner.scan()
+        self.state.scanner.hash_pending()
 
     def info_update(self):
         pass
@@ -0,0 +1,228 @@
+"""
+Module for limiting and measuring transfer bandwidth.
+
+A `Scheduler` holds a hierarchy of token buckets: one for all traffic, one
+per direction (upload and download), one per hub and one per peer.  Each
+`Transfer` draws from every bucket above it, so it runs at the speed of its
+tightest limit.  Transfers take tokens a quantum at a time, and a bucket
+that runs dry makes each taker wait its turn in the order it asked, so all
+active transfers sharing a bucket get an equal share of it.
+
+The scheduler also measures the throughput of each direction, which is used
+to grant extra upload slots as described by the `AS` (auto slot speed) and
+`AM` (auto slot maximum) fields of `INF`.
+
+"""
+import time
+import logging
+import threading
+import weakref
+
+log = logging.getLogger(__name__)
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+
+# The number of bytes a transfer takes from its buckets at a time.
+QUANTUM = 64 * 1024
+
+class TokenBucket(object):
+    """
+    A bucket filling with `rate` tokens (bytes) per second, up to `burst`
+    tokens (by default, one second's worth).  A `rate` of None means
+    unlimited.
+
+    """
+    def __init__(self, rate=None, burst=None, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self.rate = rate
+            self.burst = burst or rate
+            self.tokens = self.burst
+            self.updated = self.clock()
+
+    def reserve(self, count):
+        """
+        Take `count` tokens and return the number of seconds to wait before
+        using them.  The bucket may go into debt, which later callers wait
+        for in turn.
+
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / float(self.rate)
+
+class Meter(object):
+    """
+    Measures a rate in bytes per second as an exponentially weighted moving
+    average of the rate over each `interval`, with the given `half_life`
+    (both in seconds).
+
+    """
+    def __init__(self, interval=1.0, half_life=5.0, clock=time.time):
+        self.interval = interval
+        self.half_life = half_life
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._rate = 0.0
+        self._count = 0
+        self._start = clock()
+
+    def add(self, count):
+        with self._lock:
+            self._roll(self.clock())
+            self._count += count
+
+    @property
+    def rate(self):
+        with self._lock:
+            self._roll(self.clock())
+            return self._rate
+
+    def _roll(self, now):
+        elapsed = now - self._start
+        if elapsed >= self.interval:
+            sample = self._count / elapsed
+            weight = 1 - 0.5 ** (elapsed / self.half_life)
+            self._rate += (sample - self._rate) * weight
+            self._count = 0
+            self._start = now
+
+class Transfer(object):
+    """A transfer limited by each of the token `buckets`."""
+
+    def __init__(self, scheduler, direction, buckets):
+        self.scheduler = scheduler
+        self.direction = direction
+        self.buckets = buckets
+        self.meter = scheduler.meters[direction]
+        self.transferred = 0
+
+    def throttle(self, count):
+        """Wait until `count` bytes may be transferred, and count them."""
+        delay = 0.0
+        for bucket in self.buckets:
+            delay = max(delay, bucket.reserve(count))
+        if delay > 0:
+            self.scheduler.sleep(delay)
+        self.meter.add(count)
+        self.transferred += count
+
+    def chunks(self, count):
+        """
+        Yield the sizes of the chunks in which to transfer `count` bytes,
+        waiting for each to be allowed before yielding it.
+
+        """
+        quantum = self.scheduler.quantum
+        while count > 0:
+            size = min(quantum, count)
+            self.throttle(size)
+            yield size
+            count -= size
+
+class Scheduler(object):
+    """
+    Bandwidth limits (in bytes per second, None meaning unlimited) for all
+    traffic, for each direction, and, through `set_hub_rate`,
+    `set_peer_rate`, `hub_rate` and `peer_rate`, for each hub and peer.
+
+    """
+    def __init__(self, upload_rate=None, download_rate=None, total_rate=None,
+                 quantum=QUANTUM, clock=time.time, sleep=time.sleep):
+        self.quantum = quantum
+        self.clock = clock
+        self.sleep = sleep
+        self.total = TokenBucket(total_rate, clock=clock)
+        self.directions = {UPLOAD: TokenBucket(upload_rate, clock=clock),
+                           DOWNLOAD: TokenBucket(download_rate, clock=clock)}
+        self.meters = {UPLOAD: Meter(clock=clock),
+                       DOWNLOAD: Meter(clock=clock)}
+        # Default limits for hubs and peers without a limit of their own.
+        self.hub_rate = None
+        self.peer_rate = None
+        self._hub_rates = {}
+        self._peer_rates = {}
+        # Buckets only live as long as the transfers using them.
+        self._hubs = weakref.WeakValueDictionary()
+        self._peers = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_info(cls, info, **kwargs):
+        """
+        Create a scheduler honoring the upload and download speeds
+        advertised by the `INF` command `info`.
+
+        """
+        return cls(info.upload_speed, info.download_speed, **kwargs)
+
+    def set_hub_rate(self, hub, rate):
+        self._set_rate(self._hub_rates, self._hubs, hub, rate)
+
+    def set_peer_rate(self, peer, rate):
+        self._set_rate(self._peer_rates, self._peers, peer, rate)
+
+    def _set_rate(self, rates, buckets, key, rate):
+        with self._lock:
+            rates[key] = rate
+            bucket = buckets.get(key)
+        if bucket is not None:
+            bucket.set_rate(rate)
+
+    def _bucket(self, rates, buckets, key, default):
+        with self._lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rates.get(key, default),
+                                     clock=self.clock)
+                buckets[key] = bucket
+            return bucket
+
+    def transfer(self, direction, hub=None, peer=None):
+        """
+        Return a `Transfer` in `direction` (`UPLOAD` or `DOWNLOAD`) with the
+        given `hub` and `peer`, which are any hashable keys, or None.
+
+        """
+        buckets = [self.total, self.directions[direction]]
+        if hub is not None:
+            buckets.append(self._bucket(self._hub_rates, self._hubs, hub,
+                                        self.hub_rate))
+        if peer is not None:
+            buckets.append(self._bucket(self._peer_rates, self._peers, peer,
+                                        self.peer_rate))
+        return Transfer(self, direction, buckets)
+
+    def rate(self, direction):
+        """Return the measured throughput in `direction`."""
+        return self.meters[direction].rate
+
+    def grant_slot(self, active, slots=None, auto_slot_speed=None,
+                   auto_slot_max=None):
+        """
+        Return True if another upload may start while `active` uploads are
+        running, given the number of `slots`.  When the slots are full, an
+        extra slot is granted as long as the measured upload speed is below
+        `auto_slot_speed` and fewer than `auto_slot_max` uploads run.
+
+        """
+        if slots is None or active < slots:
+            return True
+        if not auto_slot_speed:
+            return False
+        if auto_slot_max is not None and active >= auto_slot_max:
+            return False
+        return self.rate(UPLOAD) < auto_slot_speed
@@ -0,0 +1,140 @@
+"""
+Module for browsing another client's share without downloading its whole
+file list.  `RemoteBrowser` fetches a partial list of the top-level
+directory, and each incomplete directory in it fetches its own contents the
+first time they are accessed, so the work done is proportional to the number
+of directories actually visited.
+
+Expanded directories are kept in a bounded least-recently-used set; when it
+overflows, the oldest are collapsed back into incomplete stubs and will be
+fetched again if they are visited again.
+
+"""
+import logging
+from collections import OrderedDict
+from libsheep.filelist import FileListing, Directory, Container
+from libsheep.path import Path
+
+log = logging.getLogger(__name__)
+
+class LazyDirectory(Directory):
+    """
+    A `Directory` whose contents are fetched by `browser` when they are
+    first accessed while the directory is incomplete.
+
+    """
+    browser = None
+    path = None
+
+    def _get_contents(self):
+        if self.browser is not None:
+            if self.incomplete:
+                self.browser.expand(self)
+            else:
+                self.browser.touch(self)
+        return self._contents
+
+    def _set_contents(self, contents):
+        self._contents = contents
+
+    def _known_contents(self):
+        # Statistics must not fetch stubs, which could also collapse
+        # directories whose statistics are being computed.
+        return self._contents
+
+    contents = property(_get_contents, _set_contents)
+
+class RemoteBrowser(object):
+    """
+    Browse a share using `fetcher`, a callable that takes the absolute
+    `Path` of a directory and returns a partial `FileListing` based at that
+    directory (typically the parsed response to `GET list`).  At most
+    `max_expanded` fetched directories are kept in memory.
+
+    """
+    def __init__(self, fetcher, max_expanded=256):
+        self.fetcher = fetcher
+        self.max_expanded = max_expanded
+        self.listing = None
+        self._expanded = OrderedDict()
+
+    def open(self, base='/'):
+        """Fetch the directory `base` and return it as a `FileListing`."""
+        listing = self.fetcher(Path(base))
+        self._adopt(listing, listing.contents, listing.base)
+        self.listing = listing
+        return listing
+
+    def expand(self, directory):
+        """Fetch the contents of the incomplete `directory`."""
+        log.debug("Fetching %r...", directory.path)
+        partial = self.fetcher(directory.path)
+        contents = partial.contents
+        self._adopt(directory, contents, directory.path)
+        directory._contents = contents
+        directory.incomplete = False
+        directory.invalidate()
+        self._expanded[id(directory)] = directory
+        self._evict(directory)
+
+    def collapse(self, directory):
+        """Discard the contents of `directory`, making it a stub again."""
+        self._expanded.pop(id(directory), None)
+        directory._contents = {}
+        directory.incomplete = True
+        directory.invalidate()
+        # Expanded descendants are no longer reachable.
+        for key, other in self._expanded.items():
+            if directory.path.is_ancestor(other.path):
+                del self._expanded[key]
+
+    def touch(self, directory):
+        """Mark the expanded `directory` as recently used."""
+        key = id(directory)
+        if key in self._expanded:
+            self._expanded[key] = self._expanded.pop(key)
+
+    def _evict(self, keep):
+        # Never collapse an ancestor of the directory just expanded, since
+        # that would detach it from the tree.
+        for key, directory in self._expanded.items():
+            if len(self._expanded) <= self.max_expanded:
+                break
+            if key not in self._expanded:
+                # Already collapsed along with an ancestor.
+                continue
+            if not directory.path.is_ancestor(keep.path):
+                self.collapse(directory)
+
+    def _adopt(self, owner, contents, path):
+        """
+        Replace the directories in `contents`, which belong to the container
+        `owner`, (recursively) with `LazyDirectory` instances bound to this
+        browser.
+
+        """
+        stack = [(owner, contents, path)]
+        while stack:
+            owner, contents, path = stack.pop()
+            for name, item in contents.items():
+                if isinstance(item, Container):
+                    directory = LazyDirectory(name, item.incomplete)
+                    directory.parent = owner
+                    directory.browser = self
+                    directory.path = path.join(Path([name, '']))
+                    directory._contents = item.contents
+                    contents[name] = directory
+                    stack.append((directory, directory._contents,
+                                  directory.path))
+
+def listing_fetcher(listing):
+    """
+    Return a fetcher that reads one level at a time from the local
+    `FileListing` instance `listing`, the same way a remote client would
+    serve `GET list` requests.
+
+    """
+    def fetch(path):
+        xml = ''.join(listing.iter_xml(path, 1))
+        return FileListing.from_string(xml)
+    return fetch
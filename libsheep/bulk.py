@@ -0,0 +1,70 @@
+"""
+Module for loading many file lists at once.  Parsing XML is CPU-bound, so
+`load_many` parses lists in a pool of worker processes.  Each worker returns
+its listing in the packed binary format (see `libsheep.packed`), which is a
+single string and therefore cheap to send back, and the parent wraps it in a
+`PackedListing` instead of rebuilding the tree object by object.
+
+"""
+import logging
+import multiprocessing
+from collections import deque
+from libsheep.filelist import FileListing
+from libsheep.packed import PackedListing, pack
+
+log = logging.getLogger(__name__)
+
+def parse_packed(filename):
+    """
+    Parse the file list in `filename` (which may be bzip2 compressed) and
+    return a `(data, error)` tuple, where `data` is the packed listing or
+    None, and `error` describes why the list could not be parsed.
+
+    """
+    try:
+        return (pack(FileListing.from_file(filename)), None)
+    except Exception as e:
+        return (None, '%s: %s' % (e.__class__.__name__, e))
+
+def load_many(filenames, processes=None, max_pending=None):
+    """
+    Parse the file lists named in `filenames` using `processes` worker
+    processes (by default, one per CPU), and yield a `(filename, listing)`
+    tuple for each, in order, where `listing` is a `PackedListing`.  Lists
+    that fail to parse are logged and yielded with a `listing` of None.
+
+    No more than `max_pending` lists (by default, twice the number of
+    processes) are parsed or waiting to be consumed at any time, which
+    bounds the memory used when the consumer is slower than the workers.
+
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if max_pending is None:
+        max_pending = processes * 2
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = deque()
+        filenames = iter(filenames)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    filename = filenames.next()
+                except StopIteration:
+                    exhausted = True
+                else:
+                    result = pool.apply_async(parse_packed, (filename,))
+                    pending.append((filename, result))
+            if not pending:
+                break
+            filename, result = pending.popleft()
+            data, error = result.get()
+            if error is not None:
+                log.warning("Unable to load %r: %s", filename, error)
+                yield (filename, None)
+            else:
+                yield (filename, PackedListing(data))
+    finally:
+        pool.terminate()
+        pool.join()
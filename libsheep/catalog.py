@@ -0,0 +1,288 @@
+"""
+Module for keeping track of which files are available from which clients.
+A `Catalog` ingests the file listings of many clients and answers "who has
+this TTH" and "what does this client have that nobody else does".
+
+The catalog is designed to stay small with thousands of listings:
+
+    * Directory paths and file names are interned in `StringTable`s, so
+      each distinct string is stored once no matter how many files or
+      clients share it.  Strings are freed when the last file using them
+      is removed.
+    * Each client's files are stored as three parallel arrays of integers
+      (TTH, directory and name IDs) rather than as objects.
+    * For each TTH, the locations of the files with that TTH are stored as
+      a sorted array of 64-bit postings, each combining a client ID and the
+      index of the file in that client's arrays.  TTHs with a single
+      location (most of them) store a plain integer instead.
+    * The IDs of TTHs and strings that are no longer used are reused, so
+      re-ingesting listings as clients update them does not grow the
+      catalog.
+
+"""
+import bisect
+import logging
+from array import array
+from libsheep.filelist import Container
+from libsheep.packed import PackedListing
+from libsheep.path import Path
+
+log = logging.getLogger(__name__)
+
+try:
+    array('Q')
+except ValueError:
+    # Python 2 has no 'Q' type code; 'L' is 64 bits on LP64 platforms.
+    POSTING_TYPE = 'L'
+else:
+    POSTING_TYPE = 'Q'
+
+INDEX_BITS = 32
+INDEX_MASK = (1 << INDEX_BITS) - 1
+
+class StringTable(object):
+    """
+    Assigns integer IDs to distinct strings.  References to each string are
+    counted, and strings without references are freed and their IDs reused.
+
+    """
+    def __init__(self):
+        self._ids = {}
+        self._strings = []
+        self._counts = array('I')
+        self._free = []
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, string_id):
+        return self._strings[string_id]
+
+    def intern(self, string):
+        """
+        Return the ID of `string`, adding it to the table if needed, and
+        count a reference to it.
+
+        """
+        string_id = self._ids.get(string)
+        if string_id is None:
+            if self._free:
+                string_id = self._free.pop()
+                self._strings[string_id] = string
+            else:
+                string_id = len(self._strings)
+                self._strings.append(string)
+                self._counts.append(0)
+            self._ids[string] = string_id
+        self._counts[string_id] += 1
+        return string_id
+
+    def release(self, string_id):
+        """
+        Drop a reference to the string with the ID `string_id`, freeing it
+        if it has no references left.
+
+        """
+        count = self._counts[string_id] - 1
+        self._counts[string_id] = count
+        if not count:
+            del self._ids[self._strings[string_id]]
+            self._strings[string_id] = None
+            self._free.append(string_id)
+
+class _ClientFiles(object):
+    __slots__ = ('client_id', 'tths', 'directories', 'names')
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.tths = array('I')
+        self.directories = array('I')
+        self.names = array('I')
+
+def iter_files(listing):
+    """
+    Yield a `(directory, name, tth)` tuple for each file with a TTH in
+    `listing`, which is a `FileListing` or `PackedListing`.  `directory` is
+    the absolute path of the file's directory, with a trailing slash.
+
+    """
+    base = unicode(listing.base)
+    if isinstance(listing, PackedListing):
+        stack = [(listing.root, base)]
+        while stack:
+            directory, path = stack.pop()
+            for item in directory.files():
+                if item.tth is not None:
+                    yield (path, item.name, item.tth)
+            for item in directory.directories():
+                stack.append((item, path + Path.escape(item.name) + u'/'))
+    else:
+        stack = [(listing, base)]
+        while stack:
+            container, path = stack.pop()
+            for item in container.contents.itervalues():
+                if isinstance(item, Container):
+                    stack.append((item,
+                                  path + Path.escape(item.name) + u'/'))
+                else:
+                    tth = getattr(item, 'tth', None)
+                    if tth is not None:
+                        yield (path, item.name, tth)
+
+class Catalog(object):
+    def __init__(self):
+        self._client_ids = {}
+        self._clients = []
+        self._tth_ids = {}
+        self._tths = []
+        self._postings = []
+        # IDs of TTHs no longer available from any client.
+        self._free_tth_ids = []
+        self.directories = StringTable()
+        self.names = StringTable()
+
+    def __len__(self):
+        """Return the number of distinct TTHs available."""
+        return len(self._tth_ids)
+
+    def __contains__(self, tth):
+        return tth in self._tth_ids
+
+    @property
+    def client_ids(self):
+        return [files.client_id for files in self._clients
+                if files is not None]
+
+    def ingest(self, client_id, listing):
+        """
+        Add the files in `listing` (a `FileListing` or `PackedListing`) as
+        those available from the client `client_id`, replacing any listing
+        previously ingested for that client.
+
+        """
+        if client_id in self._client_ids:
+            self.remove(client_id)
+            number = self._client_ids[client_id]
+        else:
+            number = self._client_ids[client_id] = len(self._clients)
+            self._clients.append(None)
+        files = _ClientFiles(client_id)
+        for directory, name, tth in iter_files(listing):
+            tth_id = self._tth_ids.get(tth)
+            if tth_id is None:
+                tth_id = self._allocate_tth(tth)
+            index = len(files.tths)
+            files.tths.append(tth_id)
+            files.directories.append(self.directories.intern(directory))
+            files.names.append(self.names.intern(name))
+            self._add_posting(tth_id, number << INDEX_BITS | index)
+        self._clients[number] = files
+
+    def remove(self, client_id):
+        """Remove the files of the client `client_id` from the catalog."""
+        number = self._client_ids[client_id]
+        files = self._clients[number]
+        if files is None:
+            return
+        for index, tth_id in enumerate(files.tths):
+            self._remove_posting(tth_id, number << INDEX_BITS | index)
+        for directory_id in files.directories:
+            self.directories.release(directory_id)
+        for name_id in files.names:
+            self.names.release(name_id)
+        self._clients[number] = None
+
+    def _allocate_tth(self, tth):
+        if self._free_tth_ids:
+            tth_id = self._free_tth_ids.pop()
+            self._tths[tth_id] = tth
+        else:
+            tth_id = len(self._tths)
+            self._tths.append(tth)
+            self._postings.append(None)
+        self._tth_ids[tth] = tth_id
+        return tth_id
+
+    def _add_posting(self, tth_id, posting):
+        postings = self._postings[tth_id]
+        if postings is None:
+            self._postings[tth_id] = posting
+        elif isinstance(postings, array):
+            if posting > postings[-1]:
+                postings.append(posting)
+            else:
+                postings.insert(bisect.bisect(postings, posting), posting)
+        else:
+            self._postings[tth_id] = array(POSTING_TYPE,
+                                           sorted([postings, posting]))
+
+    def _remove_posting(self, tth_id, posting):
+        postings = self._postings[tth_id]
+        if isinstance(postings, array):
+            del postings[bisect.bisect_left(postings, posting)]
+            if len(postings) == 1:
+                self._postings[tth_id] = postings[0]
+        else:
+            self._postings[tth_id] = None
+            del self._tth_ids[self._tths[tth_id]]
+            self._tths[tth_id] = None
+            self._free_tth_ids.append(tth_id)
+
+    def _iter_postings(self, tth_id):
+        postings = self._postings[tth_id]
+        if isinstance(postings, array):
+            return iter(postings)
+        return iter([postings])
+
+    def _location(self, posting):
+        files = self._clients[posting >> INDEX_BITS]
+        index = posting & INDEX_MASK
+        path = (self.directories[files.directories[index]] +
+                Path.escape(self.names[files.names[index]]))
+        return (files.client_id, path)
+
+    def locations(self, tth):
+        """
+        Return a list of `(client_id, path)` tuples for the files with the
+        binary digest `tth`.
+
+        """
+        tth_id = self._tth_ids.get(tth)
+        if tth_id is None:
+            return []
+        return map(self._location, self._iter_postings(tth_id))
+
+    def who_has(self, tth):
+        """Return a list of the clients that have a file with `tth`."""
+        tth_id = self._tth_ids.get(tth)
+        if tth_id is None:
+            return []
+        clients = []
+        # Postings are sorted by client, so duplicates are adjacent.
+        last = None
+        for posting in self._iter_postings(tth_id):
+            number = posting >> INDEX_BITS
+            if number != last:
+                clients.append(self._clients[number].client_id)
+                last = number
+        return clients
+
+    def unique_to(self, client_id):
+        """
+        Yield a `(tth, path)` tuple for each file of the client `client_id`
+        that no other client has.
+
+        """
+        number = self._client_ids[client_id]
+        files = self._clients[number]
+        if files is None:
+            return
+        for index, tth_id in enumerate(files.tths):
+            postings = self._postings[tth_id]
+            if isinstance(postings, array):
+                # Sorted, so only the ends need checking.
+                if (postings[0] >> INDEX_BITS != number or
+                    postings[-1] >> INDEX_BITS != number):
+                    continue
+            posting = number << INDEX_BITS | index
+            yield (self._tths[tth_id], self._location(posting)[1])
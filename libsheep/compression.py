@@ -0,0 +1,189 @@
+"""
+Module for compressing transfers.  The ADC ZLIG extension lets a client ask
+for a transfer to be zlib-compressed by adding `ZL1` to its `GET`; these
+helpers compress and decompress such streams incrementally so that memory
+use is bounded by the block size rather than the size of the transfer.
+
+Compressing data that is already compressed wastes CPU on both ends, so
+`should_compress` skips well-known compressed formats by extension and then
+checks how well a sample of the data actually compresses.
+
+File lists are stored with bzip2.  `ParallelBZ2Writer` splits its input
+into blocks and compresses each one into a separate bzip2 stream in a
+process pool; the concatenated streams are decoded by standard bzip2 tools,
+and by `decompress_bz2_stream`, since Python 2's `bz2.BZ2File` stops after
+the first stream.
+
+"""
+import os
+import bz2
+import zlib
+import multiprocessing
+from collections import deque
+
+BLOCK_SIZE = 64 * 1024
+COMPRESSION_LEVEL = zlib.Z_DEFAULT_COMPRESSION
+
+# Bytes of input per bzip2 stream written by `ParallelBZ2Writer`, matching
+# the largest block size of bzip2 itself.
+BZ2_BLOCK_SIZE = 900 * 1000
+BZ2_COMPRESSION_LEVEL = 9
+
+# A sample must compress to less than this fraction of its size for the
+# rest of the transfer to be compressed.
+MAX_SAMPLE_RATIO = 0.9
+
+COMPRESSED_EXTENSIONS = set([
+    '.7z', '.aac', '.ape', '.avi', '.bz2', '.cab', '.docx', '.flac', '.flv',
+    '.gif', '.gz', '.jar', '.jpeg', '.jpg', '.lzma', '.m4a', '.m4v', '.mkv',
+    '.mov', '.mp3', '.mp4', '.mpeg', '.mpg', '.ogg', '.ogm', '.opus', '.png',
+    '.rar', '.tbz', '.tbz2', '.tgz', '.webm', '.webp', '.wma', '.wmv', '.xlsx',
+    '.xz', '.zip',
+])
+
+def should_compress(name, sample=None):
+    """
+    Return True if a file named `name` is worth compressing.  If `sample`
+    (usually the first block of the data) is given, it must also compress
+    reasonably well.
+
+    >>> should_compress('movie.mkv')
+    False
+    >>> should_compress('files.xml', 'Directory ' * 100)
+    True
+
+    """
+    extension = os.path.splitext(name)[1].lower()
+    if extension in COMPRESSED_EXTENSIONS:
+        return False
+    if sample:
+        compressed_size = len(zlib.compress(sample, 1))
+        return compressed_size < len(sample) * MAX_SAMPLE_RATIO
+    return True
+
+def compress_stream(blocks, level=COMPRESSION_LEVEL):
+    """
+    Compress the strings in the iterable `blocks` and yield the compressed
+    data as it becomes available.
+
+    """
+    compressor = zlib.compressobj(level)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def decompress_stream(blocks, max_length=BLOCK_SIZE):
+    """
+    Decompress the compressed strings in the iterable `blocks` and yield the
+    decompressed data in strings no longer than `max_length`, so that a
+    small, highly compressed block cannot expand into a huge string.
+
+    """
+    decompressor = zlib.decompressobj()
+    for block in blocks:
+        while block:
+            data = decompressor.decompress(block, max_length)
+            if data:
+                yield data
+            block = decompressor.unconsumed_tail
+    data = decompressor.flush()
+    if data:
+        yield data
+
+def decompress_bz2_stream(blocks):
+    """
+    Decompress the strings in the iterable `blocks`, which hold one or more
+    concatenated bzip2 streams, and yield the decompressed data.
+
+    """
+    decompressor = bz2.BZ2Decompressor()
+    for block in blocks:
+        while block:
+            try:
+                data = decompressor.decompress(block)
+            except EOFError:
+                # The previous stream ended exactly at the end of a block.
+                decompressor = bz2.BZ2Decompressor()
+                continue
+            if data:
+                yield data
+            block = decompressor.unused_data
+            if block:
+                decompressor = bz2.BZ2Decompressor()
+
+class ParallelBZ2Writer(object):
+    """
+    A write-only file object compressing what is written to it into
+    `output` as a series of bzip2 streams, one per `block_size` bytes of
+    input.  The blocks are compressed by a pool of `processes` processes
+    (by default, one per CPU) and written in order; at most `window` blocks
+    are compressed or waiting to be written at a time, which bounds memory
+    use.  With a single process, blocks are compressed in this process.
+
+    Call `close` when done; `output` itself is not closed.
+
+    """
+    def __init__(self, output, processes=None, block_size=BZ2_BLOCK_SIZE,
+                 level=BZ2_COMPRESSION_LEVEL, window=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.output = output
+        self.block_size = block_size
+        self.level = level
+        self.window = window or 2 * processes
+        self.streams = 0
+        self._buffer = []
+        self._buffered = 0
+        self._pending = deque()
+        self._pool = None
+        if processes > 1:
+            self._pool = multiprocessing.Pool(processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            self._submit()
+
+    def _submit(self):
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self.streams += 1
+        if self._pool is None:
+            self.output.write(bz2.compress(data, self.level))
+            return
+        self._pending.append(self._pool.apply_async(bz2.compress,
+                                                    (data, self.level)))
+        while len(self._pending) >= self.window:
+            self.output.write(self._pending.popleft().get())
+
+    def close(self):
+        """Compress the remaining input and wait until it is all written."""
+        if self._buffered or not self.streams:
+            self._submit()
+        while self._pending:
+            self.output.write(self._pending.popleft().get())
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def abort(self):
+        """Stop compressing, discarding pending blocks."""
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
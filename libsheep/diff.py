@@ -0,0 +1,103 @@
+"""
+Module for comparing file listings.  `diff` walks two listings in lockstep
+and yields the `Change`s that turn the first into the second; subtrees whose
+cached digests match are skipped without being visited.  `apply_patch`
+applies such changes to a listing in place, so only the latest listing of a
+client needs to be kept around.
+
+"""
+import copy
+import logging
+from collections import namedtuple
+from libsheep.filelist import Container
+from libsheep.path import Path
+
+log = logging.getLogger(__name__)
+
+ADD = 'add'
+REMOVE = 'remove'
+MODIFY = 'modify'
+
+# `path` is relative to the listing and references a directory if `item`
+# is a `Container`.  `item` is the added or modified item from the new
+# listing, or the removed item from the old listing.
+Change = namedtuple('Change', 'action path item')
+
+def diff(old, new):
+    """
+    Yield the `Change`s needed to turn the container `old` into `new`,
+    ordered by path.
+
+    """
+    if old.digest == new.digest:
+        return
+    # Walk depth-first with a stack of iterators, so changes come out in
+    # path order and no generator is nested more than one level deep.
+    stack = [((), _iter_pairs(old, new))]
+    while stack:
+        names, pairs = stack[-1]
+        for name, old_item, new_item in pairs:
+            old_is_dir = isinstance(old_item, Container)
+            new_is_dir = isinstance(new_item, Container)
+            if old_item is not None and (new_item is None or
+                                         old_is_dir != new_is_dir):
+                yield Change(REMOVE, _path(names, old_item), old_item)
+                old_item = None
+            if new_item is None:
+                continue
+            elif old_item is None:
+                yield Change(ADD, _path(names, new_item), new_item)
+            elif new_is_dir:
+                if bool(old_item.incomplete) != bool(new_item.incomplete):
+                    yield Change(MODIFY, _path(names, new_item), new_item)
+                if old_item.digest != new_item.digest:
+                    stack.append((names + (name,),
+                                  _iter_pairs(old_item, new_item)))
+                    break
+            elif (old_item.listed_attributes() !=
+                  new_item.listed_attributes()):
+                yield Change(MODIFY, _path(names, new_item), new_item)
+        else:
+            stack.pop()
+
+def _iter_pairs(old, new):
+    old_contents = old.contents
+    new_contents = new.contents
+    for name in sorted(set(old_contents) | set(new_contents)):
+        yield (name, old_contents.get(name), new_contents.get(name))
+
+def apply_patch(listing, changes):
+    """
+    Apply the `Change`s in `changes` to the `FileListing` instance
+    `listing` in place.  Added and modified items are copied, so `listing`
+    shares nothing with the listing the changes came from.  To patch one of
+    the listings passed to `diff`, collect the changes in a list first.
+
+    """
+    for change in changes:
+        if change.action == REMOVE:
+            listing.remove(change.path)
+        elif change.action == ADD:
+            _graft(listing, change.path, copy.deepcopy(change.item))
+        elif change.action == MODIFY:
+            if isinstance(change.item, Container):
+                listing.add(change.path, incomplete=change.item.incomplete)
+            else:
+                _graft(listing, change.path, copy.copy(change.item))
+        else:
+            raise ValueError("Unknown change: %r" % (change.action,))
+
+def _path(names, item):
+    if isinstance(item, Container):
+        return Path(names + (item.name, ''))
+    else:
+        return Path(names + (item.name,))
+
+def _graft(listing, path, item):
+    parent_path = path.parent
+    if parent_path is None:
+        parent = listing
+    else:
+        parent = listing.add(parent_path)
+    parent[item.name] = item
+    listing.generation += 1
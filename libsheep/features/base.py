@@ -131,6 +131,7 @@ class GET(Command):
     start_pos = Parameter(2, Integer)
     bytes = Parameter(3, Integer)
     recursive = Parameter('RE', Boolean, default=False)
+    compressed = Parameter('ZL', Boolean, default=False)
 
 class GFI(Command):
     """Get file information message."""
@@ -143,3 +144,12 @@ class SND(Command):
     identifier = Parameter(1)
     start_pos = Parameter(2, Integer)
     bytes = Parameter(3, Integer)
+    compressed = Parameter('ZL', Boolean, default=False)
+    
+    def encode(self):
+        yield self.type
+        yield self.identifier
+        yield '%d' % (self.start_pos,)
+        yield '%d' % (self.bytes,)
+        if self.compressed:
+            yield 'ZL1'
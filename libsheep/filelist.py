@@ -2,6 +2,9 @@
 import logging
 import re
 import copy
+import hashlib
+from timeit import default_timer
+from xml.sax.saxutils import quoteattr
 try:
     from xml.etree import ElementTree
 except ImportError:
@@ -10,14 +13,34 @@ try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
+from libsheep import metrics
 from libsheep.path import Path
+from libsheep.utils import b32encode, b32decode
+from libsheep.compression import (BLOCK_SIZE, ParallelBZ2Writer,
+                                  decompress_bz2_stream)
 
 log = logging.getLogger(__name__)
 
 class NotFound(Exception):
     pass
 
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
 class File(object):
+    """
+    High-level representation of a shared file.  The `tth` attribute, if
+    set, is the binary (24-byte) Tiger tree hash root of the file.
+    Attributes from extensions that libsheep does not know about are kept
+    as a sorted tuple of `(name, value)` pairs in `extra`.
+    
+    """
+    # Shared by every file without extension attributes, so they cost
+    # nothing per file.
+    extra = ()
+    
     def __init__(self, name, size, **kwargs):
         self.name = name
         self.size = size
@@ -33,18 +56,58 @@ class File(object):
     def __ne__(self, other):
         return not self == other
     
+    def listed_attributes(self):
+        """Return the attributes of this file that appear in file lists."""
+        return (self.size, getattr(self, 'tth', None), self.extra)
+    
+    def _digest_data(self):
+        """
+        Return the listed attributes of this file as a canonical byte
+        string, so that equal attributes give equal digests whether their
+        values are byte strings or unicode.
+        
+        """
+        size, tth, extra = self.listed_attributes()
+        parts = [size is not None and '%d' % (size,) or '', tth or '']
+        for key, value in extra:
+            parts.append(_utf8(key))
+            parts.append(_utf8(value))
+        return ''.join(['%d:%s' % (len(part), part) for part in parts])
+    
     @classmethod
     def from_element(cls, element):
-        name = element.attrib['Name']
-        size = int(element.attrib['Size'])
-        # TODO: Optional/arbitrary attributes (from extensions, etc.)
-        return cls(name, size)
+        attributes = element.attrib
+        item = cls(attributes['Name'], int(attributes['Size']))
+        extra = []
+        for key, value in attributes.iteritems():
+            if key == 'Name' or key == 'Size':
+                continue
+            if key == 'TTH':
+                try:
+                    tth = b32decode(value)
+                except TypeError:
+                    tth = None
+                if tth is not None and len(tth) == 24:
+                    item.tth = tth
+                    continue
+                log.warning("Invalid TTH for %r: %r", item.name, value)
+            if isinstance(key, str):
+                # Most lists use the same few attribute names.
+                key = intern(key)
+            extra.append((key, value))
+        if extra:
+            item.extra = tuple(sorted(extra))
+        return item
     
     def to_element(self):
         element = ElementTree.Element('File')
         element.set('Name', self.name)
         element.set('Size', '%d' % (self.size,))
-        # TODO: Optional/arbitrary attributes (from extensions, etc.)
+        tth = getattr(self, 'tth', None)
+        if tth is not None:
+            element.set('TTH', b32encode(tth))
+        for key, value in self.extra:
+            element.set(key, value)
         return element
 
 class Container(object):
@@ -52,11 +115,42 @@ class Container(object):
     Base class for `Directory` and `FileListing`, which can both contain
     `File` instances and other `Container` instances.
     
+    Each container caches the total size, file count and digest of its
+    contents.  The caches are computed on demand and invalidated along the
+    chain of `parent` containers whenever items are added or removed, so
+    reading them is O(1) unless something below has changed.  Changing the
+    attributes of an item directly requires calling `invalidate` on its
+    container; `add` does this itself.
+    
+    Containers may be shared between a `FileListing` and its snapshots.
+    `add` and `remove` copy shared containers along the path they modify,
+    so changes should be made through them (or through the containers they
+    return) rather than to arbitrary containers in the tree.
+    
     """
+    parent = None
+    _stats = None
+    # Identifies the tree allowed to modify this container in place; see
+    # `FileListing.snapshot`.
+    _owner = None
     
     def __init__(self):
         self.contents = {}
     
+    def __deepcopy__(self, memo):
+        # Copying the parent would copy everything above this container, so
+        # the copy is detached; parent links below it are recreated.
+        cls = self.__class__
+        container = cls.__new__(cls)
+        memo[id(self)] = container
+        for key, value in self.__dict__.iteritems():
+            if key not in ('parent', '_stats', '_owner', '_name_index'):
+                container.__dict__[key] = copy.deepcopy(value, memo)
+        for item in container.contents.itervalues():
+            if isinstance(item, Container):
+                item.parent = container
+        return container
+    
     def __iter__(self):
         return self.contents.itervalues()
     
@@ -77,15 +171,26 @@ class Container(object):
     
     def __setitem__(self, name, item):
         self.contents[name] = item
+        if isinstance(item, Container):
+            item.parent = self
+        self.invalidate()
     
     def __delitem__(self, name):
         try:
-            del self.contents[name]
+            item = self.contents.pop(name)
         except KeyError:
             raise NotFound("%r" % (name,))
+        if isinstance(item, Container) and item.parent is self:
+            # Shared items keep their link to a snapshot's container.
+            item.parent = None
+        self.invalidate()
     
     def __eq__(self, other):
         if isinstance(other, Container):
+            if (self._stats is not None and other._stats is not None and
+                self._stats[2] != other._stats[2]):
+                # Different digests always mean different contents.
+                return False
             return self.contents == other.contents
         else:
             return False
@@ -93,6 +198,117 @@ class Container(object):
     def __ne__(self, other):
         return not self == other
     
+    def _begin_write(self):
+        """
+        Prepare this container to be modified and return the token of the
+        tree that owns it.
+        
+        """
+        return self._owner
+    
+    def _own(self, name, item, token):
+        """
+        Return the child container `item`, named `name`, in a form that the
+        tree identified by `token` may modify in place.  If it is shared
+        with a snapshot, it is replaced with a shallow copy first.
+        
+        """
+        if item._owner is token:
+            return item
+        owned = item._copy_for(token)
+        # The contents are unchanged, so the cached statistics still hold.
+        self.contents[name] = owned
+        owned.parent = self
+        return owned
+    
+    def _copy_for(self, token):
+        container = copy.copy(self)
+        container.contents = dict(self.contents)
+        container._owner = token
+        return container
+    
+    def invalidate(self):
+        """
+        Discard the cached statistics of this container and the containers
+        above it.
+        
+        """
+        container = self
+        # A container's statistics are only ever computed after those of
+        # the containers below it, so once we reach one that has already
+        # been invalidated, everything above it has been too.
+        while container is not None and container._stats is not None:
+            container._stats = None
+            container = container.parent
+    
+    def _get_stats(self):
+        if self._stats is None:
+            # Compute the statistics of nested containers bottom-up, without
+            # recursion, so deep trees can't exhaust the stack.
+            stack = [(self, False)]
+            while stack:
+                container, children_done = stack.pop()
+                if children_done:
+                    container._stats = container._compute_stats()
+                elif container._stats is None:
+                    stack.append((container, True))
+                    for item in container._known_contents().itervalues():
+                        if isinstance(item, Container) and item._stats is None:
+                            stack.append((item, False))
+        return self._stats
+    
+    def _known_contents(self):
+        """
+        Return the contents of this container that are already known,
+        without fetching any.  Statistics are computed from these.
+        
+        """
+        return self.contents
+    
+    def _compute_stats(self):
+        """
+        Return the `(total_size, file_count, digest)` of this container,
+        whose subcontainers' statistics have already been computed.
+        
+        """
+        total_size = 0
+        file_count = 0
+        hasher = hashlib.sha1()
+        contents = self._known_contents()
+        for name in sorted(contents):
+            item = contents[name]
+            if isinstance(item, Container):
+                size, count, digest = item._stats
+                total_size += size
+                file_count += count
+                hasher.update('D%s\0%d\0%s' % (name.encode('utf-8'),
+                                               bool(item.incomplete), digest))
+            else:
+                total_size += item.size or 0
+                file_count += 1
+                hasher.update('F%s\0%s\0' % (name.encode('utf-8'),
+                                             item._digest_data()))
+        return (total_size, file_count, hasher.digest())
+    
+    @property
+    def total_size(self):
+        """The total size of all files in this container."""
+        return self._get_stats()[0]
+    
+    @property
+    def file_count(self):
+        """The number of files in this container."""
+        return self._get_stats()[1]
+    
+    @property
+    def digest(self):
+        """
+        A digest of the names and listed attributes of everything in this
+        container.  Containers with equal digests have equal contents.
+        
+        """
+        return self._get_stats()[2]
+    
     def add(self, path, overwrite=False, **kwargs):
         """
         Add an item to this container at the relative path `path` and return
@@ -109,11 +325,21 @@ class Container(object):
         instances, and any item sharing the same path will be replaced with a
         new `File` or `Directory` instance.
         
+        """
+        return self._add(path, overwrite, kwargs)[0]
+    
+    def _add(self, path, overwrite, attributes):
+        """
+        Implement `add`, returning a `(item, changed)` tuple, where `changed`
+        is False if the container was left as it was.
+        
         """
         path = Path(path)
         if not path.is_relative:
             raise RuntimeError("Path must be relative to container.")
         
+        token = self._begin_write()
+        changed = False
         parent = self
         # Descend the tree named by `path`, creating intermediate directories
         # as needed.
@@ -121,10 +347,12 @@ class Container(object):
             item = parent.contents.get(dir_name)
             if isinstance(item, Container):
                 # Directory exists.
-                parent = item
+                parent = parent._own(dir_name, item, token)
             elif item is None or overwrite:
                 # Directory does not exist or can be replaced.
                 parent[dir_name] = parent = Directory(dir_name)
+                parent._owner = token
+                changed = True
             else:
                 # A non-directory of the same name exists, but should not be
                 # overwritten.
@@ -136,14 +364,29 @@ class Container(object):
             item = parent.contents.get(file_name)
             if item is None or overwrite:
                 parent[file_name] = item = File(file_name, None)
+                changed = True
             elif not isinstance(item, File):
                 raise RuntimeError("%r exists and is not a file "
                                    "(try overwrite=True)." % (file_name,))
         else:
             item = parent
-        for key, value in kwargs.iteritems():
-            setattr(item, key, value)
-        return item
+        # Only attributes that differ change anything.
+        missing = object()
+        kwargs = dict((key, value) for key, value in attributes.iteritems()
+                      if getattr(item, key, missing) != value)
+        if kwargs:
+            if item is not parent and not changed and token is not None:
+                # The file may be shared with a snapshot.
+                parent.contents[file_name] = item = copy.copy(item)
+            changed = True
+            for key, value in kwargs.iteritems():
+                setattr(item, key, value)
+            # The attributes of `item` are part of its container's digest.
+            if item is parent and item.parent is not None:
+                item.parent.invalidate()
+            else:
+                parent.invalidate()
+        return (item, changed)
     
     def remove(self, path):
         """
@@ -160,6 +403,7 @@ class Container(object):
         if not path.is_relative:
             raise RuntimeError("Path must be relative to container.")
         
+        token = self._begin_write()
         grandparent = None
         parent = self
         for dir_name in path.names[:-1]:
@@ -167,6 +411,7 @@ class Container(object):
             parent = parent.contents.get(dir_name)
             if not isinstance(parent, Container):
                 break
+            parent = grandparent._own(dir_name, parent, token)
         else:
             file_name = path.names[-1]
             if file_name:
@@ -180,27 +425,73 @@ class Container(object):
                 return item
     
     def iter_paths(self, base=None, depth=-1):
-        names = base and Path(base).names[:-1] or ()
-        for item in self:
+        """
+        Yield a `(path, item)` tuple for each item in this container, where
+        `path` is a `Path` relative to `base`.  Building a `Path` for every
+        item is expensive; use `walk` for large traversals.
+
+        """
+        names = base and tuple(Path(base).names[:-1]) or ()
+        for parents, item in self.walk(depth):
             if isinstance(item, Container):
-                path = Path(names + (item.name, ''))
-                yield (path, item)
-                if depth:
-                    for child_path, child in item.iter_paths(path, depth - 1):
-                        yield (child_path, child)
+                yield (Path(names + parents + (item.name, '')), item)
             else:
-                path = Path(names + (item.name,))
-                yield (path, item)
+                yield (Path(names + parents + (item.name,)), item)
+
+    def walk(self, depth=-1, files_only=False, min_size=None,
+             extensions=None):
+        """
+        Yield a `(parents, item)` tuple for each item in this container,
+        depth-first, where `parents` is the tuple of names of the directories
+        between this container and `item`.  Use `render_path` to get the
+        path string of an item only when it is needed.
+
+        Directories more than `depth` levels below this container are not
+        entered; a negative `depth` means unlimited recursion.  If
+        `files_only` is True, directories are entered but not yielded.  Files
+        smaller than `min_size`, or whose lowercase extension (without the
+        dot) is not in the set `extensions`, are skipped before anything is
+        allocated for them.
+
+        """
+        # Traverse iteratively, so that each item is yielded exactly once no
+        # matter how deep the tree is.  A tuple of parent names is built once
+        # per directory, not once per item.
+        stack = [((), self.contents.itervalues(), depth)]
+        while stack:
+            parents, items, child_depth = stack[-1]
+            for item in items:
+                if isinstance(item, Container):
+                    if not files_only:
+                        yield (parents, item)
+                    if child_depth:
+                        stack.append((parents + (item.name,),
+                                      item.contents.itervalues(),
+                                      child_depth - 1))
+                        break
+                    continue
+                if min_size is not None and (item.size or 0) < min_size:
+                    continue
+                if extensions is not None:
+                    name = item.name
+                    dot = name.rfind('.')
+                    if dot < 0 or name[dot + 1:].lower() not in extensions:
+                        continue
+                yield (parents, item)
+            else:
+                stack.pop()
     
     def get_partial(self, depth=0):
         partial = copy.copy(self)
         partial.contents = {}
+        partial.parent = None
+        partial._stats = None
         if depth:
             for name, item in self.contents.iteritems():
                 if isinstance(item, Container):
-                    partial.contents[name] = item.get_partial(depth - 1)
+                    partial[name] = item.get_partial(depth - 1)
                 else:
-                    partial.contents[name] = copy.copy(item)
+                    partial[name] = copy.copy(item)
         return partial
 
 class Directory(Container):
@@ -244,6 +535,7 @@ class Directory(Container):
                 directory.contents[child_file.name] = child_file
             elif subelement.tag == 'Directory':
                 child_dir = cls.from_element(subelement)
+                child_dir.parent = directory
                 directory.contents[child_dir.name] = child_dir
         
         return directory
@@ -264,11 +556,77 @@ class Directory(Container):
             partial.incomplete = True
         return partial
 
+def _record_listing(listing, operation, start):
+    elapsed = default_timer() - start
+    if operation == 'load':
+        metrics.listing_load_seconds.observe(elapsed)
+    else:
+        metrics.listing_serialize_seconds.observe(elapsed)
+    metrics.listing_entries.inc(metrics.count_entries(listing), operation)
+
+def render_path(parents, item):
+    """
+    Return the escaped path string of `item`, as yielded by
+    `Container.walk` along with the tuple of names `parents`.  Directory
+    paths end with a '/'.
+
+    """
+    path = u'/'.join([Path.escape(name) for name in parents + (item.name,)])
+    if isinstance(item, Container):
+        return path + u'/'
+    return path
+
+def iter_contents_xml(container, depth=-1):
+    """
+    Yield the UTF-8 encoded XML elements for the contents of `container`,
+    reading the live tree without copying any items.  Directories more than
+    `depth` levels below `container` are written without their contents and
+    marked incomplete; a negative `depth` means unlimited recursion.
+    
+    """
+    if not depth:
+        return
+    # Traverse iteratively so that each element is yielded exactly once,
+    # no matter how deep the tree is.
+    stack = [(container.contents.itervalues(), depth - 1)]
+    while stack:
+        items, child_depth = stack[-1]
+        for item in items:
+            name = quoteattr(item.name)
+            if not isinstance(item, Container):
+                attributes = u'Name=%s Size="%d"' % (name, item.size or 0)
+                tth = getattr(item, 'tth', None)
+                if tth is not None:
+                    attributes += u' TTH="%s"' % (b32encode(tth),)
+                for key, value in getattr(item, 'extra', ()):
+                    attributes += u' %s=%s' % (key, quoteattr(value))
+                yield (u'<File %s/>' % (attributes,)).encode('utf-8')
+            elif child_depth and item.contents:
+                if item.incomplete:
+                    yield (u'<Directory Name=%s Incomplete="1">' %
+                           (name,)).encode('utf-8')
+                else:
+                    yield (u'<Directory Name=%s>' % (name,)).encode('utf-8')
+                stack.append((item.contents.itervalues(), child_depth - 1))
+                break
+            elif item.incomplete or item.contents:
+                yield (u'<Directory Name=%s Incomplete="1"/>' %
+                       (name,)).encode('utf-8')
+            else:
+                yield (u'<Directory Name=%s/>' % (name,)).encode('utf-8')
+        else:
+            stack.pop()
+            if stack:
+                yield '</Directory>'
+
 class FileListing(Container):
     """High-level representation of a file listing."""
     
     VERSION = 1
     GENERATOR = 'libsheep'
+    XML_DECLARATION = ('<?xml version="1.0" encoding="utf-8" '
+                       'standalone="yes"?>\n')
+    _name_index = None
     
     def __init__(self, client_id, base='/', version=VERSION, generator=None):
         super(FileListing, self).__init__()
@@ -278,6 +636,12 @@ class FileListing(Container):
             raise RuntimeError("Unsupported file listing version.")
         self.version = version
         self.generator = generator
+        # Incremented whenever items are added or removed, so that anything
+        # derived from the listing can tell whether it is stale.
+        self.generation = 0
+        # Identifies this tree once it has been snapshotted; containers
+        # owned by another tree are copied before being modified.
+        self._token = None
     
     def __repr__(self):
         return 'FileListing(%r, %r)' % (self.client_id, self.base)
@@ -288,9 +652,78 @@ class FileListing(Container):
                 return False
         return super(FileListing, self).__eq__(other)
     
+    def __setitem__(self, name, item):
+        self._begin_write()
+        super(FileListing, self).__setitem__(name, item)
+        self.generation += 1
+    
+    def __delitem__(self, name):
+        self._begin_write()
+        super(FileListing, self).__delitem__(name)
+        self.generation += 1
+    
     def iter_paths(self, depth=-1):
         return super(FileListing, self).iter_paths(self.base, depth)
     
+    def query(self, *args, **kwargs):
+        """
+        Yield a `(path, item)` tuple for each item matching a query, where
+        `path` is the absolute path string of `item`.  The arguments are a
+        `libsheep.query.Query` instance, or the arguments to create one.
+        The index used to run queries is kept until the listing changes.
+        
+        """
+        from libsheep.query import Query, NameIndex
+        if args and isinstance(args[0], Query):
+            query = args[0]
+        else:
+            query = Query(*args, **kwargs)
+        index = self._name_index
+        if index is None or index.digest != self.digest:
+            index = self._name_index = NameIndex(self)
+        return query.run(self, index)
+    
+    def snapshot(self):
+        """
+        Return a read-only view of this listing as it is now, in O(1) time.
+        
+        The snapshot shares every item with this listing.  Afterwards,
+        `add` and `remove` copy each shared container along the path they
+        modify (and each file whose attributes they change) instead of
+        changing it in place, so readers of the snapshot see a consistent
+        tree while this listing keeps changing.  Containers that are never
+        modified are never copied.
+        
+        """
+        snapshot = copy.copy(self)
+        # Neither tree owns anything yet, so each copies what it modifies.
+        snapshot._token = object()
+        self._token = object()
+        return snapshot
+    
+    def unshare(self, item):
+        """
+        Return the detached `item` (typically just removed from this
+        listing) in a form that may be modified in place, copying it if it
+        may still be shared with a snapshot.
+        
+        """
+        token = self._token
+        if isinstance(item, Container):
+            if item._owner is not token:
+                item = item._copy_for(token)
+                item.parent = None
+        elif token is not None:
+            item = copy.copy(item)
+        return item
+    
+    def _begin_write(self):
+        if self._owner is not self._token:
+            # The top-level contents are shared with a snapshot.
+            self.contents = dict(self.contents)
+            self._owner = self._token
+        return self._token
+    
     def _get_base(self):
         return self._base
     
@@ -305,11 +738,26 @@ class FileListing(Container):
     def from_file(cls, file_or_name):
         """
         Return a `FileListing` instance initialized with contents from
-        `file_or_name`, which is a filename or file-like object.
+        `file_or_name`, which is a filename or file-like object.  Filenames
+        ending in '.bz2' are decompressed, and may hold several bzip2
+        streams.
         
         """
-        tree = ElementTree.parse(file_or_name)
-        return cls.from_element(tree.getroot())
+        start = metrics.enabled and default_timer()
+        if (isinstance(file_or_name, basestring) and
+            file_or_name.endswith('.bz2')):
+            parser = ElementTree.XMLParser()
+            with open(file_or_name, 'rb') as f:
+                blocks = iter(lambda: f.read(BLOCK_SIZE), '')
+                for data in decompress_bz2_stream(blocks):
+                    parser.feed(data)
+            root = parser.close()
+        else:
+            root = ElementTree.parse(file_or_name).getroot()
+        listing = cls.from_element(root)
+        if start:
+            _record_listing(listing, 'load', start)
+        return listing
     
     @classmethod
     def from_string(cls, xml_string):
@@ -318,8 +766,12 @@ class FileListing(Container):
         `xml_string`.
         
         """
+        start = metrics.enabled and default_timer()
         element = ElementTree.fromstring(xml_string)
-        return cls.from_element(element)
+        listing = cls.from_element(element)
+        if start:
+            _record_listing(listing, 'load', start)
+        return listing
     
     @classmethod
     def from_element(cls, element):
@@ -339,6 +791,7 @@ class FileListing(Container):
                     listing.contents[listing_file.name] = listing_file
                 elif subelement.tag == 'Directory':
                     listing_dir = Directory.from_element(subelement)
+                    listing_dir.parent = listing
                     listing.contents[listing_dir.name] = listing_dir
             
             return listing
@@ -361,29 +814,57 @@ class FileListing(Container):
         self.write(string_file)
         return string_file.getvalue()
     
-    def write(self, file_or_name, mode='w'):
+    def write(self, file_or_name, mode='w', compress=None, processes=None):
         """
         Serialize the file listing and write it to `file_or_name`, which
         is a filename or file-like object.  If `file_or_name` is a filename,
         it will be opened with the mode given by `mode`.
         
+        If `compress` is true, or it is None and `file_or_name` is a
+        filename ending in '.bz2', the output is compressed with bzip2 in
+        parallel by `processes` processes (by default, one per CPU).  See
+        `compression.ParallelBZ2Writer`.
+        
         """
+        if compress is None:
+            compress = (isinstance(file_or_name, basestring) and
+                        file_or_name.endswith('.bz2'))
         if isinstance(file_or_name, basestring):
+            if compress and 'b' not in mode:
+                mode += 'b'
             output_file = open(file_or_name, mode)
         else:
             output_file = file_or_name
         
-        root = self.to_element()
-        tree = ElementTree.ElementTree(root)
-        tree.write(output_file, 'utf-8')
+        try:
+            start = metrics.enabled and default_timer()
+            root = self.to_element()
+            tree = ElementTree.ElementTree(root)
+            if compress:
+                with ParallelBZ2Writer(output_file, processes) as writer:
+                    tree.write(writer, 'utf-8')
+            else:
+                tree.write(output_file, 'utf-8')
+            if start:
+                _record_listing(self, 'serialize', start)
+        finally:
+            if output_file is not file_or_name:
+                output_file.close()
     
     def get(self, path):
+        """
+        Return the item at the relative or absolute path `path`.  Absolute
+        paths must descend from `self.base`.  Raises `NotFound` if no such
+        item exists.
+        
+        """
         path = Path(path)
         if path.is_absolute:
-            # Make this possible later.
-            raise RuntimeError("Path does not descend from base.")
+            if path == self.base:
+                return self
+            path = path.relative_to(self.base)
         
-        names = list(self.base)
+        names = list(path)
         file_name = names.pop()
         parent = self
         for dir_name in names:
@@ -410,7 +891,10 @@ class FileListing(Container):
             # This is an absolute path.  Ensure that `path` descends from
             # `self.base`, otherwise it does not belong in this file list.
             path = path.relative_to(self.base)
-        return super(FileListing, self).add(path, overwrite, **kwargs)
+        item, changed = self._add(path, overwrite, kwargs)
+        if changed:
+            self.generation += 1
+        return item
     
     def remove(self, path):
         """
@@ -426,9 +910,19 @@ class FileListing(Container):
             # This is an absolute path.  Ensure that `path` descends from
             # `self.base`, otherwise it does not belong in this file list.
             path = path.relative_to(self.base)
-        return super(FileListing, self).remove(path)
+        item = super(FileListing, self).remove(path)
+        if item is not None:
+            self.generation += 1
+        return item
 
-    def get_partial(self, base=None, depth=-1):
+    def get_base(self, base):
+        """
+        Return the absolute directory path `base` and the container it
+        references, for use as the base of a partial listing.  If `base` is
+        not given, the base of this listing and the listing itself are
+        returned.
+        
+        """
         if base:
             base = Path(base)
             if not base.is_directory:
@@ -437,14 +931,36 @@ class FileListing(Container):
                 base = self.base.join(base)
             elif not base.descends_from(self.base):
                 raise RuntimeError("Path does not descend from base.")
-            listing = self.get(base)
+            return (base, self.get(base))
         else:
-            listing = self
-            base = self.base
+            return (self.base, self)
+    
+    def get_partial(self, base=None, depth=-1):
+        base, listing = self.get_base(base)
         
         partial = super(FileListing, listing).get_partial(depth)
         partial.base = base
         return partial
+    
+    def iter_xml(self, base=None, depth=-1):
+        """
+        Yield the UTF-8 encoded XML serialization of the partial listing
+        rooted at the directory `base` (by default, the base of this
+        listing) in chunks.  Directories more than `depth` levels below
+        `base` are marked incomplete.
+        
+        Unlike `get_partial`, this reads the live tree and copies nothing.
+        
+        """
+        base, container = self.get_base(base)
+        yield self.XML_DECLARATION
+        yield (u'<FileListing Version="%d" CID=%s Base=%s Generator=%s>' %
+               (self.version, quoteattr(unicode(self.client_id)),
+                quoteattr(unicode(base)),
+                quoteattr(self.GENERATOR))).encode('utf-8')
+        for chunk in iter_contents_xml(container, depth):
+            yield chunk
+        yield '</FileListing>\n'
 
 if __name__ == '__main__':
     import doctest
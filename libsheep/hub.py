@@ -0,0 +1,575 @@
+"""
+Module for the hub side of ADC: keeping track of the users connected to a
+hub and relaying their messages to each other.
+
+Relaying is built around encoding each message once.  A message is turned
+into a byte string a single time and that same immutable string is queued
+on every recipient's `Connection`, so broadcasting to n users costs n queue
+appends rather than n encodes.  Each user's latest `INF` is also kept
+pre-encoded, so a joining user is sent the existing users' `INF`s without
+encoding any of them.  Queued strings are written in batches with a single
+send per connection.  The send is vectored only where sockets have
+`sendmsg` (Python 3.3 and later); on Python 2 each batch of up to
+`BATCH_SIZE` bytes is joined into one string first.
+
+`F` messages are routed with a `FeatureIndex`: each user is assigned a bit,
+and each feature a bitmap (a Python integer) of the users supporting it, so
+the recipients of a message are found with a few bitwise operations rather
+than by checking every user's features.
+
+Searches for a TTH are only forwarded to the users whose bloom filter (see
+the ADC BLOM extension) may contain it, and to users without a filter.
+
+"""
+import re
+import errno
+import socket
+import logging
+from collections import deque, OrderedDict
+from libsheep.protocol import ProtocolError
+from libsheep.utils import b32decode
+
+log = logging.getLogger(__name__)
+
+# The largest number of bytes a connection writes in one send.
+BATCH_SIZE = 64 * 1024
+
+FEATURE = re.compile(r'([+-])([A-Z][A-Z0-9]{3})')
+
+# Missing on Python 2, where batches are joined before being sent.
+_sendmsg = getattr(socket.socket, 'sendmsg', None)
+
+def encode(line):
+    """
+    Return `line`, a byte or unicode string, as a byte string.  `Message`
+    instances are not accepted, since their contexts don't encode the
+    SIDs and fields of relayed messages.
+
+    """
+    if isinstance(line, unicode):
+        return line.encode('utf-8')
+    return line
+
+class Connection(object):
+    """
+    The outgoing side of the connection `socket` to a user.  Messages are
+    queued with `send` and written by `flush`, which never blocks if the
+    socket is non-blocking.
+
+    """
+    def __init__(self, socket):
+        self.socket = socket
+        self.queue = deque()
+        self.queued_bytes = 0
+        # How much of the first queued string has already been written.
+        self._offset = 0
+
+    def send(self, data):
+        """Queue the byte string `data`, which may be shared with others."""
+        self.queue.append(data)
+        self.queued_bytes += len(data)
+
+    def flush(self):
+        """
+        Write as much of the queue as the socket accepts and return True if
+        the queue is now empty.
+
+        """
+        queue = self.queue
+        while queue:
+            batch = []
+            size = 0
+            for data in queue:
+                if batch and size + len(data) > BATCH_SIZE:
+                    break
+                batch.append(data)
+                size += len(data)
+            if self._offset:
+                batch[0] = batch[0][self._offset:]
+            try:
+                sent = self._write(batch)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return False
+                raise
+            if not sent:
+                return False
+            self.queued_bytes -= sent
+            sent += self._offset
+            while queue and sent >= len(queue[0]):
+                sent -= len(queue.popleft())
+            self._offset = sent
+        return True
+
+    def _write(self, batch):
+        if len(batch) == 1:
+            return self.socket.send(batch[0])
+        if _sendmsg is not None:
+            return self.socket.sendmsg(batch)
+        return self.socket.send(''.join(batch))
+
+class User(object):
+    """
+    A user of the hub, identified by the session ID `sid` and connected
+    through the `Connection` instance `connection`.  `info` holds the
+    (escaped) values of the fields of the user's latest `INF`.
+
+    """
+    def __init__(self, sid, connection):
+        self.sid = sid
+        self.connection = connection
+        self.info = OrderedDict()
+        self.features = frozenset()
+        # The user's bit in the `FeatureIndex` bitmaps.
+        self.slot = None
+        self.bloom = None
+        self._inf_line = None
+
+    def __repr__(self):
+        return 'User(%r)' % (self.sid,)
+
+    def update_info(self, fields):
+        """
+        Merge the `(code, value)` pairs in `fields` into `info` and return
+        a dictionary of the fields that changed.  An empty value removes a
+        field.
+
+        """
+        changed = {}
+        for code, value in fields:
+            if self.info.get(code, '') == value:
+                continue
+            changed[code] = value
+            if value:
+                self.info[code] = value
+            else:
+                self.info.pop(code, None)
+        if changed:
+            self._inf_line = None
+        return changed
+
+    @property
+    def inf_line(self):
+        """The user's complete `BINF`, encoded once per change."""
+        if self._inf_line is None:
+            tokens = ['BINF', self.sid]
+            tokens.extend(code + value for code, value in
+                          self.info.iteritems())
+            self._inf_line = (u' '.join(tokens) + u'\n').encode('utf-8')
+        return self._inf_line
+
+def iter_bits(bitmap):
+    """
+    Yield the positions of the set bits of the integer `bitmap`, lowest
+    first.
+
+    >>> list(iter_bits(0b100101))
+    [0, 2, 5]
+
+    """
+    # Searching the binary representation is done in C, so this is much
+    # faster than shifting a large integer bit by bit.
+    bits = bin(bitmap)[:1:-1]
+    position = bits.find('1')
+    while position >= 0:
+        yield position
+        position = bits.find('1', position + 1)
+
+class FeatureIndex(object):
+    """
+    Bitmaps of the users supporting each feature, for routing `F` messages.
+    Each user added is assigned a bit position (`User.slot`), which is
+    reused after the user is removed.
+
+    """
+    def __init__(self):
+        self.everyone = 0
+        self.bitmaps = {}
+        self.users = []
+        self._free_slots = []
+
+    def add(self, user, features=()):
+        if self._free_slots:
+            user.slot = self._free_slots.pop()
+            self.users[user.slot] = user
+        else:
+            user.slot = len(self.users)
+            self.users.append(user)
+        self.everyone |= 1 << user.slot
+        user.features = frozenset()
+        self.update(user, features)
+
+    def remove(self, user):
+        self.update(user, ())
+        self.everyone &= ~(1 << user.slot)
+        self.users[user.slot] = None
+        self._free_slots.append(user.slot)
+        user.slot = None
+
+    def update(self, user, features):
+        """Change the features supported by `user` to `features`."""
+        features = frozenset(features)
+        bit = 1 << user.slot
+        for feature in features - user.features:
+            self.bitmaps[feature] = self.bitmaps.get(feature, 0) | bit
+        for feature in user.features - features:
+            bitmap = self.bitmaps[feature] & ~bit
+            if bitmap:
+                self.bitmaps[feature] = bitmap
+            else:
+                del self.bitmaps[feature]
+        user.features = features
+
+    def select(self, required=(), excluded=()):
+        """
+        Return the bitmap of the users supporting all of the features in
+        `required` and none of those in `excluded`.
+
+        """
+        bitmap = self.everyone
+        for feature in required:
+            bitmap &= self.bitmaps.get(feature, 0)
+            if not bitmap:
+                return 0
+        for feature in excluded:
+            bitmap &= ~self.bitmaps.get(feature, 0)
+        return bitmap
+
+    def users_in(self, bitmap):
+        users = self.users
+        return [users[slot] for slot in iter_bits(bitmap)]
+
+class BloomFilter(object):
+    """
+    A client's bloom filter of the TTHs in its share, as sent for the ADC
+    BLOM extension: `data` is the m / 8 byte filter, and each TTH sets the
+    `k` bits whose positions are consecutive `h`-bit little-endian integers
+    taken from the TTH, modulo m.
+
+    """
+    def __init__(self, data, k, h):
+        m = len(data) * 8
+        if not m or k < 1 or h < 1 or h > 64 or k * h > 192:
+            raise ProtocolError("Invalid bloom filter parameters.")
+        self.data = data
+        self.geometry = (m, k, h)
+
+    @staticmethod
+    def probes(tth, geometry):
+        """
+        Return the `(byte index, bit mask)` pairs that must all be set in a
+        filter with the given `(m, k, h)` geometry that contains `tth`.
+
+        """
+        m, k, h = geometry
+        value = 0
+        for i, char in enumerate(tth):
+            value |= ord(char) << (i * 8)
+        mask = (1 << h) - 1
+        probes = []
+        for i in xrange(k):
+            bit = ((value >> (i * h)) & mask) % m
+            probes.append((bit >> 3, 1 << (bit & 7)))
+        return probes
+
+    def may_contain(self, tth):
+        data = self.data
+        for index, mask in self.probes(tth, self.geometry):
+            if not ord(data[index]) & mask:
+                return False
+        return True
+
+    def fill_ratio(self):
+        """Return the fraction of the filter's bits that are set."""
+        return (sum(bin(ord(char)).count('1') for char in self.data) /
+                float(self.geometry[0]))
+
+    def false_positive_rate(self):
+        """Return the expected rate of false positives of the filter."""
+        return self.fill_ratio() ** self.geometry[1]
+
+class SearchStats(object):
+    """
+    Statistics of TTH searches routed with bloom filters.  `matched` counts
+    users whose filter may contain a searched TTH, and `confirmed` those of
+    them that then sent a result through the hub; results sent directly
+    over UDP are not seen, so `observed_false_positive_rate` is an upper
+    bound.
+
+    """
+    # The number of recent searches remembered for confirming results.
+    MAX_PENDING = 1024
+
+    def __init__(self):
+        self.searches = 0
+        self.probed = 0
+        self.skipped = 0
+        self.matched = 0
+        self.confirmed = 0
+        self.pending = OrderedDict()
+
+    def observed_false_positive_rate(self):
+        if not self.matched:
+            return 0.0
+        return 1.0 - self.confirmed / float(self.matched)
+
+    def expect_results(self, sid, token, sids):
+        key = (sid, token)
+        self.pending.pop(key, None)
+        self.pending[key] = set(sids)
+        while len(self.pending) > self.MAX_PENDING:
+            self.pending.popitem(last=False)
+
+    def result(self, sid, target_sid, token):
+        """Record a result for the search `token` of `target_sid`."""
+        expected = self.pending.get((target_sid, token))
+        if expected is not None and sid in expected:
+            expected.discard(sid)
+            self.confirmed += 1
+
+def parse_features(token):
+    """
+    Return the sets of required and excluded features in the feature token
+    of an `F` message, such as '+TCP4-NAT0'.
+
+    """
+    required = set()
+    excluded = set()
+    for sign, feature in FEATURE.findall(token):
+        if sign == '+':
+            required.add(feature)
+        else:
+            excluded.add(feature)
+    return required, excluded
+
+def split_line(line):
+    """
+    Split the ADC message `line` into its header (context and command) and
+    remaining tokens, which are left escaped.
+
+    """
+    if isinstance(line, str):
+        line = line.decode('utf-8')
+    tokens = line.rstrip(u'\n').split(u' ')
+    header = tokens[0]
+    if len(header) != 4:
+        raise ProtocolError("No leading four-letter word in header.")
+    return header, tokens[1:]
+
+def named_fields(tokens):
+    """Return the `(code, value)` pairs of the named parameters `tokens`."""
+    return [(token[:2], token[2:]) for token in tokens if len(token) >= 2]
+
+def _supported(info):
+    value = info.get('SU')
+    if not value:
+        return ()
+    return value.split(',')
+
+class Hub(object):
+    """
+    The users connected to a hub, and the relaying of messages between
+    them.  Messages received from users are passed to `receive`; messages
+    are queued on the recipients' connections, and written by `flush`.
+
+    """
+    def __init__(self):
+        self.users = OrderedDict()
+        self.features = FeatureIndex()
+        self.search_stats = SearchStats()
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, sid):
+        return sid in self.users
+
+    def join(self, sid, connection, line):
+        """
+        Add the user `sid`, whose initial `BINF` is `line`, and return the
+        `User`.  The new user is sent the `INF` of every existing user, and
+        the new `INF` is broadcast to everyone.
+
+        """
+        user = User(sid, connection)
+        header, tokens = split_line(line)
+        user.update_info(named_fields(tokens[1:]))
+        for other in self.users.itervalues():
+            connection.send(other.inf_line)
+        self.users[sid] = user
+        self.features.add(user, _supported(user.info))
+        self.added(user)
+        self.broadcast(user.inf_line)
+        return user
+
+    def leave(self, sid):
+        """Remove the user `sid` and tell everyone else it has quit."""
+        user = self.users.pop(sid, None)
+        if user is not None:
+            self.features.remove(user)
+            self.removed(user)
+            self.broadcast('IQUI %s\n' % (sid,))
+        return user
+
+    def added(self, user):
+        """Called after `user` joins."""
+
+    def removed(self, user):
+        """Called after `user` leaves."""
+
+    def info_changed(self, user, changed):
+        """Called after the fields in `changed` of `user`'s `INF` change."""
+
+    def receive(self, sid, line):
+        """
+        Relay the message `line` (a byte string ending with a newline)
+        received from the user `sid` according to its context, and return
+        the number of recipients.
+
+        """
+        user = self.users[sid]
+        header, tokens = split_line(line)
+        context = header[0]
+        if context in 'BDEF' and (not tokens or tokens[0] != sid):
+            raise ProtocolError("Message does not come from its sender.")
+        if header == 'BINF':
+            changed = user.update_info(named_fields(tokens[1:]))
+            if not changed:
+                return 0
+            if 'SU' in changed:
+                self.features.update(user, _supported(user.info))
+            self.info_changed(user, changed)
+        if context in 'BF':
+            if context == 'B':
+                users = None
+                fields = tokens[1:]
+            else:
+                users = self.route_features(tokens)
+                fields = tokens[2:]
+            if header[1:] == 'SCH':
+                users = self.route_search(user, fields, users)
+            return self.broadcast(encode(line), users)
+        elif context in 'DE':
+            if len(tokens) < 2:
+                raise ProtocolError("Message has no target.")
+            target = self.users.get(tokens[1])
+            if target is None:
+                return 0
+            if header[1:] == 'RES':
+                token = dict(named_fields(tokens[2:])).get('TO')
+                if token is not None:
+                    self.search_stats.result(sid, target.sid, token)
+            data = encode(line)
+            target.connection.send(data)
+            if context == 'E' and target is not user:
+                user.connection.send(data)
+                return 2
+            return 1
+        return 0
+
+    def route_features(self, tokens):
+        """
+        Return the users that should receive the `F` message with the
+        (escaped) `tokens`.
+
+        """
+        if len(tokens) < 2:
+            raise ProtocolError("Message has no features.")
+        required, excluded = parse_features(tokens[1])
+        return self.features.users_in(self.features.select(required,
+                                                           excluded))
+
+    def set_bloom(self, sid, data, k, h):
+        """
+        Set the bloom filter of the user `sid`, received in response to
+        `HGET blom / 0 <m / 8> BK<k> BH<h>`.
+
+        """
+        self.users[sid].bloom = BloomFilter(data, k, h)
+
+    def route_search(self, sender, fields, users=None):
+        """
+        Return the users, among `users` (by default everyone), that should
+        receive the search from `sender` with the (escaped) named parameter
+        tokens `fields`.  Searches for a TTH skip users whose bloom filter
+        does not contain it.
+
+        """
+        fields = dict(named_fields(fields))
+        if 'TR' not in fields:
+            return users
+        try:
+            tth = b32decode(fields['TR'])
+        except TypeError:
+            return users
+        if len(tth) != 24:
+            return users
+        if users is None:
+            users = self.users.itervalues()
+        stats = self.search_stats
+        stats.searches += 1
+        # Probe positions depend only on the TTH and the filter geometry,
+        # so they are computed once per geometry, not once per filter.
+        probes = {}
+        recipients = []
+        matched = []
+        for user in users:
+            bloom = user.bloom
+            if bloom is None or user is sender:
+                recipients.append(user)
+                continue
+            geometry = bloom.geometry
+            try:
+                user_probes = probes[geometry]
+            except KeyError:
+                user_probes = probes[geometry] = BloomFilter.probes(
+                    tth, geometry)
+            data = bloom.data
+            stats.probed += 1
+            for index, mask in user_probes:
+                if not ord(data[index]) & mask:
+                    stats.skipped += 1
+                    break
+            else:
+                recipients.append(user)
+                matched.append(user.sid)
+        stats.matched += len(matched)
+        token = fields.get('TO')
+        if token is not None and matched:
+            stats.expect_results(sender.sid, token, matched)
+        return recipients
+
+    def broadcast(self, message, users=None):
+        """
+        Queue `message` (a byte or unicode string) for each of `users`, by
+        default everyone, encoding it only once.  Return the number of
+        recipients.
+
+        """
+        data = encode(message)
+        if users is None:
+            users = self.users.itervalues()
+        count = 0
+        for user in users:
+            user.connection.send(data)
+            count += 1
+        return count
+
+    def flush(self):
+        """
+        Write the queued messages of every user and return the users whose
+        queues could not be written completely.  Users whose connection
+        fails are removed as if they had left.
+
+        """
+        pending = []
+        for user in self.users.values():
+            if not user.connection.queue:
+                continue
+            try:
+                if not user.connection.flush():
+                    pending.append(user)
+            except socket.error, e:
+                log.info("Connection to %s failed: %s", user.sid, e)
+                self.leave(user.sid)
+        return pending
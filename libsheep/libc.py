@@ -0,0 +1,91 @@
+"""
+Module for the system calls that Python 2's `os` module lacks, called
+through ctypes with the same signatures as their Python 3 counterparts.
+Each is None where it is not available: on platforms other than Linux,
+whose versions of these calls differ, or when ctypes can't load libc.
+
+"""
+import os
+import sys
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+def _load_libc():
+    if ctypes is None or not sys.platform.startswith('linux'):
+        return None
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+    except OSError:
+        return None
+
+_libc = _load_libc()
+
+def _function(name, restype, argtypes):
+    function = getattr(_libc, name, None)
+    if function is not None:
+        function.restype = restype
+        function.argtypes = argtypes
+    return function
+
+def _raise_errno():
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code))
+
+sendfile = None
+posix_fadvise = None
+
+# Values of the `advice` argument of `posix_fadvise` on Linux.
+POSIX_FADV_NORMAL = 0
+POSIX_FADV_RANDOM = 1
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_WILLNEED = 3
+POSIX_FADV_DONTNEED = 4
+POSIX_FADV_NOREUSE = 5
+
+if _libc is not None:
+    # The 64-bit variant takes 64-bit offsets on 32-bit platforms too.
+    _sendfile = (_function('sendfile64', ctypes.c_ssize_t,
+                           [ctypes.c_int, ctypes.c_int,
+                            ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t])
+                 or _function('sendfile', ctypes.c_ssize_t,
+                              [ctypes.c_int, ctypes.c_int,
+                               ctypes.POINTER(ctypes.c_int64),
+                               ctypes.c_size_t]))
+
+    if _sendfile is not None:
+        def sendfile(out_fd, in_fd, offset, count):
+            """
+            Copy `count` bytes of `in_fd`, beginning at `offset`, to
+            `out_fd` in the kernel and return the number of bytes copied.
+            Raises `OSError` on failure.
+
+            """
+            offset = ctypes.c_int64(offset)
+            sent = _sendfile(out_fd, in_fd, ctypes.byref(offset), count)
+            if sent < 0:
+                _raise_errno()
+            return sent
+
+    _fadvise = (_function('posix_fadvise64', ctypes.c_int,
+                          [ctypes.c_int, ctypes.c_int64, ctypes.c_int64,
+                           ctypes.c_int])
+                or _function('posix_fadvise', ctypes.c_int,
+                             [ctypes.c_int, ctypes.c_int64, ctypes.c_int64,
+                              ctypes.c_int]))
+
+    if _fadvise is not None:
+        def posix_fadvise(fd, offset, length, advice):
+            """
+            Tell the kernel how the `length` bytes of `fd` from `offset`
+            (to the end of the file if `length` is 0) will be accessed.
+            Raises `OSError` on failure.
+
+            """
+            # Returns the error number instead of setting errno.
+            code = _fadvise(fd, offset, length, advice)
+            if code:
+                raise OSError(code, os.strerror(code))
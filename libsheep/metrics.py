@@ -0,0 +1,265 @@
+"""
+Module for opt-in runtime metrics.  Instrumented code checks the module
+attribute `enabled` before recording anything, so metrics cost a single
+attribute lookup when they are disabled (the default).  Call `enable` to
+start recording.
+
+Metrics are counters and histograms, each with an optional label (such as
+a command code).  `snapshot` returns their current values as plain data,
+and `to_prometheus`, `dump` and `MetricsServer` expose them in the
+Prometheus text format.
+
+"""
+import os
+import socket
+import logging
+import threading
+from timeit import default_timer
+
+log = logging.getLogger(__name__)
+
+enabled = False
+
+# Upper bounds, in seconds, of the default latency histogram buckets.
+LATENCY_BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._lock = threading.Lock()
+
+    def _labels(self, value):
+        if value is None:
+            return ''
+        return '{%s="%s"}' % (self.label, value)
+
+class Counter(Metric):
+    """A count, per label value, that only increases."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, label=None):
+        super(Counter, self).__init__(name, help, label)
+        self.values = {}
+
+    def inc(self, amount=1, label=None):
+        with self._lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self.values = {}
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+    def samples(self):
+        for label, value in sorted(self.snapshot().items()):
+            yield (self.name + self._labels(label), value)
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, per label value, counted in
+    cumulative buckets with the upper bounds `buckets`.
+
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, label)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value, label=None):
+        with self._lock:
+            try:
+                counts, total = self.values[label]
+            except KeyError:
+                counts = [0] * (len(self.buckets) + 1)
+                total = 0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.values[label] = (counts, total + value)
+
+    def time(self, label=None):
+        """Return a context manager observing the time spent in it."""
+        return _Timer(self, label)
+
+    def reset(self):
+        with self._lock:
+            self.values = {}
+
+    def snapshot(self):
+        """
+        Return a dictionary mapping each label value to a dictionary with
+        the `count` and `sum` of observed values and the cumulative
+        `buckets` as `(upper bound, count)` tuples.
+
+        """
+        with self._lock:
+            values = dict((label, (list(counts), total))
+                          for label, (counts, total)
+                          in self.values.iteritems())
+        snapshot = {}
+        for label, (counts, total) in values.iteritems():
+            cumulative = []
+            count = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),),
+                                           counts):
+                count += bucket_count
+                cumulative.append((bound, count))
+            snapshot[label] = {'count': count, 'sum': total,
+                               'buckets': cumulative}
+        return snapshot
+
+    def samples(self):
+        for label, value in sorted(self.snapshot().items()):
+            for bound, count in value['buckets']:
+                if bound == float('inf'):
+                    bound = '+Inf'
+                else:
+                    bound = repr(bound)
+                if label is None:
+                    labels = '{le="%s"}' % (bound,)
+                else:
+                    labels = '{%s="%s",le="%s"}' % (self.label, label, bound)
+                yield (self.name + '_bucket' + labels, count)
+            yield (self.name + '_sum' + self._labels(label), value['sum'])
+            yield (self.name + '_count' + self._labels(label),
+                   value['count'])
+
+class _Timer(object):
+    def __init__(self, histogram, label):
+        self.histogram = histogram
+        self.label = label
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.histogram.observe(default_timer() - self.start, self.label)
+
+REGISTRY = {}
+
+def register(metric):
+    REGISTRY[metric.name] = metric
+    return metric
+
+messages_decoded = register(Counter(
+    'libsheep_messages_decoded_total', "Messages decoded.", 'command'))
+message_decode_seconds = register(Histogram(
+    'libsheep_message_decode_seconds', "Time spent decoding messages.",
+    'command'))
+listing_load_seconds = register(Histogram(
+    'libsheep_listing_load_seconds', "Time spent loading file lists."))
+listing_serialize_seconds = register(Histogram(
+    'libsheep_listing_serialize_seconds',
+    "Time spent serializing file lists."))
+listing_entries = register(Counter(
+    'libsheep_listing_entries_total',
+    "Files and directories in loaded or serialized file lists.",
+    'operation'))
+tth_bytes = register(Counter(
+    'libsheep_tth_bytes_total', "Bytes hashed into Tiger trees."))
+tth_seconds = register(Counter(
+    'libsheep_tth_seconds_total', "Time spent hashing Tiger trees."))
+printable_cache = register(Counter(
+    'libsheep_printable_cache_total',
+    "Lookups in the cache of printable characters used to validate paths.",
+    'result'))
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    for metric in REGISTRY.itervalues():
+        metric.reset()
+
+def count_entries(container):
+    """Return the number of files and directories below `container`."""
+    return sum(1 for item in container.walk())
+
+def snapshot():
+    """Return a dictionary mapping metric names to their current values."""
+    return dict((name, metric.snapshot())
+                for name, metric in REGISTRY.iteritems())
+
+def to_prometheus():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    for name in sorted(REGISTRY):
+        metric = REGISTRY[name]
+        lines.append('# HELP %s %s' % (name, metric.help))
+        lines.append('# TYPE %s %s' % (name, metric.type))
+        for sample, value in metric.samples():
+            lines.append('%s %r' % (sample, value))
+    return '\n'.join(lines) + '\n'
+
+def dump(filename):
+    """
+    Write all metrics to `filename` in the Prometheus text format, for
+    example for the node exporter's textfile collector.  The file is
+    replaced atomically.
+
+    """
+    temporary = '%s.%d.tmp' % (filename, os.getpid())
+    with open(temporary, 'w') as f:
+        f.write(to_prometheus())
+    os.rename(temporary, filename)
+
+class MetricsServer(threading.Thread):
+    """
+    Serve the metrics in the Prometheus text format to each connection
+    accepted on `address`: a filename for a Unix socket, or a
+    `(host, port)` tuple for TCP.  Call `close` to stop.
+
+    """
+    def __init__(self, address):
+        super(MetricsServer, self).__init__()
+        self.daemon = True
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(5)
+        self.address = self.socket.getsockname()
+
+    def run(self):
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except socket.error:
+                # Closed.
+                break
+            try:
+                connection.sendall(to_prometheus())
+            except socket.error, e:
+                log.debug("Failed to send metrics: %s", e)
+            finally:
+                connection.close()
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.socket.close()
@@ -0,0 +1,371 @@
+"""
+Module for storing file listings in a compact binary format that can be
+memory-mapped and queried in place, without building a `FileListing`.
+
+A packed listing consists of a header followed by four tables:
+
+    * The directory table, with one fixed-width entry per directory.  The
+      first entry is the listing itself.  Directories are stored
+      breadth-first, so the subdirectories of each directory are contiguous
+      and sorted by name.
+    * The file table, with one fixed-width entry per file.  The files of
+      each directory are contiguous and sorted by name.
+    * The extra attribute table, with an entry for each file that has
+      attributes from extensions (`File.extra`), sorted by file index.  The
+      attributes of a file are stored as one string of alternating names
+      and values separated by NUL characters, which XML cannot contain.
+    * The string table, holding the UTF-8 encoded names (each distinct name
+      is stored once) and the listing's CID, base and generator.
+
+Entries refer to each other and to strings by index and offset, so looking
+up a path only touches the entries along it, and finding a name among the
+children of a directory is a binary search.
+
+"""
+import mmap
+import struct
+import logging
+from libsheep.filelist import FileListing, Directory, File, Container
+from libsheep.path import Path
+
+log = logging.getLogger(__name__)
+
+MAGIC = 'SHEEPLST'
+VERSION = 1
+
+# magic, version, listing version, directory count, file count, directory
+# table offset, file table offset, string table offset, string table length,
+# (offset, length) pairs for the CID, base and generator strings, extra
+# attribute table offset and extra attribute entry count.
+HEADER = struct.Struct('<8sIIIIQQQQIIIIIIQI')
+# name offset, name length, parent, first subdirectory, subdirectory count,
+# first file, file count, flags, total size
+DIRECTORY = struct.Struct('<IIIIIIIIQ')
+# name offset, name length, parent, flags, size, TTH
+FILE = struct.Struct('<IIIIQ24s')
+# file index, attribute string offset, attribute string length
+EXTRA = struct.Struct('<III')
+
+INCOMPLETE = 0x1
+HAS_TTH = 0x1
+NO_SIZE = 0x2
+HAS_EXTRA = 0x4
+
+class PackedItem(object):
+    def __init__(self, packed, index):
+        self.packed = packed
+        self.index = index
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.name)
+
+class PackedDirectory(PackedItem):
+    """A read-only view of a directory entry in a `PackedListing`."""
+
+    def __init__(self, packed, index):
+        super(PackedDirectory, self).__init__(packed, index)
+        (name_offset, name_length, self.parent_index, self.first_directory,
+         self.directory_count, self.first_file, self.file_count, flags,
+         self.total_size) = packed.read_directory(index)
+        self.name = packed.read_string(name_offset, name_length)
+        self.incomplete = bool(flags & INCOMPLETE)
+
+    def directories(self):
+        for index in xrange(self.first_directory,
+                            self.first_directory + self.directory_count):
+            yield PackedDirectory(self.packed, index)
+
+    def files(self):
+        for index in xrange(self.first_file,
+                            self.first_file + self.file_count):
+            yield PackedFile(self.packed, index)
+
+    def __iter__(self):
+        for directory in self.directories():
+            yield directory
+        for item in self.files():
+            yield item
+
+    def __len__(self):
+        return self.directory_count + self.file_count
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        item = self.get(name)
+        if item is None:
+            raise KeyError(name)
+        return item
+
+    def get(self, name, default=None):
+        """Return the child named `name`, or `default` if there is none."""
+        packed = self.packed
+        key = name.encode('utf-8')
+        index = packed.search(packed.read_directory, key,
+                              self.first_directory, self.directory_count)
+        if index is not None:
+            return PackedDirectory(packed, index)
+        index = packed.search(packed.read_file, key, self.first_file,
+                              self.file_count)
+        if index is not None:
+            return PackedFile(packed, index)
+        return default
+
+class PackedFile(PackedItem):
+    """A read-only view of a file entry in a `PackedListing`."""
+
+    def __init__(self, packed, index):
+        super(PackedFile, self).__init__(packed, index)
+        (name_offset, name_length, self.parent_index, flags, size,
+         tth) = packed.read_file(index)
+        self.name = packed.read_string(name_offset, name_length)
+        if flags & NO_SIZE:
+            self.size = None
+        else:
+            self.size = size
+        if flags & HAS_TTH:
+            self.tth = tth
+        else:
+            self.tth = None
+        if flags & HAS_EXTRA:
+            self.extra = packed.read_extra(index)
+        else:
+            self.extra = ()
+
+class PackedListing(object):
+    """
+    A file listing in the packed binary format, backed by `data`, which is
+    a string or a memory map.  Use `open` to map a file.
+
+    """
+    def __init__(self, data):
+        self.data = data
+        header = HEADER.unpack_from(data, 0)
+        if header[0] != MAGIC:
+            raise RuntimeError("Not a packed file listing.")
+        if header[1] != VERSION:
+            raise RuntimeError("Unsupported packed file listing version.")
+        (self.version, self.directory_count, self.file_count,
+         self._directories_offset, self._files_offset,
+         self._strings_offset) = header[2:8]
+        self.client_id = self.read_string(*header[9:11])
+        self.base = Path(self.read_string(*header[11:13]))
+        self.generator = self.read_string(*header[13:15]) or None
+        self._extra_offset, self.extra_count = header[15:17]
+
+    @classmethod
+    def open(cls, filename):
+        """Memory-map the packed listing in the file `filename`."""
+        with open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    @property
+    def root(self):
+        return PackedDirectory(self, 0)
+
+    @property
+    def total_size(self):
+        return self.root.total_size
+
+    def read_directory(self, index):
+        return DIRECTORY.unpack_from(
+            self.data, self._directories_offset + index * DIRECTORY.size)
+
+    def read_file(self, index):
+        return FILE.unpack_from(self.data,
+                                self._files_offset + index * FILE.size)
+
+    def read_extra(self, file_index):
+        """
+        Return the extra attributes of the file at `file_index` as a tuple
+        of `(name, value)` pairs.
+
+        """
+        low = 0
+        high = self.extra_count
+        while low < high:
+            middle = (low + high) // 2
+            index, offset, length = EXTRA.unpack_from(
+                self.data, self._extra_offset + middle * EXTRA.size)
+            if index < file_index:
+                low = middle + 1
+            elif index > file_index:
+                high = middle
+            else:
+                fields = self.read_string(offset, length).split(u'\0')
+                return tuple(zip(fields[::2], fields[1::2]))
+        return ()
+
+    def read_name(self, read_entry, index):
+        name_offset, name_length = read_entry(index)[:2]
+        start = self._strings_offset + name_offset
+        return self.data[start:start + name_length]
+
+    def read_string(self, offset, length):
+        start = self._strings_offset + offset
+        return self.data[start:start + length].decode('utf-8')
+
+    def search(self, read_entry, key, first, count):
+        """
+        Return the index of the entry named `key` (UTF-8 encoded) among the
+        `count` sorted entries beginning at `first`, or None.
+
+        """
+        low = first
+        high = first + count
+        while low < high:
+            middle = (low + high) // 2
+            name = self.read_name(read_entry, middle)
+            if name < key:
+                low = middle + 1
+            elif name > key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def get(self, path):
+        """
+        Return the `PackedDirectory` or `PackedFile` at the relative or
+        absolute path `path`, or None if there is no such item.
+
+        """
+        path = Path(path)
+        if path.is_absolute:
+            if path == self.base:
+                return self.root
+            path = path.relative_to(self.base)
+        item = self.root
+        for name in path.names:
+            if not name:
+                break
+            if not isinstance(item, PackedDirectory):
+                return None
+            item = item.get(name)
+            if item is None:
+                return None
+        if path.is_directory and not isinstance(item, PackedDirectory):
+            return None
+        return item
+
+    def to_listing(self):
+        """Build and return the equivalent `FileListing`."""
+        listing = FileListing(self.client_id, self.base, self.version,
+                              self.generator)
+        containers = [listing]
+        for index in xrange(1, self.directory_count):
+            directory = PackedDirectory(self, index)
+            parent = containers[directory.parent_index]
+            container = Directory(directory.name, directory.incomplete)
+            container.parent = parent
+            parent.contents[container.name] = container
+            containers.append(container)
+        for index in xrange(self.file_count):
+            packed_file = PackedFile(self, index)
+            parent = containers[packed_file.parent_index]
+            item = File(packed_file.name, packed_file.size)
+            if packed_file.tth is not None:
+                item.tth = packed_file.tth
+            if packed_file.extra:
+                item.extra = packed_file.extra
+            parent.contents[item.name] = item
+        return listing
+
+    @classmethod
+    def from_xml(cls, file_or_name):
+        """Pack the XML file listing in `file_or_name`."""
+        return cls(pack(FileListing.from_file(file_or_name)))
+
+    def write_xml(self, file_or_name):
+        """Write this listing as XML to `file_or_name`."""
+        self.to_listing().write(file_or_name)
+
+def _utf8(string):
+    if isinstance(string, unicode):
+        return string.encode('utf-8')
+    return string
+
+def pack(listing):
+    """Return the packed binary representation of `listing`."""
+    strings = []
+    string_offsets = {}
+    state = {'length': 0}
+    def add_string(string):
+        string = _utf8(string)
+        try:
+            return (string_offsets[string], len(string))
+        except KeyError:
+            offset = string_offsets[string] = state['length']
+            strings.append(string)
+            state['length'] += len(string)
+            return (offset, len(string))
+
+    meta = (add_string(unicode(listing.client_id or '')) +
+            add_string(unicode(listing.base)) +
+            add_string(unicode(listing.generator or '')))
+
+    # Lay out directories breadth-first, so that the subdirectories of each
+    # directory are contiguous.
+    directories = [(listing, 0)]
+    files = []
+    directory_entries = []
+    position = 0
+    while position < len(directories):
+        container, parent_index = directories[position]
+        subdirectories = []
+        container_files = []
+        for name, item in container.contents.iteritems():
+            if isinstance(item, Container):
+                subdirectories.append((_utf8(name), item))
+            else:
+                container_files.append((_utf8(name), item))
+        subdirectories.sort()
+        container_files.sort()
+        flags = getattr(container, 'incomplete', False) and INCOMPLETE or 0
+        name = getattr(container, 'name', '')
+        directory_entries.append(add_string(name) + (
+            parent_index, len(directories), len(subdirectories), len(files),
+            len(container_files), flags, container.total_size))
+        for name, item in subdirectories:
+            directories.append((item, position))
+        for name, item in container_files:
+            files.append((item, position))
+        position += 1
+
+    chunks = []
+    extra_chunks = []
+    for entry in directory_entries:
+        chunks.append(DIRECTORY.pack(*entry))
+    for index, (item, parent_index) in enumerate(files):
+        flags = 0
+        tth = getattr(item, 'tth', None)
+        if tth is not None:
+            flags |= HAS_TTH
+        if item.size is None:
+            flags |= NO_SIZE
+        if item.extra:
+            flags |= HAS_EXTRA
+            fields = u'\0'.join(u'%s\0%s' % pair for pair in item.extra)
+            extra_chunks.append(EXTRA.pack(index, *add_string(fields)))
+        chunks.append(FILE.pack(*add_string(item.name) + (
+            parent_index, flags, item.size or 0, tth or '')))
+    directories_offset = HEADER.size
+    files_offset = directories_offset + len(directory_entries) * DIRECTORY.size
+    extra_offset = files_offset + len(files) * FILE.size
+    strings_offset = extra_offset + len(extra_chunks) * EXTRA.size
+    header = HEADER.pack(*(
+        (MAGIC, VERSION, listing.version, len(directory_entries),
+         len(files), directories_offset, files_offset, strings_offset,
+         state['length']) + meta + (extra_offset, len(extra_chunks))))
+    return ''.join([header] + chunks + extra_chunks + strings)
+
+def write(listing, filename):
+    """Pack `listing` and write it to the file `filename`."""
+    with open(filename, 'wb') as f:
+        f.write(pack(listing))
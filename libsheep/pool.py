@@ -0,0 +1,203 @@
+"""
+Module for reusing client-client connections.  Setting up a connection to
+another client takes a `CTM` or `RCM` through the hub, a TCP (and perhaps
+TLS) handshake and a `SUP`/`INF` exchange, which dominates the time taken
+by small transfers.  A `ConnectionPool` keeps connections that finished a
+transfer open, keyed by the peer's CID, and hands them out again for the
+next `GET` (file list, TTH leaves or file segment) from the same peer.
+
+The number of connections is limited per peer and in total.  Idle
+connections are closed after `idle_timeout` seconds, and the least recently
+used idle connection is closed when the total limit is reached and a
+connection to another peer is needed.
+
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+class PoolTimeout(RuntimeError):
+    pass
+
+class ConnectionPool(object):
+    """
+    A pool of connections created by calling `connect` with a peer's CID.
+    The callable must return a connection ready for `GET` requests, with a
+    `close` method.
+
+    """
+    def __init__(self, connect, max_per_peer=2, max_total=32,
+                 idle_timeout=60.0, clock=time.time):
+        self.connect = connect
+        self.max_per_peer = max_per_peer
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.total = 0
+        # Open connections (busy, idle or being connected) per peer.
+        self._open = {}
+        # Idle connections, least recently used first, mapped to their
+        # peer and the time they became idle.
+        self._idle = OrderedDict()
+        self._idle_by_peer = {}
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return self.total
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def acquire(self, cid, timeout=None):
+        """
+        Return a connection to the peer `cid`: an idle one if there is one,
+        otherwise a new one if the limits allow.  Otherwise wait for one to
+        be released, raising `PoolTimeout` after `timeout` seconds.
+
+        """
+        deadline = timeout is not None and self.clock() + timeout
+        with self._condition:
+            while True:
+                closing = self._expire()
+                connection = self._take_idle(cid)
+                if connection is not None:
+                    break
+                if self._open.get(cid, 0) < self.max_per_peer:
+                    if self.total >= self.max_total and self._idle:
+                        closing.append(self._evict())
+                    if self.total < self.max_total:
+                        self._open[cid] = self._open.get(cid, 0) + 1
+                        self.total += 1
+                        break
+                self._close_all(closing)
+                if deadline is False:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        raise PoolTimeout("No connection to %s available."
+                                          % (cid,))
+                    self._condition.wait(remaining)
+        self._close_all(closing)
+        if connection is not None:
+            return connection
+        try:
+            return self.connect(cid)
+        except:
+            self._forget(cid)
+            raise
+
+    def release(self, cid, connection, reusable=True):
+        """
+        Return `connection` to the peer `cid` to the pool.  If it is not
+        `reusable` (for example, after a failed transfer), it is closed.
+
+        """
+        if not reusable:
+            self.discard(cid, connection)
+            return
+        with self._condition:
+            self._idle[connection] = (cid, self.clock())
+            self._idle_by_peer.setdefault(cid, []).append(connection)
+            self._condition.notify_all()
+
+    def discard(self, cid, connection):
+        """Close `connection` to the peer `cid` and forget about it."""
+        try:
+            connection.close()
+        finally:
+            self._forget(cid)
+
+    @contextmanager
+    def connection(self, cid, timeout=None):
+        """
+        Return a context manager providing a connection to the peer `cid`,
+        which is released when the block finishes, or discarded if it
+        raises an exception.
+
+        """
+        connection = self.acquire(cid, timeout)
+        try:
+            yield connection
+        except:
+            self.discard(cid, connection)
+            raise
+        else:
+            self.release(cid, connection)
+
+    def expire(self):
+        """Close idle connections older than `idle_timeout`."""
+        with self._condition:
+            closing = self._expire()
+        self._close_all(closing)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._condition:
+            closing = []
+            while self._idle:
+                closing.append(self._evict())
+        self._close_all(closing)
+
+    def _forget(self, cid):
+        # The condition's lock is reentrant, so this is also called with it
+        # held.
+        with self._condition:
+            count = self._open[cid] - 1
+            if count:
+                self._open[cid] = count
+            else:
+                del self._open[cid]
+            self.total -= 1
+            self._condition.notify_all()
+
+    def _take_idle(self, cid):
+        connections = self._idle_by_peer.get(cid)
+        if not connections:
+            return None
+        # Prefer the most recently used connection; the others are more
+        # likely to have been closed by the peer.
+        connection = connections.pop()
+        if not connections:
+            del self._idle_by_peer[cid]
+        del self._idle[connection]
+        return connection
+
+    def _evict(self):
+        """
+        Remove the least recently used idle connection from the pool and
+        return it, to be closed by the caller.
+
+        """
+        connection, (cid, since) = self._idle.popitem(last=False)
+        connections = self._idle_by_peer[cid]
+        connections.remove(connection)
+        if not connections:
+            del self._idle_by_peer[cid]
+        self._forget(cid)
+        return connection
+
+    def _expire(self):
+        closing = []
+        if self.idle_timeout is None:
+            return closing
+        oldest = self.clock() - self.idle_timeout
+        while self._idle:
+            cid, since = next(self._idle.itervalues())
+            if since > oldest:
+                break
+            closing.append(self._evict())
+        return closing
+
+    def _close_all(self, connections):
+        while connections:
+            connection = connections.pop()
+            try:
+                connection.close()
+            except Exception, e:
+                log.debug("Failed to close idle connection: %s", e)
@@ -1,9 +1,22 @@
 import re
+from timeit import default_timer
+from libsheep import metrics
 from libsheep.parameters import DeclarativeParameterMeta, Parameter, Base32, Set
 
 class ProtocolError(RuntimeError):
     pass
 
+def escape(value):
+    """
+    Escape spaces, newlines and backslashes in the parameter `value`.
+    
+    >>> escape('Slots full')
+    'Slots\\\\sfull'
+    
+    """
+    # `str.replace` is faster than `re.sub` in this case.
+    return value.replace('\\', '\\\\').replace(' ', '\\s').replace('\n', '\\n')
+
 class MessagePart(object):
     __metaclass__ = DeclarativeParameterMeta
     
@@ -34,6 +47,10 @@ class MessagePart(object):
             codes = [cls.__name__]
         for code in codes:
             cls.REGISTRY[code] = cls
+    
+    def encode(self):
+        """Return the parameter tokens of this message part."""
+        return ()
 
 class Context(MessagePart):
     REGISTRY = {}
@@ -58,8 +75,30 @@ class Message(object):
     def __repr__(self):
         return "Message(%r, %r)" % (self.context.code, self.command.code)
     
+    def encode(self):
+        """
+        Return the message as a UTF-8 encoded line, ready to be written to
+        a connection.
+        
+        """
+        tokens = [self.context.code + self.command.code]
+        tokens.extend(map(escape, self.context.encode()))
+        tokens.extend(map(escape, self.command.encode()))
+        return (u' '.join(tokens) + u'\n').encode('utf-8')
+    
     @classmethod
     def decode(cls, tokens):
+        if not metrics.enabled:
+            return cls._decode(tokens)
+        start = default_timer()
+        message = cls._decode(tokens)
+        code = message.command.code
+        metrics.message_decode_seconds.observe(default_timer() - start, code)
+        metrics.messages_decoded.inc(label=code)
+        return message
+    
+    @classmethod
+    def _decode(cls, tokens):
         if isinstance(tokens, basestring):
             tokens = tokens.split()
         else:
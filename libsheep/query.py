@@ -0,0 +1,212 @@
+"""
+Module for querying file listings by name pattern, location and size.
+
+A `Query` compiles its predicates once and can be run against any number of
+listings.  Each listing is searched through a `NameIndex`, which flattens
+the listing into columns: the names of all items joined into one string,
+with parallel arrays of sizes and parent directories.  A glob pattern is
+matched with a single regular expression scan over the name column (user
+regular expressions are matched against each name in turn, so that their
+anchors apply to whole names), and because items are stored depth-first,
+the items below a directory form a contiguous range, so restricting a
+query to a directory only scans that range.
+
+"""
+import re
+import bisect
+import logging
+from array import array
+from libsheep.filelist import Container
+from libsheep.path import Path
+
+log = logging.getLogger(__name__)
+
+# Names can't contain unprintable characters, so this separates them in the
+# name column.
+SEPARATOR = u'\n'
+# The size of directories in the size column.
+DIRECTORY_SIZE = -1
+
+def glob_to_regex(pattern):
+    """
+    Return a regular expression matching a whole name in the name column
+    against the glob `pattern`, where '*' matches any run of characters and
+    '?' matches any single character.
+
+    >>> glob_to_regex(u'*.flac')
+    u'^[^\\\\n]*\\\\.flac$'
+
+    """
+    parts = [u'^']
+    for char in pattern:
+        if char == u'*':
+            parts.append(u'[^\\n]*')
+        elif char == u'?':
+            parts.append(u'[^\\n]')
+        else:
+            parts.append(re.escape(char))
+    parts.append(u'$')
+    return u''.join(parts)
+
+class NameIndex(object):
+    """
+    A flattened, read-only index of the items in the `FileListing` instance
+    `listing`.  The index is not updated when the listing changes; build a
+    new one (`FileListing.query` does this automatically).
+
+    """
+    def __init__(self, listing):
+        self.digest = listing.digest
+        self.items = []
+        self.sizes = array('l')
+        self.parents = array('l')
+        self.starts = array('l')
+        # Absolute path strings of the directories, the listing itself being
+        # directory 0, and the range of item indexes below each.
+        self.directories = [unicode(listing.base)]
+        self.first = array('l', [0])
+        self.end = array('l', [0])
+        self._directory_numbers = {self.directories[0].lower(): 0}
+        names = []
+        offset = 0
+        stack = [(0, listing.contents.itervalues())]
+        while stack:
+            number, items = stack[-1]
+            for item in items:
+                self.items.append(item)
+                self.parents.append(number)
+                self.starts.append(offset)
+                names.append(item.name)
+                offset += len(item.name) + 1
+                if isinstance(item, Container):
+                    self.sizes.append(DIRECTORY_SIZE)
+                    path = (self.directories[number] +
+                            Path.escape(item.name) + u'/')
+                    child = len(self.directories)
+                    self.directories.append(path)
+                    self._directory_numbers[path.lower()] = child
+                    self.first.append(len(self.items))
+                    self.end.append(0)
+                    stack.append((child, item.contents.itervalues()))
+                    break
+                else:
+                    self.sizes.append(item.size or 0)
+            else:
+                stack.pop()
+                self.end[number] = len(self.items)
+        names.append(u'')
+        self.names = SEPARATOR.join(names)
+
+    def __len__(self):
+        return len(self.items)
+
+    def directory_range(self, path):
+        """
+        Return the `(first, end)` range of indexes of the items below the
+        directory at the absolute path `path`, or None if there is no such
+        directory.
+
+        """
+        number = self._directory_numbers.get(unicode(path).lower())
+        if number is None:
+            return None
+        return (self.first[number], self.end[number])
+
+    def index_at(self, offset):
+        """Return the index of the item whose name contains `offset`."""
+        return bisect.bisect_right(self.starts, offset) - 1
+
+    def path(self, index):
+        """Return the absolute path string of the item at `index`."""
+        path = (self.directories[self.parents[index]] +
+                Path.escape(self.items[index].name))
+        if self.sizes[index] == DIRECTORY_SIZE:
+            return path + u'/'
+        return path
+
+class Query(object):
+    """
+    A compiled query for items whose name matches the glob `pattern` (case
+    insensitively) or the regular expression `regex` (a string or compiled
+    pattern, searched for anywhere in the name), that are below the
+    directory `under`, and whose size is between `min_size` and `max_size`
+    inclusive.  Omitted predicates match everything.  Only files match
+    unless `files_only` is False; directories never match size predicates.
+
+    """
+    def __init__(self, pattern=None, regex=None, under=None, min_size=None,
+                 max_size=None, files_only=True):
+        if pattern is not None and regex is not None:
+            raise RuntimeError("Use either a glob pattern or a regex.")
+        if pattern is not None:
+            self.matcher = re.compile(glob_to_regex(unicode(pattern)),
+                                      re.IGNORECASE | re.MULTILINE |
+                                      re.UNICODE)
+            self.anchored = True
+        elif regex is not None:
+            if isinstance(regex, basestring):
+                regex = re.compile(regex, re.UNICODE)
+            self.matcher = regex
+            self.anchored = False
+        else:
+            self.matcher = None
+        self.under = under is not None and Path(under) or None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.files_only = (files_only or min_size is not None or
+                           max_size is not None)
+
+    def run(self, listing, index=None):
+        """
+        Yield a `(path, item)` tuple, where `path` is the absolute path
+        string of `item`, for each matching item in the `FileListing`
+        instance `listing`, in depth-first order.  `index` is a `NameIndex`
+        of `listing`, which is built if not given.
+
+        """
+        if index is None:
+            index = NameIndex(listing)
+        if self.under is None:
+            first, end = 0, len(index)
+        else:
+            under = self.under
+            if under.is_relative:
+                under = listing.base.join(under)
+            bounds = index.directory_range(under)
+            if bounds is None:
+                return
+            first, end = bounds
+        for i in self._candidates(index, first, end):
+            size = index.sizes[i]
+            if size == DIRECTORY_SIZE:
+                if self.files_only:
+                    continue
+            else:
+                if self.min_size is not None and size < self.min_size:
+                    continue
+                if self.max_size is not None and size > self.max_size:
+                    continue
+            yield (index.path(i), index.items[i])
+
+    def _candidates(self, index, first, end):
+        if first == end:
+            return
+        if self.matcher is None:
+            for i in xrange(first, end):
+                yield i
+            return
+        if self.anchored:
+            starts = index.starts
+            names = index.names
+            start = starts[first]
+            stop = starts[end] - 1 if end < len(starts) else len(names) - 1
+            for match in self.matcher.finditer(names, start, stop):
+                yield index.index_at(match.start())
+            return
+        # A user regex may use '^' and '$' or match the separator, so it is
+        # matched against each name on its own.
+        search = self.matcher.search
+        items = index.items
+        for i in xrange(first, end):
+            if search(items[i].name):
+                yield i
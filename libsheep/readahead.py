@@ -0,0 +1,150 @@
+"""
+Module for reading files ahead of the code consuming them.  `ReadAhead`
+runs a reader thread that fills a small ring of preallocated buffers while
+the consumer (typically hashing) works through the previous ones, so the
+disk and the CPU are busy at the same time instead of taking turns.
+
+Where `posix_fadvise` is available (`os.posix_fadvise` on Python 3, or
+libc's on Linux), the kernel is told that the file is read sequentially,
+and pages that have been read are dropped from the page cache so that a
+rehash of the whole share does not evict the data being uploaded.  Reading
+may also be limited to a rate in bytes per second, so that background
+hashing leaves disk bandwidth for transfers.
+
+"""
+import os
+import sys
+import time
+import logging
+import threading
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+from libsheep import libc
+from libsheep.bandwidth import TokenBucket
+
+log = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024 * 1024
+BUFFERS = 4
+
+# Python 2 has no `os.posix_fadvise`; on Linux, libc's is called through
+# ctypes.
+fadvise = getattr(os, 'posix_fadvise', None) or libc.posix_fadvise
+
+class ReadAhead(object):
+    """
+    Iterate over the contents of the file object `f`, from its current
+    position, in read-only buffers of up to `block_size` bytes.  Every
+    buffer but the last is full.  Each buffer is only valid until the next
+    one is requested, since its memory is reused for reading ahead.
+
+    Up to `buffers` buffers are read ahead, at no more than `rate` bytes per
+    second if given.  If `drop_cache` is true, pages that have been read are
+    dropped from the page cache where possible.
+
+    Iterating starts a reader thread, which is stopped when the iteration
+    ends, including when the consumer stops early, or when `close` is
+    called.
+
+    """
+    def __init__(self, f, block_size=BLOCK_SIZE, buffers=BUFFERS, rate=None,
+                 drop_cache=True, sleep=time.sleep):
+        self.file = f
+        self.block_size = block_size
+        self.bucket = rate and TokenBucket(rate, block_size) or None
+        self.drop_cache = drop_cache
+        self.sleep = sleep
+        self._free = Queue()
+        for i in xrange(buffers):
+            self._free.put(bytearray(block_size))
+        self._full = Queue()
+        self._closed = False
+        self._error = None
+        self._reader = None
+
+    def __iter__(self):
+        self._reader = threading.Thread(target=self._read)
+        self._reader.daemon = True
+        self._reader.start()
+        try:
+            while True:
+                data, count = self._full.get()
+                if data is None:
+                    if self._error is not None:
+                        raise self._error[0], self._error[1], self._error[2]
+                    return
+                try:
+                    yield buffer(data, 0, count)
+                finally:
+                    self._free.put(data)
+        finally:
+            # Stops the reader if the consumer gives up early.
+            self.close()
+
+    def close(self):
+        """Stop reading ahead and wait for the reader thread to exit."""
+        self._closed = True
+        # Wakes the reader if it is waiting for a free buffer.
+        self._free.put(None)
+        if (self._reader is not None and
+            self._reader is not threading.current_thread()):
+            self._reader.join()
+
+    def _read(self):
+        try:
+            offset = 0
+            try:
+                fd = self.file.fileno()
+                offset = self.file.tell()
+            except (AttributeError, IOError):
+                fd = None
+            else:
+                self._advise(fd, offset, 0, 'POSIX_FADV_SEQUENTIAL')
+            while not self._closed:
+                data = self._free.get()
+                if data is None:
+                    break
+                count = self._fill(data)
+                if count:
+                    if self.drop_cache and fd is not None:
+                        self._advise(fd, offset, count, 'POSIX_FADV_DONTNEED')
+                    offset += count
+                    if self.bucket is not None:
+                        delay = self.bucket.reserve(count)
+                        if delay > 0:
+                            self.sleep(delay)
+                    self._full.put((data, count))
+                if count < len(data):
+                    break
+        except Exception:
+            self._error = sys.exc_info()
+        finally:
+            self._full.put((None, 0))
+
+    def _fill(self, data):
+        """Read into `data` until it is full or the file ends."""
+        view = memoryview(data)
+        readinto = getattr(self.file, 'readinto', None)
+        count = 0
+        while count < len(data):
+            if readinto is not None:
+                read = readinto(view[count:])
+            else:
+                chunk = self.file.read(len(data) - count)
+                read = len(chunk)
+                data[count:count + read] = chunk
+            if not read:
+                break
+            count += read
+        return count
+
+    def _advise(self, fd, offset, length, name):
+        if fadvise is None:
+            return
+        try:
+            fadvise(fd, offset, length, getattr(os, name, None) or
+                    getattr(libc, name))
+        except OSError, e:
+            log.debug("Unable to advise the kernel on file access: %s", e)
@@ -0,0 +1,661 @@
+"""
+Module for mapping local directories onto the `FileListing` we advertise to
+other clients.  A `Share` knows where each top-level shared directory lives
+on disk and indexes shared files by their TTH, so that `GET` requests naming
+either a path or a `TTH/...` identifier can be resolved to a local file.
+
+`Scanner` keeps a `Share` in sync with the filesystem.  A scan walks the
+shared directories in parallel, compares what it finds with the listing by
+size and modification time, and queues only new or changed files for
+hashing.  `ShareWatcher` applies inotify events as they happen, so that a
+full scan is rarely needed at all.
+
+The listing is only changed by the thread running the scanner, which also
+applies the watcher's events.  Readers in other threads (such as upload
+threads serving file lists) use the snapshot in `Share.published`.  A
+snapshot makes the next change to each container copy it, so changes made
+one after another (a scan, a rehash, or a burst of events) are made in a
+batch and published at its end, or every `publish_interval` seconds.
+
+"""
+import os
+import sys
+import stat
+import time
+import logging
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+from libsheep.filelist import FileListing, Container, NotFound
+from libsheep.path import Path, InvalidPath
+from libsheep.utils import b32decode
+
+log = logging.getLogger(__name__)
+
+FS_ENCODING = sys.getfilesystemencoding() or 'utf-8'
+
+# inotify event masks, as defined by the kernel, so that events can also be
+# handled without pyinotify.
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+class Share(object):
+    TTH_PREFIX = 'TTH/'
+
+    def __init__(self, file_list=None):
+        if file_list is None:
+            file_list = FileListing(None)
+        self.file_list = file_list
+        self.roots = {}
+        self.by_tth = {}
+        self.published = None
+        self._batches = 0
+        self.publish()
+
+    @property
+    def size(self):
+        """The total size of all shared files."""
+        return self.file_list.total_size
+
+    @property
+    def file_count(self):
+        """The number of shared files."""
+        return self.file_list.file_count
+
+    def update_info(self, info):
+        """Set the share size fields of the `INF` command `info`."""
+        info.share_size = self.size
+        info.shared_files = self.file_count
+
+    def publish(self, force=False):
+        """
+        Replace `published` with a snapshot of the listing if it has changed
+        since the last one.  Changes made inside a `batch` block are only
+        published when the block ends, unless `force` is true.
+
+        """
+        if self._batches and not force:
+            return
+        published = self.published
+        if (published is None or
+            published.generation != self.file_list.generation):
+            self.published = self.file_list.snapshot()
+
+    @contextmanager
+    def batch(self):
+        """
+        Return a context manager that holds back publishing the changes made
+        in its block until the block ends.
+
+        """
+        self._batches += 1
+        try:
+            yield self
+        finally:
+            self._batches -= 1
+            self.publish()
+
+    def add_root(self, local_dir, name=None):
+        """
+        Share the local directory `local_dir` as a top-level directory named
+        `name` (by default, the last component of `local_dir`) and return
+        the `Directory` instance representing it.
+
+        """
+        if isinstance(local_dir, str):
+            # Unicode directory names make the filesystem return unicode
+            # file names, which is what `Path` expects.
+            local_dir = local_dir.decode(FS_ENCODING)
+        local_dir = os.path.abspath(local_dir)
+        if name is None:
+            name = os.path.basename(local_dir.rstrip(os.sep))
+        self.roots[name] = local_dir
+        root = self.file_list.add(Path([name, '']))
+        self.publish()
+        return root
+
+    def remove_root(self, name):
+        """Stop sharing the top-level directory `name`."""
+        self.roots.pop(name, None)
+        removed = self.file_list.remove(Path([name, '']))
+        if removed is not None:
+            for parents, item in removed.walk(files_only=True):
+                self._unindex(item)
+        self.publish()
+        return removed
+
+    def add_file(self, path, size, tth=None, **kwargs):
+        """
+        Add the file at the shared path `path` with the given `size` and
+        binary `tth` digest to the file listing, and return the `File`.
+
+        """
+        item = self.file_list.add(path, True, size=size, tth=tth, **kwargs)
+        if tth is not None:
+            self.by_tth[tth] = self._full_path(path)
+        self.publish()
+        return item
+
+    def remove(self, path):
+        """Remove the item at the shared path `path` and return it."""
+        item = self.file_list.remove(path)
+        if isinstance(item, Container):
+            for parents, child in item.walk(files_only=True):
+                self._unindex(child)
+        elif item is not None:
+            self._unindex(item)
+        self.publish()
+        return item
+
+    def move(self, old_path, new_path):
+        """
+        Move the item at the shared path `old_path` to `new_path`, keeping
+        its metadata (including TTHs, so nothing needs to be rehashed), and
+        return it.  Return None if there is no item at `old_path`.
+
+        """
+        with self.batch():
+            return self._move(old_path, new_path)
+
+    def _move(self, old_path, new_path):
+        item = self.remove(old_path)
+        if item is None:
+            return None
+        item = self.file_list.unshare(item)
+        new_path = self._full_path(new_path)
+        if new_path.is_directory:
+            item.name = new_path[-2]
+        else:
+            item.name = new_path[-1]
+        parent_path = new_path.parent
+        if parent_path is None or parent_path == self.file_list.base:
+            parent = self.file_list
+        else:
+            parent = self.file_list.add(parent_path)
+        parent[item.name] = item
+        self.file_list.generation += 1
+        if isinstance(item, Container):
+            for parents, child in item.walk(files_only=True):
+                if getattr(child, 'tth', None) is not None:
+                    child_path = Path(parents + (child.name,))
+                    self._index(new_path.join(child_path), child)
+        else:
+            self._index(new_path, item)
+        return item
+
+    def _index(self, path, item):
+        tth = getattr(item, 'tth', None)
+        if tth is not None:
+            self.by_tth[tth] = path
+
+    def _unindex(self, item):
+        tth = getattr(item, 'tth', None)
+        if tth is not None:
+            self.by_tth.pop(tth, None)
+
+    def _full_path(self, path):
+        path = Path(path)
+        if path.is_relative:
+            path = self.file_list.base.join(path)
+        return path
+
+    def local_path(self, path):
+        """
+        Return the local filename corresponding to the shared path `path`.
+        Raises `NotFound` if `path` is not under a shared root.
+
+        """
+        path = self._full_path(path)
+        try:
+            names = path.relative_to(self.file_list.base).names
+        except RuntimeError:
+            raise NotFound("%r" % (path,))
+        try:
+            local_dir = self.roots[names[0]]
+        except KeyError:
+            raise NotFound("%r" % (path,))
+        return os.path.join(local_dir, *names[1:])
+
+    def shared_path(self, local_path):
+        """
+        Return the shared path corresponding to the local filename
+        `local_path`, as a file path (without a trailing slash).  Raises
+        `NotFound` if `local_path` is not in a shared directory, or if it
+        can't be decoded with the filesystem encoding.
+
+        """
+        if isinstance(local_path, str):
+            try:
+                local_path = local_path.decode(FS_ENCODING)
+            except UnicodeError:
+                raise NotFound("%r" % (local_path,))
+        local_path = os.path.abspath(local_path)
+        for name, local_dir in self.roots.iteritems():
+            if local_path == local_dir:
+                return Path([name])
+            prefix = os.path.join(local_dir, '')
+            if local_path.startswith(prefix):
+                names = local_path[len(prefix):].split(os.sep)
+                return Path([name] + names)
+        raise NotFound("%r" % (local_path,))
+
+    def resolve(self, identifier):
+        """
+        Return a `(local_path, item)` tuple for the file named by
+        `identifier`, which is either a `TTH/...` identifier or a shared
+        path.  Raises `NotFound` if there is no such file.
+
+        """
+        if identifier.startswith(self.TTH_PREFIX):
+            try:
+                tth = b32decode(identifier[len(self.TTH_PREFIX):])
+            except TypeError:
+                raise NotFound("%r" % (identifier,))
+            try:
+                path = self.by_tth[tth]
+            except KeyError:
+                raise NotFound("%r" % (identifier,))
+        else:
+            try:
+                path = Path(identifier)
+            except InvalidPath:
+                raise NotFound("%r" % (identifier,))
+            if path.is_directory:
+                raise NotFound("%r" % (identifier,))
+        try:
+            item = self.file_list.get(path)
+        except RuntimeError:
+            raise NotFound("%r" % (identifier,))
+        if isinstance(item, Container):
+            raise NotFound("%r" % (identifier,))
+        return (self.local_path(path), item)
+
+def list_directory(local_dir):
+    """
+    Return a `(directories, files)` tuple describing the contents of
+    `local_dir`, where `directories` is a list of subdirectory names and
+    `files` is a list of `(name, size, mtime)` tuples.  Symbolic links to
+    directories are not followed.
+
+    """
+    directories = []
+    files = []
+    try:
+        if scandir is not None:
+            for entry in scandir(local_dir):
+                if _undecodable(local_dir, entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.name)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        files.append((entry.name, st.st_size,
+                                      int(st.st_mtime)))
+                except OSError:
+                    # The entry vanished while we were looking at it.
+                    continue
+        else:
+            for name in os.listdir(local_dir):
+                if _undecodable(local_dir, name):
+                    continue
+                try:
+                    st = os.lstat(os.path.join(local_dir, name))
+                    if stat.S_ISLNK(st.st_mode):
+                        st = os.stat(os.path.join(local_dir, name))
+                        if stat.S_ISDIR(st.st_mode):
+                            continue
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    directories.append(name)
+                elif stat.S_ISREG(st.st_mode):
+                    files.append((name, st.st_size, int(st.st_mtime)))
+    except OSError as e:
+        log.warning("Unable to list %r: %s", local_dir, e)
+    return (directories, files)
+
+def _undecodable(local_dir, name):
+    """
+    Return True (and warn) if `name`, listed in the unicode directory
+    `local_dir`, is a byte string because it isn't in the filesystem
+    encoding.  Such names can't be shared.
+
+    """
+    if isinstance(local_dir, unicode) and not isinstance(name, unicode):
+        log.warning("Not sharing %r in %r: name is not in the filesystem "
+                    "encoding", name, local_dir)
+        return True
+    return False
+
+def _list_names(args):
+    names, local_dir = args
+    return (names, local_dir) + list_directory(local_dir)
+
+def tiger_tree_hash(local_path, rate=None):
+    """
+    Return the binary TTH root of the file at `local_path`, reading it at
+    no more than `rate` bytes per second if given.
+
+    """
+    # Imported here, since hashing support is optional.
+    from libsheep.tth import TigerTreeHash
+    with open(local_path, 'rb') as f:
+        return str(TigerTreeHash(f, rate=rate).root)
+
+class Scanner(object):
+    """
+    Keep `share` in sync with the filesystem.  Directories are listed by a
+    pool of `threads` threads, since listing and stat calls spend most of
+    their time waiting on the disk.
+
+    New and changed files are removed from the listing (so that stale TTHs
+    are not served) and put on the `pending` queue as `(path, local_path,
+    size, mtime)` tuples until `hash_pending` hashes them and adds them back.
+    During a long rehash, the files added so far are published every
+    `publish_interval` seconds, as measured by `clock`.
+
+    """
+    def __init__(self, share, threads=8, hasher=tiger_tree_hash,
+                 publish_interval=60.0, clock=time.time):
+        self.share = share
+        self.threads = threads
+        self.hasher = hasher
+        self.publish_interval = publish_interval
+        self.clock = clock
+        self.pending = Queue()
+
+    def scan(self):
+        """
+        Walk all shared directories and bring the listing up to date,
+        queueing new and changed files for hashing.  Return the number of
+        files queued.
+
+        """
+        queued = 0
+        pool = ThreadPool(self.threads)
+        try:
+            with self.share.batch():
+                for name, local_dir in self.share.roots.items():
+                    queued += self._sync(pool, (name,), local_dir)
+        finally:
+            pool.close()
+            pool.join()
+        return queued
+
+    def update(self, local_path):
+        """
+        Bring the listing up to date with the file or directory at
+        `local_path` after it has been created or modified.  Return the
+        number of files queued for hashing.
+
+        """
+        names = self.share.shared_path(local_path).names
+        if os.path.isdir(local_path) and not os.path.islink(local_path):
+            pool = ThreadPool(self.threads)
+            try:
+                with self.share.batch():
+                    return self._sync(pool, names, local_path)
+            finally:
+                pool.close()
+                pool.join()
+        try:
+            st = os.stat(local_path)
+        except OSError:
+            self.share.remove(Path(names))
+            return 0
+        item = self._get(names)
+        if item is not None and self._unchanged(item, st.st_size,
+                                                int(st.st_mtime)):
+            return 0
+        self.share.remove(Path(names))
+        self.pending.put((Path(names), local_path, st.st_size,
+                          int(st.st_mtime)))
+        return 1
+
+    def removed(self, local_path):
+        """Remove the deleted file or directory at `local_path`."""
+        return self.share.remove(self.share.shared_path(local_path))
+
+    def moved(self, old_local_path, new_local_path):
+        """
+        Move the item at `old_local_path` to `new_local_path` without
+        rehashing it, then check it for changes.
+
+        """
+        old_path = self.share.shared_path(old_local_path)
+        new_path = self.share.shared_path(new_local_path)
+        if os.path.isdir(new_local_path):
+            old_path = Path(old_path.names + ('',))
+            new_path = Path(new_path.names + ('',))
+        with self.share.batch():
+            self.share.move(old_path, new_path)
+            return self.update(new_local_path)
+
+    def hash_pending(self):
+        """
+        Hash the files waiting in `pending` and add them to the share.
+        Return the number of files added.  Files modified while they were
+        being hashed are put back on `pending` for the next call.
+
+        """
+        added = 0
+        changed = []
+        published = self.clock()
+        with self.share.batch():
+            while True:
+                try:
+                    path, local_path, size, mtime = self.pending.get_nowait()
+                except Empty:
+                    break
+                try:
+                    tth = self.hasher(local_path)
+                    st = os.stat(local_path)
+                except (IOError, OSError) as e:
+                    log.warning("Unable to hash %r: %s", local_path, e)
+                    continue
+                if (st.st_size, int(st.st_mtime)) != (size, mtime):
+                    # Modified while we were hashing; try again later.  It
+                    # is not retried now, since a file that keeps growing
+                    # would never let us finish.
+                    changed.append((path, local_path, st.st_size,
+                                    int(st.st_mtime)))
+                    continue
+                self.share.add_file(path, size, tth, mtime=mtime)
+                added += 1
+                if self.clock() - published >= self.publish_interval:
+                    # Show the progress of a long rehash.
+                    self.share.publish(force=True)
+                    published = self.clock()
+        for entry in changed:
+            self.pending.put(entry)
+        return added
+
+    def _get(self, names):
+        try:
+            return self.share.file_list.get(Path(names))
+        except (NotFound, RuntimeError):
+            return None
+
+    def _unchanged(self, item, size, mtime):
+        return (not isinstance(item, Container) and
+                item.size == size and getattr(item, 'mtime', None) == mtime)
+
+    def _walk(self, pool, local_dir):
+        """
+        List the tree at `local_dir` one level at a time, with the
+        directories of each level listed in parallel.  Return a set of the
+        relative directory names tuples, and a dict mapping the relative
+        file names tuples to `(size, mtime)` tuples.
+
+        """
+        directories = set()
+        files = {}
+        level = [((), local_dir)]
+        while level:
+            next_level = []
+            for names, local, subdirs, entries in pool.imap_unordered(
+                    _list_names, level):
+                for name in subdirs:
+                    directories.add(names + (name,))
+                    next_level.append((names + (name,),
+                                       os.path.join(local, name)))
+                for name, size, mtime in entries:
+                    files[names + (name,)] = (size, mtime)
+            level = next_level
+        return (directories, files)
+
+    def _sync(self, pool, base_names, local_dir):
+        directories, files = self._walk(pool, local_dir)
+        base = self.share.file_list.add(Path(base_names + ('',)))
+        queued = 0
+        # Compare the listing with what is on disk.  Items are collected
+        # first, since the listing can't change while we iterate over it.
+        stale = []
+        stack = [((), base)]
+        while stack:
+            names, container = stack.pop()
+            for item in container:
+                item_names = names + (item.name,)
+                if isinstance(item, Container):
+                    if item_names in directories:
+                        directories.discard(item_names)
+                        stack.append((item_names, item))
+                    else:
+                        stale.append(item_names + ('',))
+                else:
+                    found = files.pop(item_names, None)
+                    if found is None or not self._unchanged(item, *found):
+                        stale.append(item_names)
+                        if found is not None:
+                            files[item_names] = found
+        for names in stale:
+            self.share.remove(Path(base_names + names))
+        for names in directories:
+            self._add_directory(base_names + names + ('',))
+        for names, (size, mtime) in files.iteritems():
+            try:
+                path = Path(base_names + names)
+            except (InvalidPath, UnicodeError) as e:
+                log.warning("Not sharing %r: %s", names, e)
+                continue
+            local_path = os.path.join(local_dir, *names)
+            self.pending.put((path, local_path, size, mtime))
+            queued += 1
+        return queued
+
+    def _add_directory(self, names):
+        try:
+            self.share.file_list.add(Path(names))
+        except (InvalidPath, UnicodeError) as e:
+            log.warning("Not sharing %r: %s", names, e)
+
+class _EventHandler(object):
+    """
+    Apply inotify events (as delivered by `pyinotify`) to the listing
+    through `scanner`.  A file moved out of a directory is only known to
+    have been moved once the matching `IN_MOVED_TO` (with the same cookie)
+    arrives; if any other event comes first, it has been moved out of the
+    share and is removed.
+
+    """
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.moved_from = {}
+
+    def __call__(self, event):
+        try:
+            self.dispatch(event)
+        except (NotFound, InvalidPath, UnicodeError) as e:
+            log.debug("Ignoring %r: %s", event, e)
+
+    def dispatch(self, event):
+        if event.mask & IN_MOVED_TO:
+            src_pathname = self.moved_from.pop(event.cookie, None)
+            self.flush_moves()
+            if src_pathname is not None:
+                self.scanner.moved(src_pathname, event.pathname)
+            else:
+                self.scanner.update(event.pathname)
+            return
+        # A move away from a watched directory is never followed by a
+        # matching IN_MOVED_TO, so the item has been removed.
+        self.flush_moves()
+        if event.mask & IN_MOVED_FROM:
+            self.moved_from[event.cookie] = event.pathname
+        elif event.mask & IN_DELETE:
+            self.scanner.removed(event.pathname)
+        elif event.mask & IN_CLOSE_WRITE:
+            self.scanner.update(event.pathname)
+        elif event.mask & IN_CREATE and event.dir:
+            self.scanner.update(event.pathname)
+
+    def flush_moves(self):
+        for pathname in self.moved_from.itervalues():
+            self.scanner.removed(pathname)
+        self.moved_from.clear()
+
+class ShareWatcher(object):
+    """
+    Watch the shared directories of `scanner.share` with inotify and apply
+    changes to the listing as they happen.  Requires `pyinotify`.
+
+    Events are not applied in a thread of their own, since only one thread
+    may change the listing: the thread running `scanner` calls
+    `process_events`, for example whenever `fileno` is readable.
+
+    """
+    def __init__(self, scanner):
+        if pyinotify is None:
+            raise RuntimeError("Watching shares requires pyinotify.")
+        self.scanner = scanner
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.manager,
+                                           _EventHandler(scanner))
+
+    @property
+    def mask(self):
+        return (IN_CREATE | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM |
+                IN_MOVED_TO)
+
+    def fileno(self):
+        return self.manager.get_fd()
+
+    def start(self):
+        for local_dir in self.scanner.share.roots.itervalues():
+            self.manager.add_watch(local_dir, self.mask, rec=True,
+                                   auto_add=True)
+
+    def process_events(self, timeout=0):
+        """
+        Apply the events that arrive within `timeout` milliseconds (None
+        meaning to wait for some) and publish the changes together.  Return
+        True if there were any events.
+
+        """
+        if not self.notifier.check_events(timeout):
+            return False
+        self.notifier.read_events()
+        with self.scanner.share.batch():
+            self.notifier.process_events()
+        return True
+
+    def stop(self):
+        self.notifier.stop()
@@ -1,7 +1,10 @@
 from libsheep.filelist import FileListing
+from libsheep.share import Share, Scanner
 
 class State(object):
     def __init__(self):
         self.file_list = FileListing(None)
+        self.share = Share(self.file_list)
+        self.scanner = Scanner(self.share)
         self.downloaded_lists = None
         self.hubs = None
@@ -2,7 +2,10 @@
 
 from types import *
 from base64 import b32encode
+from timeit import default_timer
 from mhash import MHASH, MHASH_TIGER
+from libsheep import metrics
+from libsheep.readahead import ReadAhead, BLOCK_SIZE
 
 def tiger(chunk):
     '''Hashes the string parameter'''
@@ -39,8 +42,13 @@ class node(object):
 
 class TigerTreeHash(object):
     '''Represents the tiger tree hash object'''
-    def __init__(self, f, segment=1024):
+    def __init__(self, f, segment=1024, rate=None):
+        '''
+        Hash the string or file `f`.  Files are read ahead in a separate
+        thread, at no more than `rate` bytes per second if given.
+        '''
         self.segment = segment
+        self.rate = rate
         self.buf = None
         self.fp = None
         if type(f) == StringType:
@@ -65,30 +73,155 @@ class TigerTreeHash(object):
 
     def doFullTree(self):
         '''Runs the full hash and returns the tree as a nested list of nodes'''
-        if self.buf:
+        if self.buf is not None:
             return self.doFullTree_buf()
-        if self.fp:
+        if self.fp is not None:
             return self.doFullTree_fp()
 
     def doFullTree_buf(self):
-        pass
+        return self._tree([self.buf])
 
     def doFullTree_fp(self):
+        # Blocks must hold whole segments, so that every leaf but the last
+        # is full.
+        block_size = max(BLOCK_SIZE - BLOCK_SIZE % self.segment, self.segment)
+        return self._tree(ReadAhead(self.fp, block_size, rate=self.rate))
+
+    def _tree(self, blocks):
+        start = metrics.enabled and default_timer()
+        length = 0
         leaves = []
-        while True:
-            chunk = self.fp.read(self.segment)
-            if not chunk:
-                break
-            
-            leaves.append(node([chunk]))
+        segment = self.segment
+        for block in blocks:
+            length += len(block)
+            for i in xrange(0, len(block), segment):
+                leaves.append(node([block[i:i + segment]]))
+        if not leaves:
+            # An empty file has a single, empty leaf.
+            leaves.append(node(['']))
 
         while True:
             tree = [node(leaves[i:i+2]) for i in range(0, len(leaves), 2)]
             if (len(tree) > 1):
                 leaves = tree
             else:
+                if start:
+                    metrics.tth_bytes.inc(length)
+                    metrics.tth_seconds.inc(default_timer() - start)
                 return tree[0]
 
+class IncrementalTreeHash(object):
+    '''
+    Hashes a file of `size` bytes from segments received in any order, as
+    when downloading, giving the same tree as `TigerTreeHash`.
+
+    Leaves are hashed as soon as all of their data has arrived, so only
+    partially received leaves are buffered.  Leaf hashes are folded, in
+    order, into a stack of complete subtrees; since `node` promotes the odd
+    node at the end of each level unchanged, folding the stack from the
+    right when the last leaf arrives gives the same root.
+    '''
+    def __init__(self, size, segment=1024, keep_leaves=True):
+        self.size = size
+        self.segment = segment
+        self.count = max((size + segment - 1) // segment, 1)
+        # The leaf level, if kept.
+        self.leaves = keep_leaves and [None] * self.count or None
+        self.root = None
+        # Flags the leaves that have been hashed.
+        self._hashed = bytearray(self.count)
+        # Maps leaf indexes to a buffer and the sorted, disjoint `(start,
+        # stop)` ranges of it received so far.
+        self._partial = {}
+        # Leaf hashes waiting for the leaves before them.
+        self._ready = {}
+        self._next = 0
+        # (height, hash) of the complete subtrees folded so far.
+        self._stack = []
+        if not size:
+            self._leaf(0, '')
+
+    @property
+    def complete(self):
+        return self.root is not None
+
+    def update(self, offset, data):
+        '''
+        Add the string `data` received at `offset`.  Segments may overlap
+        or be received again, as after a retry; data for leaves that have
+        already been hashed is ignored.
+        '''
+        end = offset + len(data)
+        if offset < 0 or end > self.size:
+            raise ValueError("Segment %d-%d is outside the file." %
+                             (offset, end))
+        segment = self.segment
+        position = offset
+        while position < end:
+            index = position // segment
+            leaf_start = index * segment
+            leaf_end = min(leaf_start + segment, self.size)
+            stop = min(end, leaf_end)
+            if self._hashed[index]:
+                position = stop
+                continue
+            chunk = data[position - offset:stop - offset]
+            if position == leaf_start and stop == leaf_end:
+                self._partial.pop(index, None)
+                self._leaf(index, chunk)
+            else:
+                entry = self._partial.get(index)
+                if entry is None:
+                    entry = [bytearray(leaf_end - leaf_start), []]
+                    self._partial[index] = entry
+                entry[0][position - leaf_start:stop - leaf_start] = chunk
+                received = _merge_range(entry[1], position - leaf_start,
+                                        stop - leaf_start)
+                if received == leaf_end - leaf_start:
+                    del self._partial[index]
+                    self._leaf(index, str(entry[0]))
+            position = stop
+
+    def _leaf(self, index, data):
+        self._hashed[index] = 1
+        digest = tiger(data)
+        if self.leaves is not None:
+            self.leaves[index] = digest
+        self._ready[index] = digest
+        while self._next in self._ready:
+            self._push(self._ready.pop(self._next))
+            self._next += 1
+        if self._next == self.count:
+            height, digest = self._stack.pop()
+            while self._stack:
+                digest = tiger(self._stack.pop()[1] + digest)
+            self.root = digest
+
+    def _push(self, digest):
+        stack = self._stack
+        height = 0
+        while stack and stack[-1][0] == height:
+            digest = tiger(stack.pop()[1] + digest)
+            height += 1
+        stack.append((height, digest))
+
+def _merge_range(ranges, start, stop):
+    '''
+    Merge the range `start`-`stop` into the sorted list of disjoint
+    `(start, stop)` tuples `ranges`, and return the number of positions
+    they cover.
+    '''
+    merged = []
+    for range_start, range_stop in sorted(ranges + [(start, stop)]):
+        if merged and range_start <= merged[-1][1]:
+            if range_stop > merged[-1][1]:
+                merged[-1] = (merged[-1][0], range_stop)
+        else:
+            merged.append((range_start, range_stop))
+    ranges[:] = merged
+    return sum(range_stop - range_start
+               for range_start, range_stop in merged)
+
 
 if __name__ == '__main__':
     import sys
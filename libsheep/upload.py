@@ -0,0 +1,458 @@
+"""
+Module for answering `GET` requests from other clients.  `UploadServer`
+resolves the requested identifier through a `Share`, replies with an `SND`
+header and streams the requested range of the file to the connection.
+Requests with the ZLIG `ZL1` flag are compressed on the fly unless the file
+does not look compressible.  `GET list` requests are answered with partial
+file lists rendered straight from the listing last published by the `Share`
+and cached until the requested directory changes.  The full `files.xml.bz2`
+list is rendered and hashed once per generation of the listing and sent
+from the cached string without copying it.
+
+File data is never read into Python strings: on platforms that provide
+`sendfile` (`os.sendfile` on Python 3, or libc's on Linux) the kernel
+copies the data straight from the page cache to the socket, and elsewhere
+windows of the file are memory-mapped and written from buffer views of the
+mapping.
+
+When a `bandwidth.Scheduler` is given, file data is sent in quanta taken
+from its token buckets, and its measured upload speed decides whether extra
+slots are granted under the `AS` and `AM` fields of `INF`.
+
+"""
+import os
+import mmap
+import errno
+import select
+import logging
+import socket
+import threading
+from collections import OrderedDict
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+from libsheep.protocol import Message
+from libsheep.features.base import STA, SND
+from libsheep.filelist import NotFound
+from libsheep.path import InvalidPath
+from libsheep import libc
+from libsheep.bandwidth import UPLOAD
+from libsheep.compression import (BLOCK_SIZE, COMPRESSION_LEVEL,
+                                  should_compress, compress_stream)
+
+log = logging.getLogger(__name__)
+
+try:
+    from libsheep.tth import TigerTreeHash
+except ImportError:
+    # Hashing needs mhash; without it, cached lists have no TTH.
+    TigerTreeHash = None
+
+# Python 2 has no `os.sendfile`; on Linux, libc's is called through ctypes.
+sendfile = getattr(os, 'sendfile', None) or libc.sendfile
+
+try:
+    buffer
+except NameError:
+    def _send_view(connection, mapped, start, stop):
+        with memoryview(mapped) as view:
+            connection.sendall(view[start:stop])
+else:
+    def _send_view(connection, mapped, start, stop):
+        connection.sendall(buffer(mapped, start, stop - start))
+
+# Status codes from the ADC specification.
+SEVERITY_RECOVERABLE = 1
+GENERIC_PROTOCOL_ERROR = '40'
+TRANSFER_PROTOCOL_UNSUPPORTED = '41'
+FILE_NOT_AVAILABLE = '51'
+FILE_PART_NOT_AVAILABLE = '52'
+SLOTS_FULL = '53'
+
+# The identifier of the complete file list.
+FULL_LIST = 'files.xml.bz2'
+
+# Errors indicating that `sendfile` cannot be used with the given
+# descriptors, in which case we fall back to memory-mapped writes.
+SENDFILE_UNSUPPORTED = set([errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK,
+                            getattr(errno, 'EOPNOTSUPP', errno.EINVAL)])
+
+class ListCache(object):
+    """
+    Cache of rendered partial file lists of the listing published by
+    `share`, keyed by base path, depth and compression.  Each rendering is
+    reused for as long as the digest of the directory it was rendered from
+    stays the same, and at most `max_entries` renderings are kept.
+
+    """
+    def __init__(self, share, max_entries=64):
+        self.share = share
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, base, depth=-1, compressed=False):
+        """
+        Return a `(data, size)` tuple for the partial list rooted at `base`,
+        where `size` is the length of the uncompressed XML.
+
+        """
+        listing = self.share.published
+        base, container = listing.get_base(base)
+        digest = container.digest
+        key = (unicode(base), depth, bool(compressed))
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] != digest:
+            # Rendered without holding the lock, so other lists can be
+            # served meanwhile.
+            data = ''.join(listing.iter_xml(base, depth))
+            size = len(data)
+            if compressed:
+                data = ''.join(compress_stream([data]))
+            entry = (digest, data, size)
+        with self._lock:
+            # Keep the most recently used entries at the end.
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry[1:]
+
+class FullListCache(object):
+    """
+    Cache of the complete file list of the listing published by `share`,
+    compressed with bzip2 by `processes` processes.  The list is rendered
+    at most once per generation of the listing, however many peers ask for
+    it.
+
+    """
+    def __init__(self, share, processes=1):
+        self.share = share
+        self.processes = processes
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return a `(generation, data, tth)` tuple for the current list, where
+        `tth` is the binary Tiger tree hash root of `data`, or None if
+        hashing is not available.
+
+        """
+        with self._lock:
+            entry = self._entry
+            listing = self.share.published
+            if entry is None or entry[0] != listing.generation:
+                output = StringIO()
+                listing.write(output, compress=True,
+                              processes=self.processes)
+                data = output.getvalue()
+                tth = None
+                if TigerTreeHash is not None:
+                    tth = str(TigerTreeHash(data).root)
+                entry = self._entry = (listing.generation, data, tth)
+            return entry
+
+class UploadServer(object):
+    """
+    Serve files from `share` to other clients.  The number of concurrent
+    transfers is limited by the `slots` field of the `INF` command `info`;
+    if no `INF` is given or it advertises no slot count, transfers are not
+    limited.  If a bandwidth `scheduler` is given, uploads are throttled by
+    it and extra slots are granted while the measured upload speed is below
+    the `auto_slot_speed` of `info`.
+
+    Handlers for each `GET` type are looked up in `handlers`, which maps the
+    type name to a method taking the connection and `GET` command.
+
+    """
+    MAP_WINDOW = 64 * 1024 * 1024
+    COMPRESSION_LEVEL = COMPRESSION_LEVEL
+
+    def __init__(self, share, info=None, scheduler=None):
+        self.share = share
+        self.info = info
+        self.scheduler = scheduler
+        self.active = 0
+        self._lock = threading.Lock()
+        self.list_cache = ListCache(share)
+        self.full_list_cache = FullListCache(share)
+        self.handlers = {'file': self.send_file, 'list': self.send_list}
+
+    @property
+    def slots(self):
+        if self.info is not None:
+            return self.info.slots
+
+    @property
+    def free_slots(self):
+        slots = self.slots
+        if slots is not None:
+            return max(slots - self.active, 0)
+
+    def acquire_slot(self):
+        """Reserve a slot and return True, or return False if none is free."""
+        with self._lock:
+            slots = self.slots
+            if self.scheduler is not None and self.info is not None:
+                if not self.scheduler.grant_slot(
+                        self.active, slots, self.info.auto_slot_speed,
+                        self.info.auto_slot_max):
+                    return False
+            elif slots is not None and self.active >= slots:
+                return False
+            self.active += 1
+            return True
+
+    def release_slot(self):
+        with self._lock:
+            self.active -= 1
+
+    def peer(self, connection):
+        """
+        Return the key identifying the peer on `connection` for per-peer
+        bandwidth limits: its address, or None if it has none.
+
+        """
+        try:
+            return connection.getpeername()[0] or None
+        except (AttributeError, IndexError, socket.error):
+            return None
+
+    def handle_get(self, connection, get):
+        """
+        Answer the `GET` command `get` received on `connection`.  Return
+        True if the requested data was sent, or False if an error status was
+        sent instead.
+
+        """
+        handler = self.handlers.get(get.type)
+        if handler is None:
+            self.send_status(connection, TRANSFER_PROTOCOL_UNSUPPORTED,
+                             "Unsupported transfer type")
+            return False
+        return handler(connection, get)
+
+    def send_status(self, connection, error_code, description,
+                    severity=SEVERITY_RECOVERABLE):
+        status = STA('STA')
+        status.severity = severity
+        status.error_code = error_code
+        status.description = description
+        connection.sendall(Message('C', status).encode())
+
+    def send_header(self, connection, get, start_pos, count,
+                    compressed=False):
+        reply = SND('SND')
+        reply.type = get.type
+        reply.identifier = get.identifier
+        reply.start_pos = start_pos
+        reply.bytes = count
+        reply.compressed = compressed
+        connection.sendall(Message('C', reply).encode())
+
+    def get_range(self, get, size):
+        """
+        Return the `(start_pos, bytes)` range requested by `get` for a file
+        of `size` bytes, or None if the range is not available.
+
+        """
+        start_pos = get.start_pos or 0
+        count = get.bytes
+        if count is None or count < 0:
+            count = size - start_pos
+        if start_pos < 0 or start_pos > size or start_pos + count > size:
+            return None
+        return (start_pos, count)
+
+    def _open_transfer(self, connection):
+        if self.scheduler is not None:
+            return self.scheduler.transfer(UPLOAD, peer=self.peer(connection))
+
+    def send_file(self, connection, get):
+        if get.identifier == FULL_LIST:
+            return self.send_full_list(connection, get)
+        try:
+            local_path, item = self.share.resolve(get.identifier)
+            source = open(local_path, 'rb')
+        except (NotFound, IOError, OSError):
+            self.send_status(connection, FILE_NOT_AVAILABLE,
+                             "File Not Available")
+            return False
+        try:
+            requested = self.get_range(get, os.fstat(source.fileno()).st_size)
+            if requested is None:
+                self.send_status(connection, FILE_PART_NOT_AVAILABLE,
+                                 "File Part Not Available")
+                return False
+            if not self.acquire_slot():
+                self.send_status(connection, SLOTS_FULL, "Slots full")
+                return False
+            try:
+                start_pos, count = requested
+                compressed = (get.compressed and
+                              self._should_compress(item.name, source,
+                                                    start_pos, count))
+                self.send_header(connection, get, start_pos, count,
+                                 compressed)
+                transfer = self._open_transfer(connection)
+                if compressed:
+                    self.transmit_compressed(connection, source, start_pos,
+                                             count, transfer)
+                else:
+                    self.transmit(connection, source, start_pos, count,
+                                  transfer)
+            finally:
+                self.release_slot()
+        finally:
+            source.close()
+        return True
+
+    def send_list(self, connection, get):
+        """
+        Send the partial file list for the directory named by `get`.  Only
+        the directory's immediate contents are listed unless `RE1` was
+        given.  Lists are small and are not subject to slot limits.
+
+        """
+        depth = get.recursive and -1 or 1
+        try:
+            data, size = self.list_cache.get(get.identifier, depth,
+                                             get.compressed)
+        except (NotFound, InvalidPath, RuntimeError):
+            self.send_status(connection, FILE_NOT_AVAILABLE,
+                             "File Not Available")
+            return False
+        self.send_header(connection, get, 0, size, get.compressed)
+        connection.sendall(data)
+        return True
+
+    def send_full_list(self, connection, get):
+        """
+        Send the requested range of the complete, bzip2-compressed file
+        list.  Like partial lists, it is not subject to slot limits.
+
+        """
+        generation, data, tth = self.full_list_cache.get()
+        requested = self.get_range(get, len(data))
+        if requested is None:
+            self.send_status(connection, FILE_PART_NOT_AVAILABLE,
+                             "File Part Not Available")
+            return False
+        start_pos, count = requested
+        self.send_header(connection, get, start_pos, count)
+        transfer = self._open_transfer(connection)
+        if transfer is None:
+            _send_view(connection, data, start_pos, start_pos + count)
+        else:
+            for size in transfer.chunks(count):
+                _send_view(connection, data, start_pos, start_pos + size)
+                start_pos += size
+        return True
+
+    def _should_compress(self, name, source, offset, count):
+        source.seek(offset)
+        sample = source.read(min(count, BLOCK_SIZE))
+        return should_compress(name, sample)
+
+    def transmit_compressed(self, connection, source, offset, count,
+                            transfer=None):
+        """
+        Write `count` bytes of the file object `source`, beginning at
+        `offset`, to `connection` as a zlib stream, throttled by the
+        bandwidth `transfer` if given.
+
+        """
+        blocks = read_blocks(source, offset, count)
+        for data in compress_stream(blocks, self.COMPRESSION_LEVEL):
+            if transfer is not None:
+                transfer.throttle(len(data))
+            connection.sendall(data)
+
+    def transmit(self, connection, source, offset, count, transfer=None):
+        """
+        Write `count` bytes of the file object `source`, beginning at
+        `offset`, to `connection`, throttled by the bandwidth `transfer` if
+        given.
+
+        """
+        if transfer is None:
+            self._transmit(connection, source, offset, count)
+            return
+        for size in transfer.chunks(count):
+            self._transmit(connection, source, offset, size)
+            offset += size
+
+    def _transmit(self, connection, source, offset, count):
+        if sendfile is not None:
+            sent = self._sendfile(connection, source, offset, count)
+            offset += sent
+            count -= sent
+        if count:
+            self._mmap_write(connection, source, offset, count)
+
+    def _sendfile(self, connection, source, offset, count):
+        """
+        Send as much of the range as possible with `sendfile` and return
+        the number of bytes sent.  Zero is returned if `sendfile` does not
+        support this pair of descriptors.
+
+        """
+        try:
+            out_fd = connection.fileno()
+        except AttributeError:
+            return 0
+        in_fd = source.fileno()
+        total = 0
+        while total < count:
+            try:
+                sent = sendfile(out_fd, in_fd, offset + total, count - total)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    # The socket has a timeout (and is therefore
+                    # non-blocking); wait until it is writable.
+                    select.select([], [out_fd], [])
+                    continue
+                elif e.errno == errno.EINTR:
+                    continue
+                elif not total and e.errno in SENDFILE_UNSUPPORTED:
+                    return 0
+                raise
+            if not sent:
+                raise IOError("File truncated during transfer.")
+            total += sent
+        return total
+
+    def _mmap_write(self, connection, source, offset, count):
+        granularity = mmap.ALLOCATIONGRANULARITY
+        window = max(self.MAP_WINDOW - self.MAP_WINDOW % granularity,
+                     granularity)
+        end = offset + count
+        while offset < end:
+            # Mappings must begin on a multiple of the allocation
+            # granularity, so map from the preceding boundary.
+            map_offset = offset - offset % granularity
+            length = min(end - map_offset, window)
+            mapped = mmap.mmap(source.fileno(), length,
+                               access=mmap.ACCESS_READ, offset=map_offset)
+            try:
+                _send_view(connection, mapped, offset - map_offset, length)
+            finally:
+                mapped.close()
+            offset = map_offset + length
+
+def read_blocks(source, offset, count, block_size=BLOCK_SIZE):
+    """
+    Yield `count` bytes of the file object `source`, beginning at `offset`,
+    in strings of at most `block_size` bytes.
+
+    """
+    source.seek(offset)
+    while count:
+        block = source.read(min(count, block_size))
+        if not block:
+            raise IOError("File truncated during transfer.")
+        count -= len(block)
+        yield block
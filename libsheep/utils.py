@@ -1,4 +1,6 @@
+import base64
 import unicodedata
+from libsheep import metrics
 
 def is_printable(string):
     """
@@ -7,14 +9,48 @@ def is_printable(string):
     'Control' category.
     
     """
-    for char in unicode(string):
+    string = unicode(string)
+    misses = 0
+    result = True
+    for char in string:
         try:
             printable = is_printable.cache[char]
         except KeyError:
+            misses += 1
             is_control = unicodedata.category(char).startswith('C')
             printable = char.isspace() or not is_control
             is_printable.cache[char] = printable
         if not printable:
-            return False
-    return True
+            result = False
+            break
+    if metrics.enabled:
+        if result:
+            lookups = len(string)
+        else:
+            lookups = string.index(char) + 1
+        metrics.printable_cache.inc(lookups - misses, 'hit')
+        metrics.printable_cache.inc(misses, 'miss')
+    return result
 is_printable.cache = {}
+
+def b32encode(data):
+    """
+    Return the base32 encoding of `data` without trailing padding, which is
+    how ADC transmits CIDs, PIDs and TTHs.
+    
+    >>> b32encode('libsheep')
+    'NRUWE43IMVSXA'
+    
+    """
+    return base64.b32encode(data).rstrip('=')
+
+def b32decode(string):
+    """
+    Decode the unpadded base32 `string` and return the binary data.  Raises
+    `TypeError` if `string` is not valid base32.
+    
+    >>> b32decode('NRUWE43IMVSXA')
+    'libsheep'
+    
+    """
+    return base64.b32decode(string + '=' * (-len(string) % 8))
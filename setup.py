@@ -9,7 +9,8 @@ setup(
     url='http://code.google.com/p/cwru-hackers/',
     packages=find_packages(),
     extras_require={
-        'TIGR': ['python-mhash>=1.4']
+        'TIGR': ['python-mhash>=1.4'],
+        'WATCH': ['pyinotify']
     },
     entry_points={
         'libsheep.extensions': ["TIGR = libsheep.extensions.tigr:TIGR"]
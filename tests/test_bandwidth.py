@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+import unittest
+from libsheep.bandwidth import (TokenBucket, Meter, Scheduler, UPLOAD,
+                                DOWNLOAD)
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_unlimited(self):
+        bucket = TokenBucket(clock=self.clock)
+        self.assertEquals(bucket.reserve(10 ** 9), 0)
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        self.assertEquals(bucket.reserve(100), 0)
+        self.assertEquals(bucket.reserve(50), 0.5)
+        # The debt is waited for in turn.
+        self.assertEquals(bucket.reserve(50), 1.0)
+        self.clock.now += 1.0
+        self.assertEquals(bucket.reserve(50), 0.5)
+
+    def test_refill_is_capped_by_burst(self):
+        bucket = TokenBucket(100, 200, clock=self.clock)
+        bucket.reserve(200)
+        self.clock.now += 60
+        self.assertEquals(bucket.reserve(200), 0)
+        self.assertEquals(bucket.reserve(100), 1.0)
+
+class TestMeter(unittest.TestCase):
+    def test_rate_follows_and_decays(self):
+        clock = FakeClock()
+        meter = Meter(interval=1.0, half_life=1.0, clock=clock)
+        for i in xrange(10):
+            meter.add(1000)
+            clock.now += 1.0
+        self.assertTrue(990 < meter.rate <= 1000)
+        clock.now += 10.0
+        self.assertTrue(meter.rate < 10)
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = Scheduler(clock=self.clock, sleep=self.clock.sleep,
+                                   quantum=100)
+
+    def test_chunks_are_quanta(self):
+        transfer = self.scheduler.transfer(DOWNLOAD)
+        self.assertEquals(list(transfer.chunks(250)), [100, 100, 50])
+        self.assertEquals(transfer.transferred, 250)
+
+    def test_tightest_limit_applies(self):
+        self.scheduler.directions[UPLOAD].set_rate(1000)
+        self.scheduler.set_peer_rate('peer', 100)
+        transfer = self.scheduler.transfer(UPLOAD, peer='peer')
+        start = self.clock.now
+        list(transfer.chunks(1100))
+        self.assertEquals(self.clock.now - start, 10.0)
+        # Downloads are not limited by the upload bucket.
+        start = self.clock.now
+        list(self.scheduler.transfer(DOWNLOAD).chunks(5000))
+        self.assertEquals(self.clock.now, start)
+
+    def test_peer_buckets_are_shared_while_in_use(self):
+        self.scheduler.peer_rate = 100
+        first = self.scheduler.transfer(UPLOAD, peer='peer')
+        second = self.scheduler.transfer(UPLOAD, peer='peer')
+        self.assertTrue(first.buckets[-1] is second.buckets[-1])
+        other = self.scheduler.transfer(UPLOAD, peer='other')
+        self.assertFalse(first.buckets[-1] is other.buckets[-1])
+
+    def test_transfers_share_a_bucket_fairly(self):
+        self.scheduler.total.set_rate(100)
+        first = self.scheduler.transfer(UPLOAD)
+        second = self.scheduler.transfer(DOWNLOAD)
+        first.throttle(100)
+        second.throttle(100)
+        self.assertEquals(self.clock.now, 1001.0)
+        first.throttle(100)
+        self.assertEquals(self.clock.now, 1002.0)
+
+    def test_grant_slot(self):
+        grant = self.scheduler.grant_slot
+        self.assertTrue(grant(0, 1))
+        self.assertFalse(grant(1, 1))
+        self.assertTrue(grant(1, 1, auto_slot_speed=1000, auto_slot_max=2))
+        self.assertFalse(grant(2, 1, auto_slot_speed=1000, auto_slot_max=2))
+        transfer = self.scheduler.transfer(UPLOAD)
+        for i in xrange(10):
+            transfer.throttle(2000)
+            self.clock.now += 1.0
+        self.assertFalse(grant(1, 1, auto_slot_speed=1000, auto_slot_max=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
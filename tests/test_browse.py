@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import unittest
+from libsheep.browse import RemoteBrowser, LazyDirectory, listing_fetcher
+from libsheep.filelist import FileListing
+
+class TestRemoteBrowser(unittest.TestCase):
+    def setUp(self):
+        listing = FileListing('mycid', '/')
+        listing.add('music/a/1.mp3', size=1)
+        listing.add('music/b/2.mp3', size=2)
+        listing.add('music/c/3.mp3', size=3)
+        listing.add('video/4.mkv', size=4)
+        listing.add('empty/')
+        self.fetched = []
+        fetch = listing_fetcher(listing)
+        def fetcher(path):
+            self.fetched.append(unicode(path))
+            return fetch(path)
+        self.browser = RemoteBrowser(fetcher, max_expanded=2)
+        self.remote = listing
+    
+    def test_open_fetches_only_top_level(self):
+        listing = self.browser.open()
+        self.assertEquals(self.fetched, [u'/'])
+        self.assertTrue(isinstance(listing['music'], LazyDirectory))
+        self.assertTrue(listing['music'].incomplete)
+        self.assertFalse(listing['empty'].incomplete)
+    
+    def test_contents_fetched_on_first_access(self):
+        listing = self.browser.open()
+        self.assertEquals(listing['video']['4.mkv'].size, 4)
+        self.assertEquals(listing['video']['4.mkv'].size, 4)
+        self.assertEquals(self.fetched, [u'/', u'/video/'])
+        self.assertEquals(listing['music']['b']['2.mp3'].size, 2)
+        self.assertEquals(self.fetched[2:], [u'/music/', u'/music/b/'])
+    
+    def test_least_recently_used_directories_are_collapsed(self):
+        listing = self.browser.open()
+        listing['video'].contents
+        listing['music']['a'].contents
+        # 'video' was the least recently used, and 'music' is an ancestor
+        # of the newly expanded 'a'.
+        self.assertTrue(listing['video'].incomplete)
+        self.assertFalse(listing['music'].incomplete)
+        listing['empty'].contents
+        listing['video'].contents
+        self.assertEquals(self.fetched.count(u'/video/'), 2)
+    
+    def test_statistics_do_not_fetch_stubs(self):
+        listing = self.browser.open()
+        listing['video'].contents
+        listing['music']['a'].contents
+        fetched = list(self.fetched)
+        # Only the expanded directories are counted.
+        self.assertEquals(listing.total_size, 1)
+        self.assertEquals(listing.file_count, 1)
+        self.assertTrue(listing.digest)
+        self.assertEquals(self.fetched, fetched)
+        # Expanding 'b' collapses 'a', the least recently used.
+        listing['music']['b'].contents
+        self.assertEquals(listing.total_size, 2)
+    
+    def test_collapse_forgets_expanded_descendants(self):
+        listing = self.browser.open()
+        listing['music']['c'].contents
+        self.browser.collapse(listing['music'])
+        self.assertEquals(len(self.browser._expanded), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+import os
+import bz2
+import shutil
+import tempfile
+import unittest
+from libsheep.bulk import load_many
+from libsheep.filelist import FileListing
+
+class TestLoadMany(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = []
+        for i in range(5):
+            listing = FileListing('cid%d' % i, '/')
+            listing.add('share/file%d.txt' % i, size=i)
+            filename = os.path.join(self.directory, 'files%d.xml.bz2' % i)
+            with open(filename, 'wb') as f:
+                f.write(bz2.compress(listing.serialize()))
+            self.filenames.append(filename)
+        broken = os.path.join(self.directory, 'broken.xml')
+        with open(broken, 'w') as f:
+            f.write('<FileListing')
+        self.filenames.insert(2, broken)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_lists_are_loaded_in_order(self):
+        results = list(load_many(self.filenames, processes=2, max_pending=2))
+        self.assertEquals([filename for filename, listing in results],
+                          self.filenames)
+        listings = [listing for filename, listing in results]
+        self.assertEquals(listings[2], None)
+        del listings[2]
+        for i, listing in enumerate(listings):
+            self.assertEquals(listing.client_id, 'cid%d' % i)
+            self.assertEquals(listing.get('share/file%d.txt' % i).size, i)
+
+
+if __name__ == '__main__':
+    unittest.main()
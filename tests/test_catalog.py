@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import unittest
+from libsheep.catalog import Catalog, StringTable
+from libsheep.filelist import FileListing
+from libsheep.packed import PackedListing, pack
+
+A = 'A' * 24
+B = 'B' * 24
+C = 'C' * 24
+
+def make_listing(cid, *files):
+    listing = FileListing(cid, '/')
+    for path, tth in files:
+        listing.add(path, size=1, tth=tth)
+    return listing
+
+class TestStringTable(unittest.TestCase):
+    def test_intern(self):
+        table = StringTable()
+        self.assertEquals(table.intern(u'a'), 0)
+        self.assertEquals(table.intern(u'b'), 1)
+        self.assertEquals(table.intern(u'a'), 0)
+        self.assertEquals(table[1], u'b')
+        self.assertEquals(len(table), 2)
+
+    def test_release_frees_and_reuses_ids(self):
+        table = StringTable()
+        a = table.intern(u'a')
+        table.intern(u'a')
+        b = table.intern(u'b')
+        table.release(a)
+        self.assertEquals(table[a], u'a')
+        table.release(a)
+        self.assertEquals(len(table), 1)
+        self.assertEquals(table.intern(u'c'), a)
+        self.assertEquals(table[b], u'b')
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.catalog = Catalog()
+        self.catalog.ingest('one', make_listing(
+            'one', ('music/a.mp3', A), ('music/b.mp3', B),
+            ('copy of a.mp3', A)))
+        self.catalog.ingest('two', make_listing(
+            'two', ('tunes/a.mp3', A), ('tunes/c.mp3', C),
+            ('no tth.txt', None)))
+
+    def test_len(self):
+        self.assertEquals(len(self.catalog), 3)
+        self.assertTrue(A in self.catalog)
+        self.assertFalse('X' * 24 in self.catalog)
+
+    def test_who_has(self):
+        self.assertEquals(self.catalog.who_has(A), ['one', 'two'])
+        self.assertEquals(self.catalog.who_has(C), ['two'])
+        self.assertEquals(self.catalog.who_has('X' * 24), [])
+
+    def test_locations(self):
+        self.assertEquals(sorted(self.catalog.locations(A)), [
+            ('one', u'/copy of a.mp3'),
+            ('one', u'/music/a.mp3'),
+            ('two', u'/tunes/a.mp3')])
+
+    def test_unique_to(self):
+        self.assertEquals(list(self.catalog.unique_to('one')),
+                          [(B, u'/music/b.mp3')])
+        self.assertEquals(list(self.catalog.unique_to('two')),
+                          [(C, u'/tunes/c.mp3')])
+
+    def test_names_are_interned(self):
+        self.assertEquals(len(self.catalog.names), 4)
+
+    def test_reingest_replaces_files(self):
+        self.catalog.ingest('one', make_listing('one', ('b.mp3', B)))
+        self.assertEquals(self.catalog.who_has(A), ['two'])
+        self.assertEquals(self.catalog.locations(B), [('one', u'/b.mp3')])
+        self.assertEquals(list(self.catalog.unique_to('two')),
+                          [(A, u'/tunes/a.mp3'), (C, u'/tunes/c.mp3')])
+
+    def test_reingest_does_not_grow(self):
+        files = [(u'dir %d/file %d.mp3' % (i % 10, i), '%024d' % (i,))
+                 for i in xrange(1000)]
+        self.catalog.ingest('three', make_listing('three', *files))
+        sizes = (len(self.catalog._tths),
+                 len(self.catalog.directories._strings),
+                 len(self.catalog.names._strings))
+        for i in xrange(5):
+            self.catalog.ingest('three', make_listing('three', *files))
+        self.assertEquals((len(self.catalog._tths),
+                           len(self.catalog.directories._strings),
+                           len(self.catalog.names._strings)), sizes)
+        self.catalog.remove('three')
+        self.assertEquals(len(self.catalog), 3)
+        self.assertEquals(len(self.catalog.names), 4)
+        self.assertEquals(self.catalog.locations(C),
+                          [('two', u'/tunes/c.mp3')])
+
+    def test_remove(self):
+        self.catalog.remove('two')
+        self.assertEquals(self.catalog.client_ids, ['one'])
+        self.assertFalse(C in self.catalog)
+        self.assertEquals(len(list(self.catalog.unique_to('one'))), 3)
+
+    def test_ingest_packed_listing(self):
+        listing = make_listing('three', ('x/c.mp3', C))
+        self.catalog.ingest('three', PackedListing(pack(listing)))
+        self.assertEquals(self.catalog.who_has(C), ['two', 'three'])
+        self.assertEquals(self.catalog.locations(C)[1],
+                          ('three', u'/x/c.mp3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
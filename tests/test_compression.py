@@ -0,0 +1,44 @@
+import os
+import bz2
+from cStringIO import StringIO
+from libsheep.compression import (should_compress, compress_stream,
+                                  decompress_stream, decompress_bz2_stream,
+                                  ParallelBZ2Writer)
+
+def test_compressed_extensions_are_skipped():
+    assert not should_compress('Album/01 - Track.FLAC')
+    assert not should_compress('archive.zip', 'a' * 1000)
+
+def test_incompressible_sample_is_skipped():
+    sample = os.urandom(4096)
+    assert not should_compress('data.bin', sample)
+
+def test_stream_round_trip():
+    blocks = ['%d ' % i * 100 for i in xrange(100)]
+    compressed = list(compress_stream(blocks))
+    assert ''.join(decompress_stream(compressed)) == ''.join(blocks)
+
+def test_decompressed_blocks_are_bounded():
+    compressed = list(compress_stream(['\0' * 1000000]))
+    decompressed = list(decompress_stream(compressed, max_length=1024))
+    assert max(map(len, decompressed)) <= 1024
+    assert sum(map(len, decompressed)) == 1000000
+
+def test_parallel_bz2_writes_ordered_streams():
+    data = ''.join('line %d\n' % i for i in xrange(20000))
+    output = StringIO()
+    with ParallelBZ2Writer(output, processes=2, block_size=10000,
+                           window=3) as writer:
+        for i in xrange(0, len(data), 777):
+            writer.write(data[i:i + 777])
+    assert writer.streams > 10
+    compressed = output.getvalue()
+    # Each stream is a complete bzip2 file; the first decodes by itself.
+    assert data.startswith(bz2.decompress(compressed))
+    blocks = [compressed[i:i + 1000] for i in xrange(0, len(compressed), 1000)]
+    assert ''.join(decompress_bz2_stream(blocks)) == data
+
+def test_parallel_bz2_empty_input():
+    output = StringIO()
+    ParallelBZ2Writer(output, processes=1).close()
+    assert ''.join(decompress_bz2_stream([output.getvalue()])) == ''
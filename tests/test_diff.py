@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import unittest
+from libsheep.diff import diff, apply_patch, ADD, REMOVE, MODIFY
+from libsheep.filelist import FileListing
+
+def make_listing():
+    listing = FileListing('mycid', '/')
+    listing.add('same/deep/x.txt', size=1, tth='X' * 24)
+    listing.add('same/y.txt', size=2, tth='Y' * 24)
+    listing.add('changed/a.txt', size=3, tth='A' * 24)
+    listing.add('changed/b.txt', size=4, tth='B' * 24)
+    listing.add('gone/c.txt', size=5)
+    listing.add('kind', size=6)
+    return listing
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.old = make_listing()
+        self.new = make_listing()
+        self.new.add('changed/a.txt', True, size=30, tth='Z' * 24)
+        self.new.remove('changed/b.txt')
+        self.new.add('changed/new/d.txt', size=7)
+        self.new.remove('gone/')
+        self.new.add('kind/', True)
+        self.new.add('partial/', incomplete=True)
+    
+    def test_identical_listings_have_no_changes(self):
+        self.assertEquals(list(diff(self.old, make_listing())), [])
+    
+    def test_changes(self):
+        changes = [(change.action, unicode(change.path))
+                   for change in diff(self.old, self.new)]
+        self.assertEquals(changes, [
+            (MODIFY, u'changed/a.txt'),
+            (REMOVE, u'changed/b.txt'),
+            (ADD, u'changed/new/'),
+            (REMOVE, u'gone/'),
+            (REMOVE, u'kind'),
+            (ADD, u'kind/'),
+            (ADD, u'partial/'),
+        ])
+    
+    def test_identical_subtrees_are_not_visited(self):
+        self.old['same'].contents = self.new['same'].contents = None
+        self.old['same']._stats = self.new['same']._stats = (0, 0, 'same')
+        self.assertEquals(len(list(diff(self.old, self.new))), 7)
+    
+    def test_apply_patch(self):
+        apply_patch(self.old, list(diff(self.old, self.new)))
+        self.assertEquals(self.old, self.new)
+        self.assertFalse(self.old['changed'] is self.new['changed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
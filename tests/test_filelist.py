@@ -1,19 +1,29 @@
 #!/usr/bin/env python
 import os
+import copy
+import shutil
+import tempfile
 import unittest
 from libsheep.filelist import FileListing, File, Directory, Path
+from libsheep.filelist import render_path
+from libsheep.utils import b32decode
 
 EXAMPLE_FILENAME = 'resources/example_filelist.xml'
 EXAMPLE_PATH = os.path.join(os.path.dirname(__file__), EXAMPLE_FILENAME)
+PDB_TTH = b32decode('4S5LJXUVPO6CXYXEJLLEL7YFEDG33TTYBDHMHOY')
+EXE_TTH = b32decode('SCK33OCZGCFWFLHQIA3P7VFN7Y3G273TPUTW5NQ')
+ADC_TTH = b32decode('K5WRDBGFIHU7SKXXINR653W5MHZ25TI3EZJUOAQ')
 
 class TestFileListingIO(unittest.TestCase):
     def setUp(self):
         listing = FileListing('mycid', '/')
         listing.add('/share/')
-        listing.add('/share/ADC.txt', size=154112)
+        listing.add('/share/ADC.txt', size=154112, tth=ADC_TTH)
         listing.add('/share/DC++ Prerelease/')
-        listing.add('/share/DC++ Prerelease/DCPlusPlus.pdb', size=17648640)
-        listing.add('/share/DC++ Prerelease/DCPlusPlus.exe', size=946176)
+        listing.add('/share/DC++ Prerelease/DCPlusPlus.pdb', size=17648640,
+                    tth=PDB_TTH)
+        listing.add('/share/DC++ Prerelease/DCPlusPlus.exe', size=946176,
+                    tth=EXE_TTH)
         listing.add('/share2/', incomplete=True)
         self.example_listing = listing
     
@@ -35,6 +45,34 @@ class TestFileListingIO(unittest.TestCase):
         listing_b = FileListing.from_string(a_serialized)
         self.assertEquals(listing_a, listing_b)
     
+    def test_bz2_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'files.xml.bz2')
+            self.example_listing.write(filename, processes=2)
+            listing = FileListing.from_file(filename)
+            self.assertEquals(listing, self.example_listing)
+        finally:
+            shutil.rmtree(directory)
+    
+    def test_tth_is_binary(self):
+        listing = FileListing.from_file(EXAMPLE_PATH)
+        self.assertEquals(listing['share']['ADC.txt'].tth, ADC_TTH)
+        self.assertEquals(len(ADC_TTH), 24)
+    
+    def test_extension_attributes_round_trip(self):
+        xml = ('<FileListing Version="1" CID="mycid" Base="/">'
+               '<File Name="a.txt" Size="1" TTH="%s" TS="1234" X="&amp;"/>'
+               '<File Name="b.txt" Size="2" TTH="bad"/>'
+               '</FileListing>' % ('A' * 39,))
+        listing = FileListing.from_string(xml)
+        self.assertEquals(listing['a.txt'].extra, (('TS', '1234'),
+                                                   ('X', '&')))
+        self.assertEquals(listing['b.txt'].extra, (('TTH', 'bad'),))
+        self.assertFalse(hasattr(listing['b.txt'], 'tth'))
+        for xml in (listing.serialize(), ''.join(listing.iter_xml())):
+            self.assertEquals(FileListing.from_string(xml), listing)
+    
     def _test_example_listing(self, listing):
         self.assertTrue(isinstance(listing, FileListing))
         self.assertTrue('share' in listing.contents)
@@ -93,6 +131,28 @@ class TestFileListingModification(unittest.TestCase):
         removed_b = self.listing.remove('/share/a/b')
         self.assertTrue(added_b is removed_b)
     
+    def test_changes_increment_generation(self):
+        generations = [self.listing.generation]
+        self.listing.add('a.txt', size=1)
+        generations.append(self.listing.generation)
+        self.listing.add('a.txt', size=2)
+        generations.append(self.listing.generation)
+        self.listing['b'] = Directory('b')
+        generations.append(self.listing.generation)
+        del self.listing['b']
+        generations.append(self.listing.generation)
+        self.listing.remove('a.txt')
+        generations.append(self.listing.generation)
+        self.assertEquals(generations, sorted(set(generations)))
+    
+    def test_unchanged_add_keeps_generation(self):
+        item = self.listing.add('a/b.txt', size=1)
+        generation = self.listing.generation
+        self.assertTrue(self.listing.add('a/b.txt', size=1) is item)
+        self.listing.add('a/')
+        self.listing.add('a/b.txt')
+        self.assertEquals(self.listing.generation, generation)
+    
     def test_remove_nonexisting_returns_none(self):
         removed_a = self.listing.remove('a.txt')
         self.assertTrue(removed_a is None)
@@ -122,5 +182,169 @@ class TestPartialContainers(unittest.TestCase):
         pass
 
 
+class TestStreamedXML(unittest.TestCase):
+    def setUp(self):
+        listing = FileListing('mycid', '/')
+        listing.add('a/b/c/d.txt', size=1)
+        listing.add('a/b/e & "f".txt', size=2)
+        listing.add('i/j/k.txt', size=3)
+        listing.add('x/y/z/')
+        listing.add('x/w/', incomplete=True)
+        self.listing = listing
+    
+    def test_streamed_xml_matches_listing(self):
+        xml = ''.join(self.listing.iter_xml())
+        self.assertEquals(FileListing.from_string(xml), self.listing)
+    
+    def test_streamed_xml_matches_partial_listing(self):
+        for depth in (0, 1, 2, 3):
+            xml = ''.join(self.listing.iter_xml(None, depth))
+            self.assertEquals(FileListing.from_string(xml),
+                              self.listing.get_partial(None, depth))
+    
+    def test_streamed_xml_with_base(self):
+        xml = ''.join(self.listing.iter_xml('/a/', 1))
+        partial = FileListing.from_string(xml)
+        self.assertEquals(partial.base, '/a/')
+        self.assertEquals(partial.contents, {'b': Directory('b', True)})
+
+class TestCachedStatistics(unittest.TestCase):
+    def setUp(self):
+        listing = FileListing('mycid', '/')
+        listing.add('a/b/c.txt', size=1)
+        listing.add('a/b/d.txt', size=2)
+        listing.add('e/f.txt', size=4)
+        self.listing = listing
+    
+    def test_totals(self):
+        self.assertEquals(self.listing.total_size, 7)
+        self.assertEquals(self.listing.file_count, 3)
+        self.assertEquals(self.listing['a'].total_size, 3)
+    
+    def test_add_and_remove_invalidate_parent_chain(self):
+        digest = self.listing.digest
+        self.listing['e'].digest
+        self.listing.add('a/b/g.txt', size=8)
+        self.assertEquals(self.listing.total_size, 15)
+        self.assertEquals(self.listing['a']['b'].file_count, 3)
+        self.assertNotEquals(self.listing.digest, digest)
+        # Untouched directories keep their statistics.
+        self.assertTrue(self.listing['e']._stats is not None)
+        self.listing.remove('a/b/g.txt')
+        self.assertEquals(self.listing.total_size, 7)
+        self.assertEquals(self.listing.digest, digest)
+    
+    def test_attribute_changes_through_add_invalidate(self):
+        digest = self.listing.digest
+        self.listing.add('a/b/c.txt', size=16)
+        self.assertEquals(self.listing.total_size, 22)
+        self.listing.add('e/', incomplete=True)
+        self.listing.add('a/b/c.txt', size=1)
+        self.assertNotEquals(self.listing.digest, digest)
+    
+    def test_equal_listings_have_equal_digests(self):
+        other = FileListing.from_string(self.listing.serialize())
+        self.assertEquals(other.digest, self.listing.digest)
+        self.assertEquals(other['a']['b'].parent, other['a'])
+    
+    def test_deep_copy_is_detached(self):
+        copied = copy.deepcopy(self.listing['a'])
+        self.assertTrue(copied.parent is None)
+        self.assertTrue(copied['b'].parent is copied)
+        self.assertEquals(copied, self.listing['a'])
+
+class TestWalk(unittest.TestCase):
+    def setUp(self):
+        listing = FileListing('mycid', '/')
+        listing.add('a/b/c.TXT', size=1)
+        listing.add('a/b/d.mp3', size=20)
+        listing.add('a/sl\\/ash.txt', size=30)
+        listing.add('e/', incomplete=True)
+        self.listing = listing
+    
+    def test_walk_renders_paths(self):
+        paths = sorted(render_path(parents, item)
+                       for parents, item in self.listing.walk())
+        self.assertEquals(paths, [u'a/', u'a/b/', u'a/b/c.TXT',
+                                  u'a/b/d.mp3', u'a/sl\\/ash.txt', u'e/'])
+    
+    def test_walk_is_depth_first(self):
+        for parents, item in self.listing.walk():
+            if item.name == 'b':
+                break
+        self.assertEquals(parents, ('a',))
+    
+    def test_walk_depth(self):
+        names = sorted(item.name for parents, item in self.listing.walk(0))
+        self.assertEquals(names, ['a', 'e'])
+    
+    def test_walk_filters(self):
+        items = self.listing.walk(files_only=True, min_size=10)
+        self.assertEquals(sorted(item.name for parents, item in items),
+                          ['d.mp3', 'sl/ash.txt'])
+        items = self.listing.walk(files_only=True,
+                                  extensions=set(['txt']))
+        self.assertEquals(sorted(item.name for parents, item in items),
+                          ['c.TXT', 'sl/ash.txt'])
+    
+    def test_iter_paths(self):
+        paths = dict((item.name, path)
+                     for path, item in self.listing.iter_paths())
+        self.assertEquals(paths['c.TXT'], Path('/a/b/c.TXT'))
+        self.assertEquals(paths['b'], Path('/a/b/'))
+        paths = dict((item.name, path)
+                     for path, item in self.listing['a'].iter_paths('/x/'))
+        self.assertEquals(paths['d.mp3'], Path('/x/b/d.mp3'))
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        listing = FileListing('mycid', '/')
+        listing.add('a/b/c.txt', size=1)
+        listing.add('a/d.txt', size=2)
+        listing.add('e/f.txt', size=4)
+        self.listing = listing
+        self.snapshot = listing.snapshot()
+        self.original = FileListing.from_string(listing.serialize())
+    
+    def test_snapshot_shares_items(self):
+        self.assertTrue(self.snapshot['a'] is self.listing['a'])
+        self.assertEquals(self.snapshot.total_size, 7)
+    
+    def test_modifications_do_not_affect_snapshot(self):
+        self.listing.add('a/b/g.txt', size=8)
+        self.listing.remove('e/f.txt')
+        self.listing.add('a/d.txt', size=16)
+        self.listing.remove('a/b/c.txt')
+        self.listing.add('h.txt', size=32)
+        self.assertEquals(self.snapshot, self.original)
+        self.assertEquals(self.snapshot.total_size, 7)
+        self.assertEquals(self.listing.total_size, 56)
+        self.assertEquals(sorted(self.listing['a']['b'].contents),
+                          ['g.txt'])
+    
+    def test_only_modified_path_is_copied(self):
+        self.listing.add('a/b/g.txt', size=8)
+        self.assertFalse(self.listing['a'] is self.snapshot['a'])
+        self.assertFalse(self.listing['a']['b'] is self.snapshot['a']['b'])
+        self.assertTrue(self.listing['e'] is self.snapshot['e'])
+        self.assertTrue(self.listing['a']['b'].parent is self.listing['a'])
+        # Copied containers are modified in place from then on.
+        b = self.listing['a']['b']
+        self.listing.add('a/b/i.txt', size=64)
+        self.assertTrue(self.listing['a']['b'] is b)
+        self.assertEquals(self.listing.total_size, 79)
+    
+    def test_snapshot_can_be_modified(self):
+        self.snapshot.remove('a/')
+        self.assertEquals(self.listing, self.original)
+        self.assertEquals(self.snapshot.total_size, 4)
+    
+    def test_unshare(self):
+        item = self.listing.remove('a/')
+        item = self.listing.unshare(item)
+        item.name = 'moved'
+        self.assertEquals(self.snapshot['a'].name, 'a')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+import socket
+import unittest
+from libsheep import hub
+from libsheep.hub import Hub, Connection, BloomFilter
+from libsheep.utils import b32encode
+from libsheep.protocol import ProtocolError
+
+class FakeSocket(object):
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.written = ''
+        self.sends = 0
+    
+    def send(self, data):
+        self.sends += 1
+        data = str(data)[:self.limit]
+        self.written += data
+        return len(data)
+    
+    def sendmsg(self, buffers):
+        return self.send(''.join(buffers))
+
+class TestConnection(unittest.TestCase):
+    def test_flush_batches_writes(self):
+        sock = FakeSocket()
+        connection = Connection(sock)
+        for i in xrange(100):
+            connection.send('line %d\n' % (i,))
+        self.assertTrue(connection.flush())
+        self.assertEquals(sock.sends, 1)
+        self.assertEquals(sock.written.count('\n'), 100)
+        self.assertEquals(connection.queued_bytes, 0)
+    
+    def test_partial_writes(self):
+        sock = FakeSocket(limit=3)
+        connection = Connection(sock)
+        connection.send('abcde')
+        connection.send('fgh')
+        self.assertTrue(connection.flush())
+        self.assertEquals(sock.written, 'abcdefgh')
+    
+    def test_would_block(self):
+        sock = FakeSocket()
+        def send(data):
+            raise socket.error(hub.errno.EAGAIN, 'busy')
+        sock.send = send
+        connection = Connection(sock)
+        connection.send('abc')
+        self.assertFalse(connection.flush())
+        self.assertEquals(list(connection.queue), ['abc'])
+    
+    def test_socket(self):
+        a, b = socket.socketpair()
+        connection = Connection(a)
+        connection.send('BINF AAAA\n')
+        connection.send('BMSG AAAA hi\n')
+        connection.flush()
+        self.assertEquals(b.recv(100), 'BINF AAAA\nBMSG AAAA hi\n')
+        a.close()
+        b.close()
+
+class TestHub(unittest.TestCase):
+    def setUp(self):
+        self.hub = Hub()
+        self.sockets = {}
+        for sid in ('AAAA', 'BBBB', 'CCCC'):
+            self.join(sid, 'BINF %s IDcid%s NI%s\n' % (sid, sid, sid.lower()))
+    
+    def join(self, sid, line):
+        connection = Connection(FakeSocket())
+        self.sockets[sid] = connection.socket
+        return self.hub.join(sid, connection, line)
+    
+    def written(self, sid):
+        self.hub.flush()
+        written = self.sockets[sid].written
+        self.sockets[sid].written = ''
+        return written
+    
+    def test_join_sends_existing_infs(self):
+        self.assertEquals(self.written('CCCC'),
+                          'BINF AAAA IDcidAAAA NIaaaa\n'
+                          'BINF BBBB IDcidBBBB NIbbbb\n'
+                          'BINF CCCC IDcidCCCC NIcccc\n')
+        self.assertTrue(self.written('AAAA').endswith(
+            'BINF CCCC IDcidCCCC NIcccc\n'))
+    
+    def test_broadcast_shares_one_string(self):
+        for sid in self.sockets:
+            self.written(sid)
+        line = 'BMSG AAAA hello\n'
+        self.assertEquals(self.hub.receive('AAAA', line), 3)
+        queues = [user.connection.queue[0]
+                  for user in self.hub.users.itervalues()]
+        self.assertTrue(all(data is line for data in queues))
+    
+    def test_info_update_is_merged(self):
+        self.hub.receive('BBBB', 'BINF BBBB NIbob SS100\n')
+        self.assertEquals(self.hub.users['BBBB'].inf_line,
+                          'BINF BBBB IDcidBBBB NIbob SS100\n')
+        self.assertEquals(self.hub.receive('BBBB', 'BINF BBBB SS100\n'), 0)
+        self.hub.receive('BBBB', 'BINF BBBB SS\n')
+        self.assertEquals(self.hub.users['BBBB'].inf_line,
+                          'BINF BBBB IDcidBBBB NIbob\n')
+    
+    def test_direct_and_echo(self):
+        for sid in self.sockets:
+            self.written(sid)
+        self.assertEquals(self.hub.receive('AAAA', 'DMSG AAAA BBBB hi\n'), 1)
+        self.assertEquals(self.written('BBBB'), 'DMSG AAAA BBBB hi\n')
+        self.assertEquals(self.written('AAAA'), '')
+        self.assertEquals(self.hub.receive('AAAA', 'EMSG AAAA BBBB hi\n'), 2)
+        self.assertEquals(self.written('AAAA'), 'EMSG AAAA BBBB hi\n')
+    
+    def test_failed_connection_leaves(self):
+        def send(data):
+            raise socket.error(hub.errno.EPIPE, 'Broken pipe')
+        self.sockets['AAAA'].send = send
+        self.hub.flush()
+        self.assertFalse('AAAA' in self.hub)
+        for sid in ('BBBB', 'CCCC'):
+            written = self.sockets[sid].written
+            self.assertTrue('BINF CCCC IDcidCCCC NIcccc\n' in written)
+            self.assertTrue(written.endswith('IQUI AAAA\n'))
+    
+    def test_broadcast_encodes_unicode(self):
+        for sid in self.sockets:
+            self.written(sid)
+        self.assertEquals(self.hub.broadcast(u'IMSG caf\xe9\n'), 3)
+        self.assertEquals(self.written('AAAA'), 'IMSG caf\xc3\xa9\n')
+    
+    def test_spoofed_sender(self):
+        self.assertRaises(ProtocolError, self.hub.receive, 'AAAA',
+                          'BMSG BBBB hi\n')
+    
+    def test_leave(self):
+        self.hub.leave('AAAA')
+        self.assertFalse('AAAA' in self.hub)
+        self.assertTrue(self.written('BBBB').endswith('IQUI AAAA\n'))
+
+
+class TestFeatureRouting(unittest.TestCase):
+    def setUp(self):
+        self.hub = Hub()
+        for sid, features in (('AAAA', 'TCP4,UDP4'), ('BBBB', 'TCP4'),
+                              ('CCCC', 'TCP4,NAT0'), ('DDDD', '')):
+            line = 'BINF %s SU%s\n' % (sid, features)
+            self.hub.join(sid, Connection(FakeSocket()), line)
+    
+    def recipients(self, line):
+        for user in self.hub.users.itervalues():
+            user.connection.queue.clear()
+        self.hub.receive('AAAA', line)
+        return [user.sid for user in self.hub.users.itervalues()
+                if user.connection.queue]
+    
+    def test_required_and_excluded(self):
+        self.assertEquals(self.recipients('FSCH AAAA +TCP4-NAT0 ANx\n'),
+                          ['AAAA', 'BBBB'])
+        self.assertEquals(self.recipients('FSCH AAAA +TCP4+UDP4 ANx\n'),
+                          ['AAAA'])
+        self.assertEquals(self.recipients('FSCH AAAA -TCP4 ANx\n'),
+                          ['DDDD'])
+        self.assertEquals(self.recipients('FSCH AAAA +XXXX ANx\n'), [])
+    
+    def test_info_updates_change_features(self):
+        self.hub.receive('DDDD', 'BINF DDDD SUTCP4\n')
+        self.hub.receive('CCCC', 'BINF CCCC SUTCP4\n')
+        self.assertEquals(self.recipients('FSCH AAAA +TCP4-NAT0 ANx\n'),
+                          ['AAAA', 'BBBB', 'CCCC', 'DDDD'])
+        self.assertFalse('NAT0' in self.hub.features.bitmaps)
+    
+    def test_slots_are_reused(self):
+        slot = self.hub.users['BBBB'].slot
+        self.hub.leave('BBBB')
+        self.assertEquals(self.recipients('FSCH AAAA +TCP4 ANx\n'),
+                          ['AAAA', 'CCCC'])
+        user = self.hub.join('EEEE', Connection(FakeSocket()),
+                             'BINF EEEE SUUDP4\n')
+        self.assertEquals(user.slot, slot)
+        self.assertEquals(self.recipients('FSCH AAAA +UDP4 ANx\n'),
+                          ['AAAA', 'EEEE'])
+
+def make_bloom(tths, m=1024, k=8, h=24):
+    data = bytearray(m // 8)
+    for tth in tths:
+        for index, mask in BloomFilter.probes(tth, (m, k, h)):
+            data[index] |= mask
+    return str(data)
+
+class TestBloomRouting(unittest.TestCase):
+    def setUp(self):
+        self.hub = Hub()
+        for sid in ('AAAA', 'BBBB', 'CCCC', 'DDDD'):
+            self.hub.join(sid, Connection(FakeSocket()), 'BINF %s\n' % sid)
+        self.tth = 'T' * 24
+        self.hub.set_bloom('BBBB', make_bloom([self.tth]), 8, 24)
+        self.hub.set_bloom('CCCC', make_bloom(['U' * 24]), 8, 24)
+    
+    def recipients(self, line, sid='AAAA'):
+        for user in self.hub.users.itervalues():
+            user.connection.queue.clear()
+        self.hub.receive(sid, line)
+        return [user.sid for user in self.hub.users.itervalues()
+                if user.connection.queue]
+    
+    def test_bloom_filter(self):
+        bloom = BloomFilter(make_bloom([self.tth]), 8, 24)
+        self.assertTrue(bloom.may_contain(self.tth))
+        self.assertFalse(bloom.may_contain('U' * 24))
+        self.assertTrue(0 < bloom.false_positive_rate() < 1e-6)
+    
+    def test_tth_search_skips_users_without_match(self):
+        line = 'BSCH AAAA TR%s TOabc\n' % (b32encode(self.tth),)
+        self.assertEquals(self.recipients(line),
+                          ['AAAA', 'BBBB', 'DDDD'])
+        stats = self.hub.search_stats
+        self.assertEquals((stats.searches, stats.probed, stats.skipped,
+                           stats.matched), (1, 2, 1, 1))
+    
+    def test_name_search_goes_to_everyone(self):
+        self.assertEquals(len(self.recipients('BSCH AAAA ANfoo\n')), 4)
+    
+    def test_feature_search_is_also_filtered(self):
+        self.hub.receive('CCCC', 'BINF CCCC SUTCP4\n')
+        self.hub.receive('DDDD', 'BINF DDDD SUTCP4\n')
+        line = 'FSCH AAAA +TCP4 TR%s\n' % (b32encode(self.tth),)
+        self.assertEquals(self.recipients(line), ['DDDD'])
+    
+    def test_results_confirm_matches(self):
+        self.recipients('BSCH AAAA TR%s TOabc\n' % (b32encode(self.tth),))
+        stats = self.hub.search_stats
+        self.assertEquals(stats.observed_false_positive_rate(), 1.0)
+        self.hub.receive('BBBB', 'DRES BBBB AAAA FN/a SI1 TOabc\n')
+        self.assertEquals(stats.confirmed, 1)
+        self.assertEquals(stats.observed_false_positive_rate(), 0.0)
+    
+    def test_invalid_filter(self):
+        self.assertRaises(ProtocolError, self.hub.set_bloom, 'AAAA', '',
+                          8, 24)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import os
+import socket
+import shutil
+import tempfile
+import unittest
+from libsheep import metrics
+from libsheep.filelist import FileListing
+from libsheep.path import Path
+from libsheep.protocol import Message
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        metrics.enable()
+    
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+    
+    def test_disabled_metrics_record_nothing(self):
+        metrics.disable()
+        Message.decode('BINF AAAA')
+        self.assertEquals(metrics.messages_decoded.snapshot(), {})
+    
+    def test_message_decode(self):
+        Message.decode('BINF AAAA')
+        Message.decode('BINF BBBB')
+        Message.decode('HSUP ADBASE')
+        self.assertEquals(metrics.messages_decoded.snapshot(),
+                          {'INF': 2, 'SUP': 1})
+        latency = metrics.message_decode_seconds.snapshot()['INF']
+        self.assertEquals(latency['count'], 2)
+        self.assertEquals(latency['buckets'][-1], (float('inf'), 2))
+    
+    def test_listing_load_and_serialize(self):
+        listing = FileListing('mycid', '/')
+        listing.add('a/b.txt', size=1)
+        FileListing.from_string(listing.serialize())
+        self.assertEquals(metrics.listing_entries.snapshot(),
+                          {'load': 2, 'serialize': 2})
+        self.assertEquals(
+            metrics.listing_load_seconds.snapshot()[None]['count'], 1)
+    
+    def test_printable_cache(self):
+        Path(u'/\u2603/\u2603')
+        values = metrics.printable_cache.snapshot()
+        self.assertTrue(values['hit'] >= 1)
+        self.assertTrue('miss' in values)
+    
+    def test_histogram_buckets(self):
+        histogram = metrics.Histogram('test_seconds', "Test.",
+                                      buckets=(1, 10))
+        for value in (0.5, 5, 5, 50):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()[None]
+        self.assertEquals(snapshot['buckets'],
+                          [(1, 1), (10, 3), (float('inf'), 4)])
+        self.assertEquals(snapshot['sum'], 60.5)
+    
+    def test_prometheus_text(self):
+        Message.decode('BINF AAAA')
+        text = metrics.to_prometheus()
+        self.assertTrue('# TYPE libsheep_messages_decoded_total counter\n'
+                        in text)
+        self.assertTrue('libsheep_messages_decoded_total{command="INF"} 1\n'
+                        in text)
+        self.assertTrue('libsheep_message_decode_seconds_bucket'
+                        '{command="INF",le="+Inf"} 1\n' in text)
+    
+    def test_dump_and_serve(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'libsheep.prom')
+            metrics.dump(filename)
+            with open(filename) as f:
+                self.assertEquals(f.read(), metrics.to_prometheus())
+            server = metrics.MetricsServer(os.path.join(directory, 'sock'))
+            server.start()
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(server.address)
+            data = ''
+            while True:
+                chunk = client.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            client.close()
+            server.close()
+            self.assertEquals(data, metrics.to_prometheus())
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
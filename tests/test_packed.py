@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+from libsheep.filelist import FileListing
+from libsheep.packed import PackedListing, PackedDirectory, pack, write
+
+class TestPackedListing(unittest.TestCase):
+    def setUp(self):
+        listing = FileListing('mycid', '/', generator='test')
+        listing.add('music/b.mp3', size=2, tth='B' * 24)
+        listing.add('music/a.mp3', size=1, tth='A' * 24)
+        listing.add(u'music/\xfcber/c.flac', size=0)
+        listing.add('video/d.mkv')
+        listing.add('partial/', incomplete=True)
+        listing.add('e.txt', size=5)
+        self.listing = listing
+        self.packed = PackedListing(pack(listing))
+    
+    def test_header(self):
+        self.assertEquals(self.packed.client_id, 'mycid')
+        self.assertEquals(self.packed.base, '/')
+        self.assertEquals(self.packed.generator, 'test')
+        self.assertEquals(self.packed.directory_count, 5)
+        self.assertEquals(self.packed.file_count, 5)
+        self.assertEquals(self.packed.total_size, 8)
+    
+    def test_lookup(self):
+        item = self.packed.get('/music/b.mp3')
+        self.assertEquals((item.name, item.size, item.tth),
+                          ('b.mp3', 2, 'B' * 24))
+        self.assertEquals(self.packed.get(u'music/\xfcber/c.flac').size, 0)
+        self.assertEquals(self.packed.get('video/d.mkv').size, None)
+        self.assertTrue(self.packed.get('partial/').incomplete)
+        self.assertTrue(isinstance(self.packed.get('/music/'),
+                                   PackedDirectory))
+        self.assertEquals(self.packed.get('music/missing'), None)
+        self.assertEquals(self.packed.get('e.txt/'), None)
+    
+    def test_directory_iteration(self):
+        music = self.packed.get('/music/')
+        self.assertEquals([item.name for item in music],
+                          [u'\xfcber', 'a.mp3', 'b.mp3'])
+        self.assertEquals(music.total_size, 3)
+    
+    def test_round_trip(self):
+        self.assertEquals(self.packed.to_listing(), self.listing)
+    
+    def test_extra_attributes_round_trip(self):
+        listing = FileListing.from_string(
+            '<FileListing Version="1" CID="mycid" Base="/" Generator="x">'
+            '<File Name="a.txt" Size="1" TS="1234" X="\xc3\xbc" />'
+            '<File Name="b.txt" Size="2" />'
+            '<File Name="c.txt" Size="3" TS="1234" X="\xc3\xbc" />'
+            '</FileListing>')
+        packed = PackedListing(pack(listing))
+        self.assertEquals(packed.get('a.txt').extra,
+                          ((u'TS', u'1234'), (u'X', u'\xfc')))
+        self.assertEquals(packed.get('b.txt').extra, ())
+        self.assertEquals(packed.to_listing(), listing)
+    
+    def test_digest_does_not_depend_on_string_type(self):
+        listing = FileListing.from_string(
+            '<FileListing Version="1" CID="mycid" Base="/" Generator="x">'
+            '<Directory Name="d"><File Name="a.txt" Size="1" TS="1" />'
+            '</Directory></FileListing>')
+        restored = PackedListing(pack(listing)).to_listing()
+        self.assertEquals(restored.digest, listing.digest)
+        self.assertEquals(restored, listing)
+    
+    def test_mapped_file_and_xml_conversion(self):
+        # Files without a size can't be written as XML.
+        self.listing.remove('video/d.mkv')
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'files.bin')
+            write(self.listing, filename)
+            packed = PackedListing.open(filename)
+            self.assertEquals(packed.get('music/a.mp3').tth, 'A' * 24)
+            xml_filename = os.path.join(directory, 'files.xml')
+            packed.write_xml(xml_filename)
+            packed.close()
+            from_xml = PackedListing.from_xml(xml_filename)
+            self.assertEquals(from_xml.get('/e.txt').size, 5)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
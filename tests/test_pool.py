@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+import threading
+import unittest
+from libsheep.pool import ConnectionPool, PoolTimeout
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeConnection(object):
+    def __init__(self, cid):
+        self.cid = cid
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.connected = []
+        self.pool = ConnectionPool(self.connect, max_per_peer=2, max_total=3,
+                                   idle_timeout=60, clock=self.clock)
+
+    def connect(self, cid):
+        connection = FakeConnection(cid)
+        self.connected.append(connection)
+        return connection
+
+    def test_reuses_idle_connection(self):
+        first = self.pool.acquire('A')
+        self.pool.release('A', first)
+        self.assertTrue(self.pool.acquire('A') is first)
+        self.assertEquals(len(self.connected), 1)
+        self.assertEquals(len(self.pool), 1)
+
+    def test_per_peer_limit(self):
+        self.pool.acquire('A')
+        self.pool.acquire('A')
+        self.assertRaises(PoolTimeout, self.pool.acquire, 'A', 0)
+        self.pool.acquire('B')
+        self.assertEquals(len(self.pool), 3)
+
+    def test_waits_for_release(self):
+        first = self.pool.acquire('A')
+        self.pool.acquire('A')
+        timer = threading.Timer(0.05, self.pool.release, ('A', first))
+        timer.start()
+        self.assertTrue(self.pool.acquire('A') is first)
+        timer.join()
+
+    def test_total_limit_evicts_least_recently_used_idle(self):
+        a = self.pool.acquire('A')
+        b = self.pool.acquire('B')
+        c = self.pool.acquire('C')
+        self.pool.release('A', a)
+        self.clock.now += 1
+        self.pool.release('B', b)
+        d = self.pool.acquire('D')
+        self.assertTrue(a.closed)
+        self.assertFalse(b.closed)
+        self.assertEquals(len(self.pool), 3)
+        self.assertEquals(self.pool.idle, 1)
+
+    def test_idle_timeout(self):
+        a = self.pool.acquire('A')
+        self.pool.release('A', a)
+        self.clock.now += 61
+        self.pool.expire()
+        self.assertTrue(a.closed)
+        self.assertEquals(len(self.pool), 0)
+        self.assertFalse(self.pool.acquire('A') is a)
+
+    def test_context_manager_discards_on_error(self):
+        with self.pool.connection('A') as first:
+            pass
+        self.assertEquals(self.pool.idle, 1)
+        try:
+            with self.pool.connection('A') as second:
+                raise IOError("Connection reset")
+        except IOError:
+            pass
+        self.assertTrue(second is first)
+        self.assertTrue(first.closed)
+        self.assertEquals(len(self.pool), 0)
+
+    def test_failed_connect_frees_its_place(self):
+        def connect(cid):
+            raise IOError("Connection refused")
+        pool = ConnectionPool(connect, max_per_peer=1)
+        self.assertRaises(IOError, pool.acquire, 'A')
+        self.assertRaises(IOError, pool.acquire, 'A')
+        self.assertEquals(len(pool), 0)
+
+    def test_close(self):
+        a = self.pool.acquire('A')
+        b = self.pool.acquire('B')
+        self.pool.release('A', a)
+        self.pool.close()
+        self.assertTrue(a.closed)
+        self.assertFalse(b.closed)
+        self.assertEquals(len(self.pool), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import re
+import unittest
+from libsheep.filelist import FileListing
+from libsheep.query import Query, NameIndex
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        listing = FileListing('mycid', '/')
+        listing.add('music/a/One.FLAC', size=300)
+        listing.add('music/a/two.mp3', size=30)
+        listing.add('music/b/three.flac', size=200)
+        listing.add('music/b/flac/', incomplete=True)
+        listing.add('other/four.flac', size=400)
+        listing.add('other/sl\\/ash.flac.txt', size=1)
+        self.listing = listing
+    
+    def paths(self, *args, **kwargs):
+        return sorted(path for path, item
+                      in self.listing.query(*args, **kwargs))
+    
+    def test_glob(self):
+        self.assertEquals(self.paths('*.flac'), [
+            u'/music/a/One.FLAC', u'/music/b/three.flac',
+            u'/other/four.flac'])
+        self.assertEquals(self.paths('t?o.*'), [u'/music/a/two.mp3'])
+    
+    def test_glob_directories(self):
+        self.assertEquals(self.paths('flac', files_only=False),
+                          [u'/music/b/flac/'])
+    
+    def test_under(self):
+        self.assertEquals(self.paths('*.flac', under='/music/'),
+                          [u'/music/a/One.FLAC', u'/music/b/three.flac'])
+        self.assertEquals(self.paths('*.flac', under='music/b/'),
+                          [u'/music/b/three.flac'])
+        self.assertEquals(self.paths(under='/other/'),
+                          [u'/other/four.flac', u'/other/sl\\/ash.flac.txt'])
+        self.assertEquals(self.paths(under='/nothing/'), [])
+    
+    def test_regex(self):
+        self.assertEquals(self.paths(regex=r'fla'),
+                          [u'/music/b/three.flac', u'/other/four.flac',
+                           u'/other/sl\\/ash.flac.txt'])
+        self.assertEquals(self.paths(regex=re.compile(r'^t', re.M)),
+                          [u'/music/a/two.mp3', u'/music/b/three.flac'])
+    
+    def test_anchored_regex(self):
+        self.assertEquals(self.paths(regex=r'\.flac$'),
+                          [u'/music/b/three.flac', u'/other/four.flac'])
+        self.assertEquals(self.paths(regex=r'^t'),
+                          [u'/music/a/two.mp3', u'/music/b/three.flac'])
+        self.assertEquals(self.paths(regex=re.compile(r'^f'),
+                                     under='/other/'),
+                          [u'/other/four.flac'])
+        self.assertEquals(self.paths(regex=r'^\w+$', files_only=False),
+                          [u'/music/', u'/music/a/', u'/music/b/',
+                           u'/music/b/flac/', u'/other/'])
+    
+    def test_regex_does_not_span_names(self):
+        self.assertEquals(self.paths(regex=r'mp3\s+three'), [])
+        self.assertEquals(self.paths(regex=r'mp3\n?$'),
+                          [u'/music/a/two.mp3'])
+    
+    def test_size(self):
+        self.assertEquals(self.paths(min_size=200, max_size=300),
+                          [u'/music/a/One.FLAC', u'/music/b/three.flac'])
+        self.assertEquals(self.paths('*.flac', max_size=250),
+                          [u'/music/b/three.flac'])
+    
+    def test_index_is_rebuilt_when_listing_changes(self):
+        self.assertEquals(self.paths('*.ogg'), [])
+        index = self.listing._name_index
+        self.paths('*.ogg')
+        self.assertTrue(self.listing._name_index is index)
+        self.listing.add('other/five.ogg', size=5)
+        self.assertEquals(self.paths('*.ogg'), [u'/other/five.ogg'])
+    
+    def test_compiled_query_runs_on_many_listings(self):
+        query = Query('*.flac', under='/other/')
+        other = FileListing('othercid', '/')
+        other.add('other/six.flac', size=6)
+        results = [path for listing in (self.listing, other)
+                   for path, item in query.run(listing)]
+        self.assertEquals(results, [u'/other/four.flac',
+                                    u'/other/six.flac'])
+    
+    def test_index_ranges(self):
+        index = NameIndex(self.listing)
+        first, end = index.directory_range('/music/b/')
+        self.assertEquals(sorted(index.path(i) for i in xrange(first, end)),
+                          [u'/music/b/flac/', u'/music/b/three.flac'])
+
+
+if __name__ == '__main__':
+    unittest.main()
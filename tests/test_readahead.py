@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import os
+import tempfile
+import unittest
+from cStringIO import StringIO
+from libsheep import libc, readahead
+from libsheep.readahead import ReadAhead
+
+DATA = ''.join(chr(i % 251) for i in xrange(100000))
+
+class FailingFile(object):
+    def __init__(self):
+        self.reads = 0
+
+    def read(self, size):
+        self.reads += 1
+        if self.reads > 2:
+            raise IOError("Input/output error")
+        return 'x' * size
+
+class TestReadAhead(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.write(fd, DATA)
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_blocks_are_full_and_in_order(self):
+        with open(self.filename, 'rb') as f:
+            blocks = [str(block) for block in ReadAhead(f, 4096, 2)]
+        self.assertEquals(''.join(blocks), DATA)
+        self.assertEquals(set(map(len, blocks[:-1])), set([4096]))
+
+    def test_kernel_is_advised(self):
+        calls = []
+        fadvise = readahead.fadvise
+        readahead.fadvise = lambda *args: calls.append(args)
+        try:
+            with open(self.filename, 'rb') as f:
+                list(ReadAhead(f, 65536))
+        finally:
+            readahead.fadvise = fadvise
+        self.assertEquals(calls[0][1:],
+                          (0, 0, libc.POSIX_FADV_SEQUENTIAL))
+        self.assertEquals([call[1:] for call in calls[1:]],
+                          [(0, 65536, libc.POSIX_FADV_DONTNEED),
+                           (65536, 34464, libc.POSIX_FADV_DONTNEED)])
+
+    @unittest.skipIf(readahead.fadvise is None,
+                     "posix_fadvise is not available")
+    def test_fadvise(self):
+        with open(self.filename, 'rb') as f:
+            readahead.fadvise(f.fileno(), 0, 0, libc.POSIX_FADV_DONTNEED)
+        self.assertRaises(OSError, readahead.fadvise, -1, 0, 0,
+                          libc.POSIX_FADV_NORMAL)
+
+    def test_file_without_descriptor(self):
+        blocks = [str(block) for block in ReadAhead(StringIO(DATA), 30000)]
+        self.assertEquals(map(len, blocks), [30000, 30000, 30000, 10000])
+        self.assertEquals(''.join(blocks), DATA)
+
+    def test_reads_from_current_position(self):
+        with open(self.filename, 'rb') as f:
+            f.seek(99000)
+            self.assertEquals(''.join(map(str, ReadAhead(f))), DATA[99000:])
+
+    def test_errors_reach_the_consumer(self):
+        blocks = iter(ReadAhead(FailingFile(), 10))
+        self.assertEquals(str(next(blocks)), 'x' * 10)
+        self.assertRaises(IOError, list, blocks)
+
+    def test_rate_limit(self):
+        waits = []
+        with open(self.filename, 'rb') as f:
+            reader = ReadAhead(f, 10000, rate=10000, sleep=waits.append)
+            self.assertEquals(sum(len(block) for block in reader), len(DATA))
+        self.assertTrue(waits)
+
+    def test_consumer_may_stop_early(self):
+        with open(self.filename, 'rb') as f:
+            reader = ReadAhead(f, 1000, 2)
+            for block in reader:
+                first = str(block)
+                break
+            self.assertFalse(reader._reader.is_alive())
+        self.assertEquals(first, DATA[:1000])
+
+    def test_close(self):
+        with open(self.filename, 'rb') as f:
+            reader = ReadAhead(f, 1000, 1)
+            blocks = iter(reader)
+            next(blocks)
+            # The reader is now waiting for the only buffer to be freed.
+            reader.close()
+            self.assertFalse(reader._reader.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from libsheep import share
+from libsheep.share import Share, Scanner, ShareWatcher, tiger_tree_hash
+from libsheep.filelist import Container, NotFound
+try:
+    from libsheep.tth import tiger
+except ImportError:
+    # Hashing needs mhash.
+    tiger = None
+from libsheep.features.base import INF
+
+def fake_hasher(local_path):
+    with open(local_path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()[:24]
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.local_dir = tempfile.mkdtemp()
+        self.write('a.txt', 'a')
+        self.write('sub/b.txt', 'bb')
+        os.mkdir(os.path.join(self.local_dir, 'empty'))
+        self.share = Share()
+        self.share.add_root(self.local_dir, 'share')
+        self.scanner = Scanner(self.share, threads=2, hasher=fake_hasher)
+        self.hashed = []
+        def hasher(local_path):
+            self.hashed.append(os.path.basename(local_path))
+            return fake_hasher(local_path)
+        self.scanner.hasher = hasher
+    
+    def tearDown(self):
+        shutil.rmtree(self.local_dir)
+    
+    def local(self, name):
+        return os.path.join(self.local_dir, *name.split('/'))
+    
+    def write(self, name, data, mtime=1000000000):
+        local_path = self.local(name)
+        if not os.path.isdir(os.path.dirname(local_path)):
+            os.makedirs(os.path.dirname(local_path))
+        with open(local_path, 'wb') as f:
+            f.write(data)
+        os.utime(local_path, (mtime, mtime))
+    
+    def rehash(self):
+        self.scanner.scan()
+        return self.scanner.hash_pending()
+    
+    def test_scan_adds_files_with_hashes(self):
+        self.assertEquals(self.rehash(), 2)
+        listing = self.share.file_list
+        self.assertEquals(listing.get('/share/sub/b.txt').size, 2)
+        self.assertEquals(listing.get('/share/empty/').contents, {})
+        tth = fake_hasher(self.local('a.txt'))
+        self.assertEquals(self.share.by_tth[tth], '/share/a.txt')
+        info = INF('INF')
+        self.share.update_info(info)
+        self.assertEquals((info.share_size, info.shared_files), (3, 2))
+    
+    @unittest.skipIf(tiger is None, "mhash is not available")
+    def test_empty_file_is_hashed(self):
+        self.write('empty.txt', '')
+        self.scanner.hasher = tiger_tree_hash
+        self.assertEquals(self.rehash(), 3)
+        item = self.share.file_list.get('/share/empty.txt')
+        self.assertEquals((item.size, item.tth), (0, tiger('')))
+    
+    def test_unchanged_rescan_keeps_generation(self):
+        self.rehash()
+        generation = self.share.file_list.generation
+        self.assertEquals(self.rehash(), 0)
+        self.assertEquals(self.share.file_list.generation, generation)
+    
+    def test_changes_are_published_after_batch(self):
+        published = self.share.published
+        with self.share.batch():
+            self.rehash()
+            self.assertTrue(self.share.published is published)
+        self.assertEquals(published.get('/share/').contents, {})
+        self.assertEquals(self.share.published.get('/share/a.txt').size, 1)
+    
+    def test_hashing_copies_each_container_once(self):
+        for i in xrange(500):
+            self.write('many/%d.txt' % i, 'x')
+        self.scanner.scan()
+        copied = []
+        copy_for = Container._copy_for
+        def counting_copy_for(container, token):
+            copied.append(len(container.contents))
+            return copy_for(container, token)
+        Container._copy_for = counting_copy_for
+        try:
+            self.assertEquals(self.scanner.hash_pending(), 502)
+        finally:
+            Container._copy_for = copy_for
+        # Publishing after every file would copy `many` for each one.
+        self.assertTrue(sum(copied) < 500, sum(copied))
+        self.assertEquals(self.share.published.get('/share/many/').file_count,
+                          500)
+    
+    def test_long_rehash_is_published_periodically(self):
+        self.scanner.scan()
+        self.scanner.publish_interval = 1.0
+        self.scanner.clock = iter(xrange(100)).next
+        published = []
+        publish = self.share.publish
+        def recording_publish(force=False):
+            publish(force)
+            if force:
+                published.append(self.share.published.file_count)
+        self.share.publish = recording_publish
+        self.scanner.hash_pending()
+        self.assertEquals(published, [1, 2])
+    
+    def test_undecodable_names_are_skipped(self):
+        self.write('caf\xe9.txt', 'x')
+        os.mkdir(self.local('dir\xe9'))
+        self.assertEquals(self.rehash(), 2)
+        self.assertEquals(sorted(self.share.file_list.get('/share/').contents),
+                          ['a.txt', 'empty', 'sub'])
+        self.assertRaises(NotFound, self.share.shared_path,
+                          self.local('caf\xe9.txt'))
+    
+    def test_growing_file_is_deferred(self):
+        self.scanner.scan()
+        def hasher(local_path):
+            with open(local_path, 'ab') as f:
+                f.write('more')
+            return fake_hasher(local_path)
+        self.scanner.hasher = hasher
+        self.assertEquals(self.scanner.hash_pending(), 0)
+        self.assertEquals(self.scanner.pending.qsize(), 2)
+    
+    def test_watcher_events_are_published_together(self):
+        self.rehash()
+        # Bypasses pyinotify, which may not be installed.
+        watcher = ShareWatcher.__new__(ShareWatcher)
+        watcher.scanner = self.scanner
+        watcher.notifier = StubNotifier(share._EventHandler(self.scanner))
+        published = self.share.published
+        os.rename(self.local('sub'), self.local('moved'))
+        os.remove(self.local('a.txt'))
+        watcher.notifier.events = [
+            Event(share.IN_MOVED_FROM, self.local('sub'), cookie=1, dir=True),
+            Event(share.IN_MOVED_TO, self.local('moved'), cookie=1, dir=True),
+            Event(share.IN_DELETE, self.local('a.txt'))]
+        snapshots = []
+        snapshot = self.share.file_list.snapshot
+        def counting_snapshot():
+            snapshots.append(True)
+            return snapshot()
+        self.share.file_list.snapshot = counting_snapshot
+        self.assertTrue(watcher.process_events())
+        self.assertFalse(watcher.process_events())
+        self.assertEquals(len(snapshots), 1)
+        self.assertEquals(sorted(self.share.published.get('/share/').contents),
+                          ['empty', 'moved'])
+        self.assertEquals(sorted(published.get('/share/').contents),
+                          ['a.txt', 'empty', 'sub'])
+    
+    def test_rescan_only_hashes_changes(self):
+        self.rehash()
+        del self.hashed[:]
+        self.write('a.txt', 'changed')
+        self.write('sub/c.txt', 'c')
+        os.remove(self.local('sub/b.txt'))
+        shutil.rmtree(self.local('empty'))
+        self.rehash()
+        self.assertEquals(sorted(self.hashed), ['a.txt', 'c.txt'])
+        listing = self.share.file_list
+        self.assertEquals(listing.get('/share/a.txt').size, 7)
+        self.assertEquals(sorted(listing.get('/share/').contents),
+                          ['a.txt', 'sub'])
+        self.assertEquals(sorted(listing.get('/share/sub/').contents),
+                          ['c.txt'])
+        self.assertEquals(len(self.share.by_tth), 2)
+    
+    def test_move_does_not_rehash(self):
+        self.rehash()
+        del self.hashed[:]
+        os.rename(self.local('sub'), self.local('moved'))
+        self.scanner.moved(self.local('sub'), self.local('moved'))
+        self.scanner.hash_pending()
+        self.assertEquals(self.hashed, [])
+        item = self.share.file_list.get('/share/moved/b.txt')
+        self.assertEquals(self.share.by_tth[item.tth], '/share/moved/b.txt')
+        self.assertFalse('sub' in self.share.file_list.get('/share/'))
+    
+    def test_update_and_removed(self):
+        self.rehash()
+        self.write('new.txt', 'new')
+        self.assertEquals(self.scanner.update(self.local('new.txt')), 1)
+        self.assertEquals(self.scanner.update(self.local('a.txt')), 0)
+        self.scanner.hash_pending()
+        self.assertEquals(self.share.file_list.get('/share/new.txt').size, 3)
+        self.scanner.removed(self.local('new.txt'))
+        self.assertFalse('new.txt' in self.share.file_list.get('/share/'))
+
+class Event(object):
+    def __init__(self, mask, pathname, cookie=None, dir=False):
+        self.mask = mask
+        self.pathname = pathname
+        self.cookie = cookie
+        self.dir = dir
+
+class RecordingScanner(object):
+    def __init__(self):
+        self.calls = []
+    
+    def update(self, local_path):
+        self.calls.append(('update', local_path))
+    
+    def removed(self, local_path):
+        self.calls.append(('removed', local_path))
+    
+    def moved(self, old_local_path, new_local_path):
+        self.calls.append(('moved', old_local_path, new_local_path))
+
+class TestEventHandler(unittest.TestCase):
+    def setUp(self):
+        self.scanner = RecordingScanner()
+        self.handler = share._EventHandler(self.scanner)
+    
+    def test_moves_are_paired_by_cookie(self):
+        self.handler(Event(share.IN_MOVED_FROM, '/a/x', cookie=1))
+        self.handler(Event(share.IN_MOVED_TO, '/a/y', cookie=1))
+        self.assertEquals(self.scanner.calls, [('moved', '/a/x', '/a/y')])
+    
+    def test_unpaired_moves(self):
+        self.handler(Event(share.IN_MOVED_FROM, '/a/x', cookie=1))
+        self.handler(Event(share.IN_CLOSE_WRITE, '/a/z'))
+        self.handler(Event(share.IN_MOVED_TO, '/a/y', cookie=2))
+        self.assertEquals(self.scanner.calls, [('removed', '/a/x'),
+                                               ('update', '/a/z'),
+                                               ('update', '/a/y')])
+    
+    def test_other_events(self):
+        self.handler(Event(share.IN_DELETE, '/a/x'))
+        self.handler(Event(share.IN_CREATE, '/a/file'))
+        self.handler(Event(share.IN_CREATE, '/a/dir', dir=True))
+        self.assertEquals(self.scanner.calls, [('removed', '/a/x'),
+                                               ('update', '/a/dir')])
+    
+    def test_events_outside_share_are_ignored(self):
+        scanner = Scanner(Share(), hasher=fake_hasher)
+        handler = share._EventHandler(scanner)
+        handler(Event(share.IN_CLOSE_WRITE, '/not/shared'))
+        handler(Event(share.IN_DELETE, '/not/caf\xe9'))
+        self.assertEquals(scanner.pending.qsize(), 0)
+
+class StubNotifier(object):
+    def __init__(self, handler):
+        self.handler = handler
+        self.events = []
+    
+    def check_events(self, timeout):
+        return bool(self.events)
+    
+    def read_events(self):
+        pass
+    
+    def process_events(self):
+        while self.events:
+            self.handler(self.events.pop(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
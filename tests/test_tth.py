@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+import os
+import random
+import tempfile
+import unittest
+try:
+    from libsheep.tth import TigerTreeHash, IncrementalTreeHash
+except ImportError:
+    # Hashing needs mhash.
+    TigerTreeHash = None
+
+@unittest.skipIf(TigerTreeHash is None, "mhash is not available")
+class TestIncrementalTreeHash(unittest.TestCase):
+    def test_matches_full_tree_for_any_segment_order(self):
+        random.seed(0)
+        for size in (1, 1024, 1025, 3000, 7 * 1024 + 3, 100000):
+            data = os.urandom(size)
+            expected = str(TigerTreeHash(data).root)
+            cuts = sorted(set([0, size] + [random.randrange(size)
+                                           for i in xrange(20)]))
+            segments = zip(cuts, cuts[1:])
+            random.shuffle(segments)
+            hasher = IncrementalTreeHash(size)
+            for start, end in segments:
+                self.assertFalse(hasher.complete)
+                hasher.update(start, data[start:end])
+            self.assertEquals(hasher.root, expected)
+            self.assertEquals(len(hasher.leaves), (size + 1023) // 1024)
+
+    def test_overlapping_and_repeated_segments(self):
+        data = os.urandom(5000)
+        expected = str(TigerTreeHash(data).root)
+        hasher = IncrementalTreeHash(len(data))
+        for start, end in [(0, 600), (300, 900), (1500, 2500), (1024, 1600),
+                           (2048, 5000), (1024, 2048), (300, 900)]:
+            hasher.update(start, data[start:end])
+        self.assertFalse(hasher.complete)
+        hasher.update(900, data[900:1100])
+        self.assertEquals(hasher.root, expected)
+        hasher.update(0, data[:2048])
+        self.assertEquals(hasher.root, expected)
+
+    def test_file_matches_string(self):
+        data = os.urandom(3 * 1024 * 1024 + 5)
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.seek(0)
+            self.assertEquals(str(TigerTreeHash(f).root),
+                              str(TigerTreeHash(data).root))
+
+    def test_segment_outside_file(self):
+        hasher = IncrementalTreeHash(10)
+        self.assertRaises(ValueError, hasher.update, 5, 'x' * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+import os
+import bz2
+import shutil
+import socket
+import tempfile
+import unittest
+from libsheep.features.base import GET, INF
+from libsheep.share import Share
+from libsheep.bandwidth import Scheduler
+from libsheep import upload
+from libsheep.upload import UploadServer
+from libsheep.utils import b32encode
+from libsheep.compression import decompress_stream
+from libsheep.filelist import FileListing, Directory
+
+DATA = ''.join(chr(i % 251) for i in xrange(20000))
+TEXT = 'All work and no play makes Jack a dull boy.\n' * 1000
+TTH = 'T' * 24
+
+def make_get(type, identifier, start_pos, bytes):
+    get = GET('GET')
+    get.type = type
+    get.identifier = identifier
+    get.start_pos = start_pos
+    get.bytes = bytes
+    return get
+
+class TestUploadServer(unittest.TestCase):
+    def setUp(self):
+        self.local_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.local_dir, 'data.bin'), 'wb') as f:
+            f.write(DATA)
+        with open(os.path.join(self.local_dir, 'text.txt'), 'wb') as f:
+            f.write(TEXT)
+        self.share = Share()
+        self.share.add_root(self.local_dir, 'share')
+        self.share.add_file('/share/data.bin', len(DATA), TTH)
+        self.info = INF('INF')
+        self.info.slots = 1
+        self.server = UploadServer(self.share, self.info)
+        self.client, self.peer = socket.socketpair()
+        self.client.settimeout(5)
+
+    def tearDown(self):
+        self.client.close()
+        self.peer.close()
+        shutil.rmtree(self.local_dir)
+
+    def receive(self, count):
+        data = ''
+        while len(data) < count:
+            chunk = self.client.recv(count - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def receive_line(self):
+        line = ''
+        while not line.endswith('\n'):
+            line += self.client.recv(1)
+        return line
+
+    def test_get_by_tth_sends_header_and_range(self):
+        identifier = 'TTH/' + b32encode(TTH)
+        sent = self.server.handle_get(self.peer,
+                                      make_get('file', identifier, 100, 5000))
+        self.assertTrue(sent)
+        self.assertEquals(self.receive_line(),
+                          'CSND file %s 100 5000\n' % (identifier,))
+        self.assertEquals(self.receive(5000), DATA[100:5100])
+
+    def test_get_by_path_to_end_of_file(self):
+        get = make_get('file', '/share/data.bin', 19000, -1)
+        self.assertTrue(self.server.handle_get(self.peer, get))
+        self.assertEquals(self.receive_line(),
+                          'CSND file /share/data.bin 19000 1000\n')
+        self.assertEquals(self.receive(1000), DATA[19000:])
+
+    def test_mmap_write_handles_unaligned_windows(self):
+        self.server.MAP_WINDOW = 1
+        with open(os.path.join(self.local_dir, 'data.bin'), 'rb') as source:
+            self.server._mmap_write(self.peer, source, 5000, 15000)
+        self.assertEquals(self.receive(15000), DATA[5000:])
+
+    @unittest.skipIf(upload.sendfile is None, "sendfile is not available")
+    def test_sendfile(self):
+        with open(os.path.join(self.local_dir, 'data.bin'), 'rb') as source:
+            self.assertEquals(
+                self.server._sendfile(self.peer, source, 5000, 15000), 15000)
+            self.assertRaises(OSError, upload.sendfile, -1, source.fileno(),
+                              0, 1)
+        self.assertEquals(self.receive(15000), DATA[5000:])
+
+    def test_compressed_get_sends_zlib_stream(self):
+        get = make_get('file', '/share/text.txt', 0, -1)
+        get.compressed = True
+        self.share.add_file('/share/text.txt', len(TEXT))
+        self.assertTrue(self.server.handle_get(self.peer, get))
+        self.peer.close()
+        self.assertEquals(self.receive_line(),
+                          'CSND file /share/text.txt 0 %d ZL1\n' % len(TEXT))
+        compressed = self.receive(len(TEXT))
+        self.assertTrue(len(compressed) < len(TEXT) / 10)
+        self.assertEquals(''.join(decompress_stream([compressed])), TEXT)
+
+    def test_compressed_get_skips_incompressible_data(self):
+        get = make_get('file', '/share/data.bin', 0, 100)
+        get.compressed = True
+        self.server.handle_get(self.peer, get)
+        self.assertEquals(self.receive_line(),
+                          'CSND file /share/data.bin 0 100\n')
+
+    def test_get_list_sends_one_level(self):
+        self.share.add_file('/share/sub/deep.txt', 5)
+        get = make_get('list', '/share/', 0, -1)
+        self.assertTrue(self.server.handle_get(self.peer, get))
+        header = self.receive_line().split()
+        self.assertEquals(header[:4], ['CSND', 'list', '/share/', '0'])
+        listing = FileListing.from_string(self.receive(int(header[4])))
+        self.assertEquals(listing.base, '/share/')
+        self.assertEquals(listing['data.bin'].size, len(DATA))
+        self.assertEquals(listing['sub'], Directory('sub', True))
+
+    def test_get_list_recursive_is_cached_until_share_changes(self):
+        get = make_get('list', '/', 0, -1)
+        get.recursive = True
+        self.server.handle_get(self.peer, get)
+        data, size = self.server.list_cache.get('/', -1)
+        self.assertTrue(self.server.list_cache.get('/', -1)[0] is data)
+        listing = FileListing.from_string(data)
+        self.assertEquals(sorted(listing['share'].contents),
+                          ['data.bin'])
+        self.share.add_file('/share/new.txt', 1)
+        self.assertFalse(self.server.list_cache.get('/', -1)[0] is data)
+
+    def test_full_list_is_cached_per_generation(self):
+        get = make_get('file', 'files.xml.bz2', 0, -1)
+        self.assertTrue(self.server.handle_get(self.peer, get))
+        header = self.receive_line().split()
+        self.assertEquals(header[:4],
+                          ['CSND', 'file', 'files.xml.bz2', '0'])
+        data = self.receive(int(header[4]))
+        listing = FileListing.from_string(bz2.decompress(data))
+        self.assertEquals(sorted(listing['share'].contents), ['data.bin'])
+        entry = self.server.full_list_cache.get()
+        self.assertEquals(entry[1], data)
+        self.assertTrue(self.server.full_list_cache.get() is entry)
+        self.share.add_file('/share/new.txt', 1)
+        self.assertTrue(self.server.full_list_cache.get()[0] > entry[0])
+
+    def test_list_caches_only_read_published_listing(self):
+        token = self.share.file_list._token
+        self.server.list_cache.get('/', -1)
+        self.server.full_list_cache.get()
+        self.assertTrue(self.share.file_list._token is token)
+        with self.share.batch():
+            self.share.add_file('/share/new.txt', 1)
+            data = self.server.list_cache.get('/share/', 1)[0]
+            self.assertFalse('new.txt' in data)
+        data = self.server.list_cache.get('/share/', 1)[0]
+        self.assertTrue('new.txt' in data)
+
+    def test_full_list_range(self):
+        data = self.server.full_list_cache.get()[1]
+        get = make_get('file', 'files.xml.bz2', 10, 20)
+        self.assertTrue(self.server.handle_get(self.peer, get))
+        self.assertEquals(self.receive_line(),
+                          'CSND file files.xml.bz2 10 20\n')
+        self.assertEquals(self.receive(20), data[10:30])
+
+    def test_get_list_of_missing_directory(self):
+        get = make_get('list', '/nothing/', 0, -1)
+        self.assertFalse(self.server.handle_get(self.peer, get))
+        self.assertEquals(self.receive_line()[:9], 'CSTA 151 ')
+
+    def test_unknown_tth_is_not_available(self):
+        identifier = 'TTH/' + b32encode('X' * 24)
+        get = make_get('file', identifier, 0, -1)
+        self.assertFalse(self.server.handle_get(self.peer, get))
+        self.assertEquals(self.receive_line(),
+                          'CSTA 151 File\\sNot\\sAvailable\n')
+
+    def test_range_beyond_end_is_not_available(self):
+        get = make_get('file', '/share/data.bin', 19000, 2000)
+        self.assertFalse(self.server.handle_get(self.peer, get))
+        self.assertEquals(self.receive_line()[:9], 'CSTA 152 ')
+
+    def test_start_beyond_end_is_not_available(self):
+        get = make_get('file', '/share/data.bin', 30000, -1)
+        self.assertEquals(self.server.get_range(get, len(DATA)), None)
+        self.assertFalse(self.server.handle_get(self.peer, get))
+        self.assertEquals(self.receive_line()[:9], 'CSTA 152 ')
+
+    def test_slots_full(self):
+        self.assertTrue(self.server.acquire_slot())
+        get = make_get('file', '/share/data.bin', 0, 10)
+        self.assertFalse(self.server.handle_get(self.peer, get))
+        self.assertEquals(self.receive_line(), 'CSTA 153 Slots\\sfull\n')
+        self.server.release_slot()
+        self.assertTrue(self.server.handle_get(self.peer, get))
+        self.assertEquals(self.server.active, 0)
+
+    def test_scheduler_throttles_and_grants_auto_slots(self):
+        waits = []
+        scheduler = Scheduler(sleep=waits.append, quantum=4096)
+        scheduler.directions['upload'].set_rate(8192)
+        self.info.auto_slot_speed = 1 << 30
+        self.info.auto_slot_max = 2
+        server = UploadServer(self.share, self.info, scheduler)
+        self.assertTrue(server.acquire_slot())
+        get = make_get('file', '/share/data.bin', 0, -1)
+        self.assertTrue(server.handle_get(self.peer, get))
+        self.receive_line()
+        self.assertEquals(self.receive(len(DATA)), DATA)
+        # 20000 bytes at 8192 bytes per second, after a one second burst;
+        # the sleeps are skipped, so the last wait covers the whole debt.
+        self.assertTrue(1.0 < max(waits) < 1.5)
+        self.assertTrue(server.acquire_slot())
+        self.assertFalse(server.acquire_slot())
+
+
+if __name__ == '__main__':
+    unittest.main()